@@ -1,47 +1,95 @@
+import click
 from flask import Flask, redirect
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
 
-from backend.auth import auth_bp
-from backend.dashboard import dashboard_bp
-from backend.portfolio import portfolio_bp
-from backend.trade import trade_bp
-
 import os
 import json
-import firebase_admin
-from firebase_admin import credentials, firestore
+import time
+from datetime import timedelta
+
+from backend import firebase, metrics
+from backend.lazy import timed_import, import_report_command
+
+# (module, blueprint attribute), imported and timed by create_app
+BLUEPRINTS = [
+    ("backend.auth", "auth_bp"),
+    ("backend.dashboard", "dashboard_bp"),
+    ("backend.portfolio", "portfolio_bp"),
+    ("backend.trade", "trade_bp"),
+]
+
+
+def start_services():
+    """
+    Start this process's background services: the order trigger engine, the
+    leaderboard syncer (which loads or rebuilds the board) and the journal
+    flusher.
+    """
+    timed_import("backend.orders").ensure_engine()
+    timed_import("backend.leaderboard").ensure_syncer()
+    journal = timed_import("backend.journal")
+    if journal.enabled():
+        # Also replays journals left by dead processes, so their orders don't wait for a new one
+        journal.ensure_flusher()
+
+
+def create_app():
+    """
+    Build the Flask app. Firebase is only configured here; the Admin SDK,
+    the Firestore client (one per worker process) and pandas are loaded on
+    first use, so gunicorn workers boot without paying for them.
+
+    Serving processes start the background services here, so resting orders
+    trigger and journaled orders flush from startup. Each gunicorn worker
+    imports the app itself (don't --preload: threads don't survive the
+    fork). Flask CLI commands load the app inside a click context and skip
+    them.
+    """
+    started = time.perf_counter()
+
+    raw = os.environ.get("FIREBASE_CONFIG")
+    if not raw:
+        raise RuntimeError("Missing FIREBASE_CONFIG environment variable.")
 
+    try:
+        firebase.configure(json.loads(raw))
+    except json.JSONDecodeError as e:
+        raise RuntimeError("FIREBASE_CONFIG is not valid JSON") from e
 
-raw = os.environ.get("FIREBASE_CONFIG")
-if not raw:
-    raise RuntimeError("Missing FIREBASE_CONFIG environment variable.")
+    app = Flask(__name__)
+    CORS(app)
+    metrics.init_app(app)
 
-try:
-    firebase_config = json.loads(raw)
-except json.JSONDecodeError as e:
-    raise RuntimeError("FIREBASE_CONFIG is not valid JSON") from e
+    @app.route("/")
+    def home():
+        return redirect("/auth/login")
 
-cred = credentials.Certificate(firebase_config)
-firebase_admin.initialize_app(cred)
+    # App sessions are the request identity (backend.sessions), so the signing
+    # key must be private to this deployment
+    jwt_secret = os.environ.get("JWT_SECRET_KEY")
+    if not jwt_secret:
+        raise RuntimeError("Missing JWT_SECRET_KEY environment variable.")
+    app.secret_key = os.environ.get("SECRET_KEY") or jwt_secret
+    app.config["JWT_SECRET_KEY"] = jwt_secret
+    # Sessions issued by /auth/login; same lifetime as the Firebase ID token they replace
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(minutes=int(os.environ.get("SESSION_MINUTES", 60)))
 
+    JWTManager(app)
 
-db = firestore.client()
+    for module_name, attr in BLUEPRINTS:
+        app.register_blueprint(getattr(timed_import(module_name), attr))
 
-app = Flask(__name__)
-CORS(app)
+    app.cli.add_command(timed_import("backend.positions").backfill_positions_command)
+    app.cli.add_command(timed_import("backend.portfolio").backfill_timestamps_command)
+    app.cli.add_command(timed_import("backend.leaderboard").rebuild_command)
+    app.cli.add_command(import_report_command)
 
-@app.route("/")
-def home():
-    print("Redirecting to /auth/login")
-    return redirect("/auth/login")
+    if click.get_current_context(silent=True) is None:
+        start_services()
 
-app.secret_key = "your-secret-key"
-app.config["JWT_SECRET_KEY"] = "your-jwt-secret-key"
+    app.logger.info("App created in %.1f ms", (time.perf_counter() - started) * 1000)
+    return app
 
-jwt = JWTManager(app)
 
-app.register_blueprint(auth_bp)
-app.register_blueprint(dashboard_bp)
-app.register_blueprint(portfolio_bp)
-app.register_blueprint(trade_bp)
+app = create_app()
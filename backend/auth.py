@@ -2,12 +2,9 @@ from flask import Blueprint, request, jsonify, render_template, flash
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 import datetime
-import firebase_admin
-from firebase_admin import credentials, auth, firestore 
+from backend.firebase import get_db
+from backend.sessions import InvalidIdToken, issue_session, verify_id_token
 
-def get_db():
-    return firestore.client()
-    
 auth_bp = Blueprint("auth", __name__, url_prefix="/auth")
 
 @auth_bp.route("/register", methods=["GET", "POST"])
@@ -19,7 +16,7 @@ def register():
     id_token = data.get("idToken")
 
     try:
-        decoded_token = auth.verify_id_token(id_token)
+        decoded_token = verify_id_token(id_token)
         uid = decoded_token["uid"]
         name = data.get("name")
         email = data.get("email")
@@ -28,11 +25,14 @@ def register():
             'name': name,
             'email': email,
             "balance": 10000,
+            "startingBalance": 10000,
             "profit": 0,
             "loss": 0,
             "stocks_buy": None,
             "stocks_sell": None,
-            "price": 0
+            "price": 0,
+            "positions": {},
+            "tradeSeq": 0
         })
 
         return jsonify({"message": "User profile saved"}), 201
@@ -45,16 +45,21 @@ def login():
     if request.method == "GET":
         return render_template("login.html")
     
-    id_token=request.json["idToken"]
+    id_token = request.json.get("idToken")
     try:
-        import time
-        time.sleep(2)  # Add a short delay
-        decoded_token = auth.verify_id_token(id_token, check_revoked=False)
-        uid = decoded_token['uid']
-        user = auth.get_user(uid)
-        return jsonify({"uid": uid, "name": user.display_name})
-    except Exception as e:
+        decoded_token = verify_id_token(id_token)
+    except InvalidIdToken as e:
         return jsonify({"error": str(e)}), 401
+    except Exception as e:
+        return jsonify({"error": str(e)}), 503
+
+    uid = decoded_token['uid']
+    # The display name is in the token; only users without one cost a read
+    name = decoded_token.get("name")
+    if name is None:
+        doc = get_db().collection('users').document(uid).get()
+        name = (doc.to_dict() or {}).get("name") if doc.exists else None
+    return jsonify({"uid": uid, "name": name, "token": issue_session(uid, name)})
 
     
 
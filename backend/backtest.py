@@ -0,0 +1,302 @@
+"""
+Strategy backtests over the stored daily bars (backend.bars, the source of
+/api/stock-data).
+
+Strategies are long/flat rules evaluated on closing prices:
+
+    buy_hold                        hold from the first bar of the range
+    sma_cross   fast, slow          long while SMA(fast) > SMA(slow)
+    rsi         period, lower, upper  enter when RSI < lower, exit when RSI > upper
+
+The SMA and RSI lines come from backend.indicators (the same cached series
+/api/indicators serves), computed over each symbol's whole stored history
+and cut at the end date; every value only depends on earlier bars. Signals
+are then computed for every bar at once with NumPy. A signal seen at one
+close is filled at the next close (buy_hold fills on the first bar). Fills
+follow the same rules as market orders in update_balance/update_sell: the
+close stands in for the live price, no commission, fractional quantities
+(to 6 decimals, like positions), never spend more cash than the sleeve has,
+never sell more than it holds. Each symbol trades its own equal share of
+the starting cash; the portfolio curve is their sum.
+
+Any strategy parameter may be given as a list; every combination is run
+(a sweep). Large sweeps are spread over a process pool, one (symbol,
+parameters) job at a time, as the simulations are CPU-bound.
+"""
+import os
+import math
+import logging
+import itertools
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from backend import fanout, indicators
+from backend.bars import load
+from backend.lazy import lazy
+
+log = logging.getLogger(__name__)
+
+pd = lazy("pandas")
+
+BACKTEST_WORKERS = int(os.environ.get("BACKTEST_WORKERS", os.cpu_count() or 1))
+# Below this many bars simulated in total, jobs run inline: shipping them to a
+# process costs more than simulating them
+BACKTEST_MIN_POOL_BARS = int(os.environ.get("BACKTEST_MIN_POOL_BARS", 500_000))
+BACKTEST_MAX_SYMBOLS = 20
+BACKTEST_MAX_RUNS = 100      # parameter combinations per request
+TRADING_DAYS = 252
+
+STRATEGIES = {
+    "buy_hold": {},
+    "sma_cross": {"fast": 20, "slow": 50},
+    "rsi": {"period": 14, "lower": 30, "upper": 70},
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class BacktestError(ValueError):
+    pass
+
+
+# ---- signals ----
+def lines(symbol, bars, tz, name, params):
+    """{line: values} the strategy's signal reads, from backend.indicators, for all of `bars`."""
+    def series(indicator, *args):
+        return indicators.series(symbol, "1d", indicator, args, bars=bars, tz=tz)[indicator]
+    if name == "sma_cross":
+        return {"fast": series("sma", int(params["fast"])), "slow": series("sma", int(params["slow"]))}
+    if name == "rsi":
+        return {"rsi": series("rsi", int(params["period"]))}
+    return {}
+
+
+def _hold_between(enter, leave):
+    """1 from each bar where `enter` is true until the next bar where `leave` is, else 0."""
+    state = np.where(enter, 1.0, np.where(leave, 0.0, np.nan))
+    last = np.maximum.accumulate(np.where(np.isnan(state), -1, np.arange(len(state))))
+    return np.where(last >= 0, state[np.maximum(last, 0)], 0.0)
+
+
+def signals(name, close, params, lines):
+    """Target position (0 or 1) per bar, decided at that bar's close."""
+    if name == "buy_hold":
+        return np.ones(len(close))
+    if name == "sma_cross":
+        with np.errstate(invalid="ignore"):
+            return (lines["fast"] > lines["slow"]).astype(float)
+    if name == "rsi":
+        rsi = lines["rsi"]
+        with np.errstate(invalid="ignore"):
+            return _hold_between(rsi < params["lower"], rsi > params["upper"])
+    raise BacktestError(f"Unknown strategy {name}")
+
+
+# ---- simulation ----
+def simulate(close, target, cash):
+    """
+    Long/flat sleeve trading at the close, fractional shares to 6 decimals.
+    Returns (equity per bar, trades) where trades are (entry bar, exit bar
+    or None, quantity).
+    The bar arrays are handled at once; only the per-trade quantities are
+    computed in order, as each depends on the cash the previous trade left.
+    """
+    change = np.diff(target, prepend=0.0)
+    entries = np.flatnonzero(change > 0)
+    exits = np.flatnonzero(change < 0)
+
+    cash_delta = np.zeros(len(close))
+    share_delta = np.zeros(len(close))
+    trades = []
+    for k, i in enumerate(entries):
+        quantity = math.floor(cash / close[i] * 1e6) / 1e6
+        j = exits[k] if k < len(exits) else None
+        if quantity <= 0:
+            continue
+        cash -= quantity * close[i]
+        cash_delta[i] -= quantity * close[i]
+        share_delta[i] += quantity
+        if j is not None:
+            cash += quantity * close[j]
+            cash_delta[j] += quantity * close[j]
+            share_delta[j] -= quantity
+        trades.append((int(i), None if j is None else int(j), quantity))
+
+    equity = (cash - cash_delta.sum()) + np.cumsum(cash_delta) + np.cumsum(share_delta) * close
+    return equity, trades
+
+
+def stats(t, equity, trades=None, close=None):
+    start, end = float(equity[0]), float(equity[-1])
+    years = max((t[-1] - t[0]) / (365.25 * 86400), 1 / TRADING_DAYS)
+    returns = np.diff(equity) / equity[:-1] if len(equity) > 1 else np.zeros(0)
+    peak = np.maximum.accumulate(equity)
+    result = {
+        "startEquity": round(start, 2),
+        "endEquity": round(end, 2),
+        "totalReturnPct": round((end / start - 1) * 100, 4) if start else 0.0,
+        "cagrPct": round(((end / start) ** (1 / years) - 1) * 100, 4) if start and end > 0 else None,
+        "maxDrawdownPct": round(float(((equity - peak) / peak).min()) * 100, 4) if start else 0.0,
+        "sharpe": round(float(returns.mean() / returns.std() * math.sqrt(TRADING_DAYS)), 4)
+        if len(returns) > 1 and returns.std() > 0 else None,
+    }
+    if trades is not None:
+        closed = [(i, j) for i, j, _ in trades if j is not None]
+        wins = sum(1 for i, j in closed if close[j] > close[i])
+        held = sum((len(close) if j is None else j) - i for i, j, _ in trades)
+        result.update({
+            "trades": len(trades),
+            "winRatePct": round(wins / len(closed) * 100, 2) if closed else None,
+            "exposurePct": round(held / len(close) * 100, 2),
+        })
+    return result
+
+
+def _run_job(job):
+    """One (symbol, parameters) sleeve; runs in a pool process."""
+    t, close, first, name, params, cash, signal_lines = job
+    target = signals(name, close, params, signal_lines)
+    if name != "buy_hold":
+        target = np.roll(target, 1)   # decided at one close, filled at the next
+        target[0] = 0.0
+    target[:first] = 0.0              # indicator warm-up bars are never traded
+    equity, trades = simulate(close[first:], target[first:], cash)
+    return equity, trades, stats(t[first:], equity, trades, close[first:])
+
+
+# ---- pool ----
+def pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                import multiprocessing
+                # spawn, not fork: the worker process has threads and gRPC channels open
+                _pool = ProcessPoolExecutor(max_workers=BACKTEST_WORKERS,
+                                            mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _run_all(jobs):
+    total_bars = sum(len(job[1]) for job in jobs)
+    if len(jobs) < 2 or total_bars < BACKTEST_MIN_POOL_BARS or BACKTEST_WORKERS <= 1:
+        return [_run_job(job) for job in jobs]
+    return list(pool().map(_run_job, jobs, chunksize=max(1, len(jobs) // (BACKTEST_WORKERS * 4))))
+
+
+# ---- requests ----
+def _sweep(name, params):
+    defaults = STRATEGIES[name]
+    unknown = set(params) - set(defaults)
+    if unknown:
+        raise BacktestError(f"Unknown parameters for {name}: {', '.join(sorted(unknown))}")
+    grid = {k: params.get(k, v) for k, v in defaults.items()}
+    grid = {k: v if isinstance(v, list) else [v] for k, v in grid.items()}
+    for k, values in grid.items():
+        if not values or not all(isinstance(v, (int, float)) and not isinstance(v, bool) and v > 0 for v in values):
+            raise BacktestError(f"{k} must be a positive number or a list of them")
+    combos = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    if len(combos) > BACKTEST_MAX_RUNS:
+        raise BacktestError(f"At most {BACKTEST_MAX_RUNS} parameter combinations")
+    return combos
+
+
+def _to_epoch(value, name):
+    try:
+        return int(pd.Timestamp(value, tz="UTC").timestamp())
+    except (TypeError, ValueError):
+        raise BacktestError(f"{name} must be a date (YYYY-MM-DD)")
+
+
+def _daily(symbol):
+    """(daily bars, exchange tz) of `symbol` from the bar store, or None if it has none."""
+    try:
+        return load(symbol, "1d")
+    except Exception as e:
+        log.warning("Backtest bars unavailable for %s: %s", symbol, e)
+        return None
+
+
+def _combine(curves, cash):
+    """Sum sleeve equity curves over the union of their dates (a sleeve is cash before its first bar)."""
+    t = np.unique(np.concatenate([times for times, _ in curves]))
+    total = np.zeros(len(t))
+    for times, equity in curves:
+        idx = np.searchsorted(times, t, side="right") - 1
+        total += np.where(idx >= 0, equity[np.maximum(idx, 0)], cash)
+    return t, total
+
+
+def run(symbols, start, end, strategy, params=None, cash=10000.0):
+    """
+    Backtest `strategy` on daily bars of `symbols` between `start` and `end`.
+    Returns {"runs": [{params, stats, symbols}], "best", "equity", ...};
+    "equity" is the curve of the best run by total return.
+    """
+    symbols = list(dict.fromkeys(s.strip().upper() for s in symbols if s and s.strip()))
+    if not symbols or len(symbols) > BACKTEST_MAX_SYMBOLS:
+        raise BacktestError(f"Give between 1 and {BACKTEST_MAX_SYMBOLS} symbols")
+    if strategy not in STRATEGIES:
+        raise BacktestError("strategy must be one of: " + ", ".join(STRATEGIES))
+    if cash <= 0:
+        raise BacktestError("initialCash must be positive")
+    start_t, end_t = _to_epoch(start, "start"), _to_epoch(end, "end") + 86399
+    if start_t >= end_t:
+        raise BacktestError("start must be before end")
+    combos = _sweep(strategy, params or {})
+
+    # Bars for every symbol, loaded concurrently from the store
+    loaded = fanout.gather(*((_daily, symbol) for symbol in symbols))
+    series = {}
+    for symbol, found in zip(symbols, loaded):
+        if found is None or len(found[0]) == 0:
+            continue
+        bars, tz = found
+        stop = int(np.searchsorted(bars["t"], end_t, side="right"))   # bars[:stop] end by `end`
+        first = int(np.searchsorted(bars["t"], start_t, side="left"))
+        if first >= stop:
+            continue
+        series[symbol] = (bars, tz, stop, first)
+    if not series:
+        raise BacktestError("No bars in that range for any symbol")
+
+    sleeve = cash / len(series)
+    jobs = []
+    for combo in combos:
+        for symbol, (bars, tz, stop, first) in series.items():
+            signal_lines = {k: v[:stop] for k, v in lines(symbol, bars, tz, strategy, combo).items()}
+            jobs.append((np.array(bars["t"][:stop]), np.array(bars["close"][:stop]), first,
+                         strategy, combo, sleeve, signal_lines))
+    results = iter(_run_all(jobs))
+
+    runs, curves = [], []
+    for combo in combos:
+        per_symbol, sleeves = {}, []
+        for symbol, (bars, _, stop, first) in series.items():
+            t = bars["t"][:stop]
+            equity, _, sleeve_stats = next(results)
+            per_symbol[symbol] = sleeve_stats
+            sleeves.append((t[first:], equity))
+        t, equity = _combine(sleeves, sleeve)
+        curves.append((t, equity))
+        runs.append({"params": combo, "stats": stats(t, equity), "symbols": per_symbol})
+
+    best = max(range(len(runs)), key=lambda i: runs[i]["stats"]["totalReturnPct"])
+    t, equity = curves[best]
+    return {
+        "strategy": strategy,
+        "symbols": list(series),
+        "missing": [s for s in symbols if s not in series],
+        "start": pd.Timestamp(int(t[0]), unit="s").strftime("%Y-%m-%d"),
+        "end": pd.Timestamp(int(t[-1]), unit="s").strftime("%Y-%m-%d"),
+        "initialCash": cash,
+        "runs": runs,
+        "best": best,
+        "equity": {
+            "labels": pd.to_datetime(t, unit="s").strftime("%Y-%m-%d").tolist(),
+            "values": np.round(equity, 2).tolist(),
+        },
+    }
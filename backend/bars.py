@@ -0,0 +1,291 @@
+"""
+Local OHLC bar store backing /api/stock-data.
+
+Bars for each (symbol, interval) live in one flat file of fixed-size records
+(BAR_DTYPE) that is memory-mapped for reads, so a range query is a
+searchsorted plus a slice of the mapping and never copies the bars. A small
+JSON sidecar keeps the exchange timezone and the last refresh time.
+
+Refreshing only asks upstream for bars from the last stored timestamp on:
+the last (possibly still forming) bar is overwritten in place and newer bars
+are appended. Symbols with no file yet are filled with a cold fetch.
+
+Symbols come straight from query strings, so load() only accepts ticker-
+shaped strings (SYMBOL_PATTERN) and a cold fetch that returns no bars
+leaves nothing on disk; the miss is remembered in memory for the
+interval's refresh time instead. Open memmaps are kept for at most
+BAR_MAX_MAPS files.
+"""
+import os
+import re
+import json
+import time
+import fcntl
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import numpy as np
+
+from backend.lazy import lazy
+from backend.market_data import get_provider
+
+pd = lazy("pandas")
+
+log = logging.getLogger(__name__)
+
+BAR_STORE_DIR = os.environ.get("BAR_STORE_DIR", os.path.join(".cache", "bars"))
+
+BAR_DTYPE = np.dtype([
+    ("t", "<i8"),        # bar open, epoch seconds (UTC)
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+])
+
+# How long stored bars are served before asking upstream for newer ones
+REFRESH_AFTER = {"5m": 60, "15m": 300, "1d": 3600, "1wk": 86400}
+# History fetched for a symbol we have never seen (covers every period mapped to the
+# interval; daily goes back further for backend.backtest)
+COLD_PERIOD = {"5m": "5d", "15m": "1mo", "1d": "5y", "1wk": "2y"}
+# Yahoo only serves intraday bars this far back; older gaps get a cold refill
+INTRADAY_LOOKBACK = 55 * 86400
+# Rows kept per file; older bars are dropped on the next refresh past this
+MAX_BARS = 20000
+BAR_MAX_MAPS = int(os.environ.get("BAR_MAX_MAPS", 256))   # memmaps kept open
+BAR_MAX_MISSES = 1024        # symbols with no upstream bars remembered
+# Tickers as Yahoo spells them: BRK-B, BF.B, ^GSPC, EURUSD=X
+SYMBOL_PATTERN = re.compile(r"^[A-Z0-9^][A-Z0-9.=^-]{0,15}$")
+
+_key_locks = [threading.Lock() for _ in range(64)]   # striped, so the set can't grow with input
+_maps = OrderedDict()  # path -> ((inode, size, mtime), memmap), LRU
+_maps_lock = threading.Lock()
+_misses = OrderedDict()  # (symbol, interval) -> time a cold fetch found no bars, LRU
+_misses_lock = threading.Lock()
+
+
+class InvalidSymbol(ValueError):
+    pass
+
+
+def normalize(symbol, interval):
+    """Upper-cased `symbol`, or InvalidSymbol if it can't be a ticker or `interval` isn't stored."""
+    symbol = (symbol or "").strip().upper()
+    if not SYMBOL_PATTERN.match(symbol):
+        raise InvalidSymbol(f"Invalid symbol: {symbol[:20]!r}")
+    if interval not in REFRESH_AFTER:
+        raise InvalidSymbol(f"interval must be one of {', '.join(REFRESH_AFTER)}")
+    return symbol
+
+
+def _paths(symbol, interval):
+    name = f"{symbol}_{interval}"
+    return os.path.join(BAR_STORE_DIR, name + ".bars"), os.path.join(BAR_STORE_DIR, name + ".json")
+
+
+def _key_lock(key):
+    return _key_locks[hash(key) % len(_key_locks)]
+
+
+def _read_meta(meta_path):
+    try:
+        with open(meta_path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _write_meta(meta_path, meta):
+    tmp = meta_path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(meta, f)
+    os.replace(tmp, meta_path)
+
+
+def _mapped(path):
+    """Read-only memmap of a bar file, reopened only when the file changes."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return np.empty(0, dtype=BAR_DTYPE)
+    version = (st.st_ino, st.st_size, st.st_mtime_ns)
+    with _maps_lock:
+        cached = _maps.get(path)
+        if cached is not None and cached[0] == version:
+            _maps.move_to_end(path)
+            return cached[1]
+    rows = st.st_size // BAR_DTYPE.itemsize
+    bars = np.memmap(path, dtype=BAR_DTYPE, mode="r", shape=(rows,)) if rows else np.empty(0, dtype=BAR_DTYPE)
+    with _maps_lock:
+        _maps[path] = (version, bars)
+        _maps.move_to_end(path)
+        while len(_maps) > BAR_MAX_MAPS:
+            _maps.popitem(last=False)   # callers still holding the array keep it mapped
+    return bars
+
+
+def _frame_to_bars(hist):
+    hist = hist.dropna(subset=["Close"])
+    bars = np.empty(len(hist), dtype=BAR_DTYPE)
+    index = hist.index if hist.index.tz is not None else hist.index.tz_localize("UTC")
+    bars["t"] = index.tz_convert("UTC").as_unit("s").asi8
+    bars["open"] = hist["Open"].to_numpy(dtype=float)
+    bars["high"] = hist["High"].to_numpy(dtype=float)
+    bars["low"] = hist["Low"].to_numpy(dtype=float)
+    bars["close"] = hist["Close"].to_numpy(dtype=float)
+    bars["volume"] = hist["Volume"].to_numpy(dtype=float)
+    return bars
+
+
+def _fetch(symbol, interval, last_t=None):
+    """Upstream bars (and exchange tz) from last_t on, or a cold period if last_t is None."""
+    provider = get_provider()
+    if last_t is None:
+        hist = provider.history(symbol, period=COLD_PERIOD[interval], interval=interval)
+    else:
+        start = datetime.fromtimestamp(last_t, tz=timezone.utc)
+        hist = provider.history(symbol, start=start, interval=interval)
+    tz = str(hist.index.tz) if not hist.empty and hist.index.tz is not None else None
+    return _frame_to_bars(hist), tz
+
+
+def _rewrite(path, bars):
+    tmp = path + ".tmp"
+    bars.tofile(tmp)
+    os.replace(tmp, path)
+
+
+def refresh(symbol, interval):
+    """
+    Bring the stored bars for (symbol, interval) up to date with upstream.
+    Returns False, having written nothing, if a symbol with no file yet has
+    no bars upstream.
+    """
+    path, meta_path = _paths(symbol, interval)
+    cold = None
+    if not os.path.exists(path):
+        # Ask before creating any file, so unknown symbols leave nothing on disk
+        cold = _fetch(symbol, interval)
+        if not len(cold[0]):
+            return False
+
+    os.makedirs(BAR_STORE_DIR, exist_ok=True)
+    # flock keeps gunicorn workers on the same host from appending the same bars twice
+    with open(path + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        meta = _read_meta(meta_path)
+        if time.time() - meta.get("refreshed", 0) < REFRESH_AFTER[interval]:
+            return True  # another worker just did it
+
+        stored = _mapped(path)
+        last_t = int(stored["t"][-1]) if len(stored) else None
+        intraday = interval.endswith("m")
+        if last_t is not None and intraday and time.time() - last_t > INTRADAY_LOOKBACK:
+            last_t = None
+
+        new, tz = cold if cold is not None and last_t is None else _fetch(symbol, interval, last_t)
+        if last_t is None:
+            if len(new):
+                _rewrite(path, new[-MAX_BARS:])
+        elif len(new):
+            new = new[new["t"] >= last_t]
+            if len(new) and new["t"][0] == last_t:
+                # The last stored bar may have still been forming; overwrite it
+                with open(path, "r+b") as f:
+                    f.seek((len(stored) - 1) * BAR_DTYPE.itemsize)
+                    f.write(new[:1].tobytes())
+                new = new[1:]
+            if len(stored) + len(new) > MAX_BARS:
+                _rewrite(path, np.concatenate([np.asarray(stored), new])[-MAX_BARS:])
+            elif len(new):
+                with open(path, "ab") as f:
+                    f.write(new.tobytes())
+
+        meta["refreshed"] = time.time()
+        if tz:
+            meta["tz"] = tz
+        _write_meta(meta_path, meta)
+    return True
+
+
+def _missed(key, interval):
+    """True if a cold fetch for `key` found no bars within the interval's refresh time."""
+    with _misses_lock:
+        when = _misses.get(key)
+        if when is None:
+            return False
+        if time.monotonic() - when < REFRESH_AFTER[interval]:
+            return True
+        del _misses[key]
+        return False
+
+
+def _remember_miss(key):
+    with _misses_lock:
+        _misses[key] = time.monotonic()
+        _misses.move_to_end(key)
+        while len(_misses) > BAR_MAX_MISSES:
+            _misses.popitem(last=False)
+
+
+def load(symbol, interval):
+    """
+    Return (bars, tz) for (symbol, interval), refreshing first if the store is
+    cold or stale. If upstream fails but bars are stored, the stale bars are
+    served; with nothing stored the upstream error is raised. Raises
+    InvalidSymbol for strings that can't be tickers.
+    """
+    symbol = normalize(symbol, interval)
+    path, meta_path = _paths(symbol, interval)
+    meta = _read_meta(meta_path)
+    stale = time.time() - meta.get("refreshed", 0) >= REFRESH_AFTER[interval]
+    if stale and not _missed((symbol, interval), interval):
+        lock = _key_lock((symbol, interval))
+        have_bars = len(_mapped(path)) > 0
+        # Only one thread per key refreshes; others serve what is on disk if they can
+        if lock.acquire(blocking=not have_bars):
+            try:
+                if not refresh(symbol, interval):
+                    _remember_miss((symbol, interval))
+            except Exception as e:
+                if not have_bars:
+                    raise
+                log.warning("Bar refresh failed for %s %s, serving stored bars: %s", symbol, interval, e)
+            finally:
+                lock.release()
+            meta = _read_meta(meta_path)
+    return _mapped(path), meta.get("tz") or "UTC"
+
+
+def window(bars, tz, period):
+    """
+    Zero-copy slice of `bars` covering `period` back from the newest bar.
+    "1d" is the newest session, "5d" the newest five sessions, longer periods
+    are calendar offsets from the newest bar.
+    """
+    if len(bars) == 0:
+        return bars
+    t = bars["t"]
+    last = pd.Timestamp(int(t[-1]), unit="s", tz="UTC").tz_convert(tz)
+
+    if period in ("1d", "5d"):
+        sessions = 1 if period == "1d" else 5
+        # Only the tail can matter; cap how much we convert to local dates
+        tail = t[-sessions * 400:]
+        days = pd.to_datetime(tail, unit="s", utc=True).tz_convert(tz).normalize()
+        unique_days = days.unique()
+        start = unique_days[max(len(unique_days) - sessions, 0)]
+    else:
+        months = {"1mo": 1, "3mo": 3, "6mo": 6, "1y": 12}.get(period, 1)
+        start = last - pd.DateOffset(months=months)
+
+    return bars[np.searchsorted(t, int(start.timestamp()), side="left"):]
+
+
+def get_bars(symbol, interval, period):
+    """Bars for `period` at `interval` plus the exchange tz, served from the store."""
+    bars, tz = load(symbol, interval)
+    return window(bars, tz, period), tz
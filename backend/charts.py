@@ -0,0 +1,97 @@
+"""
+Downsampling and compact encoding for the history endpoints
+(/api/stock-data, /portfolio/chart-data).
+
+?maxPoints=N keeps at most N points, chosen with Largest-Triangle-Three-
+Buckets: the first and last points stay, the rest are split into N-2
+buckets, and each bucket keeps the point that makes the largest triangle
+with the point kept before it and the average of the next bucket. Peaks and
+dips survive, unlike with every-kth-point sampling. With several series the
+triangle areas are summed, each series scaled to its own range, so all the
+lines share one set of timestamps.
+
+?format=compact answers with a binary body instead of JSON labels:
+
+    header   one line of JSON, {"n", "t0", "columns": [...], ...}, padded
+             with spaces so the arrays after it are 4-byte aligned
+    t        n int32 deltas in epoch seconds (the first is 0; add to t0)
+    columns  n float32 values per column, in header order
+
+gzip-compressed when the client accepts it. static/js/series.js decodes it.
+"""
+import gzip
+import json
+
+import numpy as np
+from flask import Response, request
+
+CHART_MIN_POINTS = 3
+CHART_GZIP_LEVEL = 5
+
+
+def max_points(args):
+    """The maxPoints query parameter as an int, or None. Raises ValueError."""
+    value = args.get("maxPoints")
+    if value in (None, ""):
+        return None
+    value = int(value)
+    if value < CHART_MIN_POINTS:
+        raise ValueError(f"maxPoints must be at least {CHART_MIN_POINTS}")
+    return value
+
+
+def compact_requested(args):
+    return args.get("format") == "compact"
+
+
+def lttb(x, ys, threshold):
+    """Indices of at most `threshold` points of the series `ys` over `x` (see module docstring)."""
+    n = len(x)
+    if threshold is None or threshold >= n or n <= CHART_MIN_POINTS:
+        return np.arange(n)
+    x = np.asarray(x, dtype=float)
+    y = np.stack([np.asarray(series, dtype=float) for series in ys])
+    span = np.ptp(y, axis=1, keepdims=True)
+    y = (y - y.min(axis=1, keepdims=True)) / np.where(span > 0, span, 1.0)
+
+    # Bucket b (for output point b+1) covers edges[b]:edges[b+1]
+    edges = (np.arange(threshold - 1) * ((n - 2) / (threshold - 2))).astype(int) + 1
+    edges[-1] = n - 1
+    # Average of each bucket, plus the last point as the "next bucket" of the final one
+    sums_x = np.add.reduceat(x[1:n - 1], edges[:-1] - 1)
+    sums_y = np.add.reduceat(y[:, 1:n - 1], edges[:-1] - 1, axis=1)
+    counts = np.diff(edges)
+    avg_x = np.r_[sums_x / counts, x[-1]]
+    avg_y = np.c_[sums_y / counts, y[:, -1]]
+
+    keep = np.empty(threshold, dtype=int)
+    keep[0], keep[-1] = 0, n - 1
+    a = 0
+    for b in range(threshold - 2):
+        lo, hi = edges[b], edges[b + 1]
+        cx, cy = avg_x[b + 1], avg_y[:, b + 1:b + 2]
+        area = np.abs((x[a] - cx) * (y[:, lo:hi] - y[:, a:a + 1]) - (x[a] - x[lo:hi]) * (cy - y[:, a:a + 1])).sum(axis=0)
+        a = lo + int(area.argmax())
+        keep[b + 1] = a
+    return keep
+
+
+def compact(t, columns, **meta):
+    """Encode epoch seconds `t` and {name: values} columns as described above."""
+    t = np.asarray(t, dtype=np.int64)
+    header = json.dumps({"n": len(t), "t0": int(t[0]) if len(t) else 0, "columns": list(columns), **meta})
+    header = header.encode()
+    header += b" " * (-(len(header) + 1) % 4) + b"\n"
+    deltas = np.diff(t, prepend=t[:1]).astype("<i4")
+    return b"".join([header, deltas.tobytes()] +
+                    [np.asarray(values, dtype="<f4").tobytes() for values in columns.values()])
+
+
+def compact_response(t, columns, **meta):
+    body = compact(t, columns, **meta)
+    response = Response(body, mimetype="application/octet-stream")
+    if "gzip" in request.accept_encodings:
+        response.set_data(gzip.compress(body, compresslevel=CHART_GZIP_LEVEL))
+        response.headers["Content-Encoding"] = "gzip"
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
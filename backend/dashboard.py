@@ -1,16 +1,16 @@
-from flask import Blueprint, render_template, jsonify, request
+from flask import Blueprint, render_template, jsonify, request, Response, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
 dashboard_bp = Blueprint("dashboard", __name__)
-import yfinance as yf
-import pandas as pd
-import random
-import ssl
-from urllib.request import urlopen
-import firebase_admin
-import requests
-from firebase_admin import credentials, firestore
+import os
 from flask import current_app as app
 import traceback
+from backend.firebase import get_db, firestore
+from backend.quotes import get_quotes, get_price
+from backend.execution import execute_buy, execute_sell, TradeRejected, TradeConflict
+from backend.stream import hub
+from backend.trade import ensure_tickers
+from backend.sessions import request_uid
+from backend import movers, fanout, journal, leaderboard, orders
 
 def json_error(status=500, message="Internal server error", body=None):
     resp = {"error": message}
@@ -19,17 +19,22 @@ def json_error(status=500, message="Internal server error", body=None):
     return jsonify(resp), status
 
 
-def get_db():
-    return firestore.client()
 cached_stocks = None
 
+# Seconds /dashboard/live-prices waits for upstream before answering with stale/null rows
+LIVE_PRICES_DEADLINE = float(os.environ.get("LIVE_PRICES_DEADLINE", 2.0))
+# Seconds before a symbol still pending gets a single-symbol retry
+LIVE_PRICES_HEDGE_AFTER = float(os.environ.get("LIVE_PRICES_HEDGE_AFTER", 0.75))
+
 @dashboard_bp.route("/dashboard")
 def dashboard_home():
+    # create_app starts the engine; this restarts it if its thread has died
+    orders.ensure_engine()
     return render_template("dashboard.html")
 
 @dashboard_bp.route("/dashboard/balance", methods=["GET"])
 def balance():
-    uid = request.args.get("uid")
+    uid = request_uid()
     app.logger.info("Balance request for uid: %r", uid)
     if not uid:
         return jsonify({"error": "No UID provided"}), 400
@@ -58,7 +63,7 @@ def balance():
 @dashboard_bp.route("/dashboard/updated_balance", methods=["POST"])
 def update_balance():
     data = request.get_json()
-    uid = data.get("uid")
+    uid = request_uid(data)
     symbol = data.get("symbol")
     quantity = data.get("quantity")
     
@@ -69,69 +74,32 @@ def update_balance():
     if quantity <= 0:
         return jsonify({"error": "Quantity must be positive"}), 400
 
-    # ---- SERVER-SIDE BALANCE VALIDATION ----
-    # Always re-read balance from Firestore to prevent race conditions
-    db = get_db()
-    user_ref = db.collection("users").document(uid)
-    doc = user_ref.get()
-    if not doc.exists:
-        return jsonify({"error": "User not found"}), 404
-    
-    user_data = doc.to_dict() or {}
-    current_balance = float(user_data.get("balance") or 0.0)
-    
-    # Get live price
-    ticker = yf.Ticker(symbol)
-    history = ticker.history(period="1d", interval="5m")
-    if history.empty:
-        return jsonify({"error": "Could not fetch price for symbol"}), 500
-    live_price = float(history['Close'].iloc[-1])
-    
-    curr_price = float(data.get("price", live_price))
-    total_cost = live_price * quantity
-    
-    # CRITICAL: Validate balance BEFORE executing the trade
-    if total_cost > current_balance:
-        return jsonify({
-            "error": "Insufficient balance",
-            "balance": current_balance,
-            "required": round(total_cost, 2)
-        }), 403
-    
-    new_balance = round(current_balance - total_cost, 2)
-    profit = round((live_price - curr_price) * quantity, 2) if live_price > curr_price else 0
-    loss = round((curr_price - live_price) * quantity, 2) if curr_price > live_price else 0
-    
-    # Update user balance
-    user_ref.set({
-        "balance": new_balance,
-        "profit": profit,
-        "loss": loss,
-        "pl": profit - loss,
-    }, merge=True)
+    curr_price = float(data["price"]) if data.get("price") is not None else None
+    if journal.enabled():
+        return _journaled(uid, "buy", symbol, quantity, client_price=curr_price)
+
+    # Live price is fetched while the transaction reads the user doc
+    live_price = fanout.submit(get_price, symbol)
     
-    # Record the trade
-    db.collection("users").document(uid).collection("trades").add({
-        "symbol": symbol,
-        "quantity": quantity,
-        "buy_price": curr_price,
-        "live_price": live_price,
-        "timestamp": firestore.SERVER_TIMESTAMP,
-        "pl": profit - loss,
-        "buy": True
-    })
+    # Balance check, balance/position update and trade record commit together
+    try:
+        result = execute_buy(get_db(), uid, symbol, quantity, live_price, curr_price)
+    except TradeRejected as e:
+        return jsonify(e.body), e.status
+    except TradeConflict:
+        return jsonify({"error": "Too many concurrent orders, please retry"}), 409
     
     return jsonify({
         "message": "success",
-        "balance": new_balance,
-        "totalCost": round(total_cost, 2)
+        "balance": result["balance"],
+        "totalCost": result["totalCost"]
     })
     
 @dashboard_bp.route("/dashboard/update_sell", methods=["POST"])
 def update_sell():
     data = request.get_json()
     
-    uid = data.get("uid")
+    uid = request_uid(data)
     symbol = data.get("symbol")
     quantity = data.get("quantity")
     
@@ -147,128 +115,146 @@ def update_sell():
     new_quantity = data.get("newQuantity", 0)
     timestamp = data.get("timestamp")
     
-    db = get_db() 
-    user_ref = db.collection("users").document(uid)
-    
-    # Get live price
-    ticker = yf.Ticker(symbol)
-    history = ticker.history(period="1d", interval="5m")
-    if history.empty:
-        return jsonify({"error": "Could not fetch price for symbol"}), 500
-    live_price = float(history['Close'].iloc[-1])
-    
-    # SERVER-SIDE: Validate the user owns enough shares
-    trades_ref = db.collection("users").document(uid).collection("trades")
-    trades_docs = trades_ref.stream()
-    owned_quantity = 0
-    for trade_doc in trades_docs:
-        trade_data = trade_doc.to_dict()
-        if trade_data.get("symbol") == symbol:
-            if trade_data.get("sell"):
-                owned_quantity -= float(trade_data.get("quantity", 0))
-            elif trade_data.get("buy"):
-                owned_quantity += float(trade_data.get("quantity", 0))
-    
-    if quantity > owned_quantity:
-        return jsonify({
-            "error": "Insufficient shares",
-            "owned": owned_quantity,
-            "requested": quantity
-        }), 403
-    
-    # Re-read balance from Firestore
-    doc = user_ref.get()
-    user_data = doc.to_dict() or {}
-    current_balance = float(user_data.get("balance") or 0.0)
-    
-    sell_value = live_price * quantity
-    new_balance = round(current_balance + sell_value, 2)
-    
-    user_ref.update({
-        "balance": new_balance
-    })
-
-    trade_data = {
+    # Ownership check (from the positions map), balance/position update and
+    # trade record commit together
+    record = {
         "symbol": symbol,
         "quantity": quantity,
         "oldQuantity": float(data.get("quantity", quantity)),
         "price": price,
         "total": total_value,
-        "timestamp": timestamp,
-        "livePrice": live_price,
-        "sell": True  
+        # Server time orders trade history; the client's clock is kept for reference
+        "timestamp": firestore.SERVER_TIMESTAMP,
+        "clientTimestamp": timestamp,
     }
-    db.collection("users").document(uid).collection("trades").add(trade_data)
+    if journal.enabled():
+        record.pop("timestamp")   # stamped by the server when the journal flushes
+        return _journaled(uid, "sell", symbol, quantity, record=record)
+
+    # Live price is fetched while the transaction reads the user doc
+    live_price = fanout.submit(get_price, symbol)
+    try:
+        result = execute_sell(get_db(), uid, symbol, quantity, live_price, record)
+    except TradeRejected as e:
+        return jsonify(e.body), e.status
+    except TradeConflict:
+        return jsonify({"error": "Too many concurrent orders, please retry"}), 409
 
     return jsonify({
         "message": "Sell recorded and balance updated",
-        "balance": new_balance,
-        "sellValue": round(sell_value, 2)
+        "balance": result["balance"],
+        "sellValue": result["sellValue"]
     }), 200
 
-@dashboard_bp.route("/dashboard/watchlist", methods=["GET"])
-def watchlist():
+def _journaled(uid, side, symbol, quantity, **kwargs):
+    """Acknowledge an order from the write-ahead journal (backend.journal); Firestore commits it shortly after."""
     try:
-        url = "https://raw.githubusercontent.com/datasets/s-and-p-500-companies/master/data/constituents.csv"
-        r = requests.get(url, timeout=8)
-        r.raise_for_status()
+        ack = journal.submit(get_db(), uid, side, symbol, quantity,
+                             key=request.headers.get("Idempotency-Key"), **kwargs)
+    except TradeRejected as e:
+        return jsonify(e.body), e.status
+    ack["journalId"] = ack.pop("id")
+    return jsonify(dict(ack, message="accepted")), 202
 
-        lines = r.text.strip().splitlines()
-        # CSV format: Symbol,Name,Sector — skip header
-        tickers = []
-        for line in lines[1:]:
-            parts = line.split(",")
-            if parts and parts[0].strip():
-                tickers.append(parts[0].strip())
-        
-        if not tickers:
-            tickers = ["AAPL", "MSFT", "AMZN", "GOOGL", "TSLA", "NVDA", "META", "JPM", "V", "UNH"]
-        
-        random_tickers = random.sample(tickers, min(5, len(tickers)))
 
-        stock_data = []
-        for t in random_tickers:
-            try:
-                ticker = yf.Ticker(t)
-                info = ticker.info
-                # Try to get live price from history if currentPrice is not available
-                current_price = info.get("currentPrice")
-                if current_price is None:
-                    history = ticker.history(period="1d", interval="1m")
-                    if not history.empty:
-                        current_price = float(history['Close'].iloc[-1])
-                
-                # Get previous close for change calculation
-                prev_close = info.get("previousClose", current_price)
-                change = current_price - prev_close if current_price and prev_close else 0
-                change_percent = (change / prev_close * 100) if prev_close else 0
-                
-                stock_data.append({
-                    "name": info.get("shortName", t),
-                    "symbol": t,
-                    "price": current_price,
-                    "previousClose": prev_close,
-                    "change": change,
-                    "changePercent": change_percent
-                })
-            except Exception as e:
-                app.logger.error(f"Error fetching data for {t}: {str(e)}")
-                # Add stock with minimal data if fetch fails
-                stock_data.append({
-                    "name": t,
-                    "symbol": t,
-                    "price": None,
-                    "previousClose": None,
-                    "change": 0,
-                    "changePercent": 0
-                })
+@dashboard_bp.route("/dashboard/journal/<order_id>", methods=["GET"])
+def journaled_order(order_id):
+    """
+    How a journaled buy/sell ended: pending, filled or rejected (with the
+    reason). Another worker's orders are only known once filled, via uid.
+    """
+    if not journal.enabled():
+        return jsonify({"error": "Trade journal is off"}), 404
+    found = journal.status(order_id)
+    uid = request_uid()
+    if found["status"] == "unknown" and uid:
+        trade = get_db().collection("users").document(uid).collection("trades").document(order_id).get()
+        if trade.exists:
+            found = {"status": "filled"}
+    return jsonify(dict(found, journalId=order_id))
+
+
+@dashboard_bp.route("/dashboard/orders", methods=["GET", "POST"])
+def resting_orders():
+    """
+    GET: the user's limit/stop orders (?status=open|filled|cancelled|rejected).
+    POST {uid, symbol, side: buy|sell, type: limit|stop, quantity, triggerPrice}:
+    place one; it fills through the trigger engine (backend.orders).
+    """
+    data = request.get_json(silent=True) or {}
+    uid = request_uid(data)
+    if not uid:
+        return jsonify({"error": "Missing uid"}), 400
+    orders.ensure_engine()
+
+    if request.method == "GET":
+        return jsonify({"orders": orders.list_orders(get_db(), uid, request.args.get("status"))})
+    try:
+        order = orders.place(get_db(), uid, data)
+    except TradeRejected as e:
+        return jsonify(e.body), e.status
+    return jsonify(order), 201
+
+@dashboard_bp.route("/dashboard/orders/<order_id>", methods=["DELETE"])
+def cancel_order(order_id):
+    uid = request_uid()
+    if not uid:
+        return jsonify({"error": "Missing uid"}), 400
+    try:
+        orders.cancel(get_db(), uid, order_id)
+    except TradeRejected as e:
+        return jsonify(e.body), e.status
+    return jsonify({"message": "Order cancelled", "id": order_id})
 
-        return jsonify(stock_data)
+@dashboard_bp.route("/dashboard/watchlist", methods=["GET"])
+def watchlist():
+    """Five random stocks from the in-memory movers snapshot (backend.movers)."""
+    try:
+        # Make sure the shared ticker list is (being) loaded; the snapshot ranks over it
+        ensure_tickers()
+        return jsonify(movers.watchlist(5))
 
     except Exception as e:
         app.logger.error(f"Error in watchlist endpoint: {str(e)}")
         return jsonify({"error": "Failed to load watchlist"}), 500
 
+@dashboard_bp.route("/dashboard/movers", methods=["GET"])
+def market_movers():
+    """Top gainers, losers and most active over the whole ticker universe."""
+    try:
+        ensure_tickers()
+        snapshot = movers.get_snapshot()
+        return jsonify({k: snapshot[k] for k in ("generated", "universe", "gainers", "losers", "active")})
+
+    except Exception as e:
+        app.logger.error(f"Error in movers endpoint: {str(e)}")
+        return jsonify({"error": "Failed to load market movers"}), 500
+
+@dashboard_bp.route("/dashboard/leaderboard", methods=["GET"])
+def leaderboard_top():
+    """
+    Top users by ?by=equity (default) or ?by=return, at most 100 (?limit=).
+    With a signed-in user their own standing is included as "you".
+    """
+    by = {"equity": "equity", "return": "returnPct"}.get(request.args.get("by", "equity"))
+    if by is None:
+        return jsonify({"error": "by must be equity or return"}), 400
+    try:
+        limit = min(int(request.args.get("limit", leaderboard.LEADERBOARD_MAX)), leaderboard.LEADERBOARD_MAX)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    public = ("rank", "name", "equity", "returnPct")
+    entries = [{k: e[k] for k in public} for e in leaderboard.top(max(limit, 0), by)]
+    you = None
+    uid = request_uid(required=False)
+    if uid:
+        mine = leaderboard.user_entry(uid)
+        if mine is not None:
+            you = {k: mine[k] for k in public[1:]}
+            you["rank"] = leaderboard.rank(uid, by)
+    return jsonify({"by": request.args.get("by", "equity"), "entries": entries, "you": you})
+
 @dashboard_bp.route("/dashboard/live-prices", methods=["POST"])
 def live_prices():
     try:
@@ -278,42 +264,35 @@ def live_prices():
         if not symbols:
             return jsonify({"error": "No symbols provided"}), 400
         
-        price_data = []
-        for symbol in symbols:
-            try:
-                ticker = yf.Ticker(symbol)
-                info = ticker.info
-                
-                # Get live price
-                current_price = info.get("currentPrice")
-                if current_price is None:
-                    history = ticker.history(period="1d", interval="1m")
-                    if not history.empty:
-                        current_price = float(history['Close'].iloc[-1])
-                
-                # Get previous close for change calculation
-                prev_close = info.get("previousClose", current_price)
-                change = current_price - prev_close if current_price and prev_close else 0
-                change_percent = (change / prev_close * 100) if prev_close else 0
-                
-                price_data.append({
-                    "symbol": symbol,
-                    "price": current_price,
-                    "previousClose": prev_close,
-                    "change": change,
-                    "changePercent": change_percent
-                })
-            except Exception as e:
-                app.logger.error(f"Error fetching live price for {symbol}: {str(e)}")
-                price_data.append({
-                    "symbol": symbol,
-                    "price": None,
-                    "previousClose": None,
-                    "change": 0,
-                    "changePercent": 0
-                })
+        # Multi-ticker fetch bounded by a deadline; a bad or slow symbol only affects its own row
+        price_data = get_quotes(symbols, deadline=LIVE_PRICES_DEADLINE, hedge_after=LIVE_PRICES_HEDGE_AFTER)
+        for requested, row in zip(symbols, price_data):
+            row["symbol"] = requested
+            if row["error"]:
+                app.logger.error(f"Error fetching live price for {requested}: {row['error']}")
         
         return jsonify(price_data)
     except Exception as e:
         app.logger.error(f"Error in live-prices endpoint: {str(e)}")
         return jsonify({"error": "Failed to fetch live prices"}), 500
+
+@dashboard_bp.route("/dashboard/stream", methods=["GET"])
+def price_stream():
+    """
+    Server-Sent Events stream of live quotes for ?symbols=AAPL,MSFT,...
+    Each `quotes` event carries a JSON list in the same shape as /dashboard/live-prices,
+    containing only the symbols whose price changed since the last push.
+    """
+    symbols = [s for s in request.args.get("symbols", "").split(",") if s.strip()]
+    if not symbols:
+        return jsonify({"error": "No symbols provided"}), 400
+
+    sub = hub.subscribe(symbols)
+    if sub is None:
+        # Every stream pins a request thread; past the cap the page polls instead
+        return jsonify({"error": "Too many open price streams"}), 503, {"Retry-After": "30"}
+    return Response(
+        stream_with_context(hub.events(sub)),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,309 @@
+"""
+Order execution against Firestore.
+
+A buy or sell is one Firestore transaction: read the user document, validate
+balance / holdings, then write the new balance, the updated position and the
+trade record in a single commit. Concurrent orders for the same user (e.g. a
+double-submitted button) conflict on the user document and are retried by the
+client library, so they can no longer overdraw or oversell. Once an order
+has committed, the user's new standing goes to backend.leaderboard; that is
+best-effort, so a committed order is never reported as failed.
+"""
+import logging
+
+from backend import leaderboard
+from backend.fanout import resolve
+from backend.firebase import firestore
+from backend.positions import apply_buy, apply_sell, positions_from_trades
+
+log = logging.getLogger(__name__)
+
+# Attempts per order before giving up on contention
+TRADE_TXN_ATTEMPTS = 5
+
+
+class TradeRejected(Exception):
+    """Validation failure; carries the HTTP status and JSON body for the client."""
+
+    def __init__(self, status, body):
+        super().__init__(body.get("error"))
+        self.status = status
+        self.body = body
+
+
+class TradeConflict(Exception):
+    """The order kept colliding with other writes to the same user."""
+
+
+def _next_seq(transaction, user_ref, user_data):
+    """
+    Sequence number for the trade being written. Trades are numbered per user
+    (user doc `tradeSeq`, trade `seq`) so readers can ask for "trades after N";
+    users from before the counter continue from their trade count.
+    """
+    seq = user_data.get("tradeSeq")
+    if seq is None:
+        seq = sum(1 for _ in user_ref.collection("trades").stream(transaction=transaction))
+    return int(seq) + 1
+
+
+def _fill_price(live_price):
+    """The live price, waiting for it if it is still being fetched."""
+    live_price = resolve(live_price)
+    if live_price is None:
+        raise TradeRejected(500, {"error": "Could not fetch price for symbol"})
+    return live_price
+
+
+def _positions(transaction, user_ref, user_data):
+    """Current positions; users that predate the map are migrated inside the transaction."""
+    positions = user_data.get("positions")
+    if positions is None:
+        trades = user_ref.collection("trades").stream(transaction=transaction)
+        positions = positions_from_trades([doc.to_dict() for doc in trades])
+        return positions, True
+    return positions, False
+
+
+def _open_order(transaction, order_ref):
+    """Reads a resting order inside the transaction; it must still be open."""
+    if order_ref is None:
+        return
+    order = order_ref.get(transaction=transaction)
+    if not order.exists or (order.to_dict() or {}).get("status") != "open":
+        raise TradeRejected(409, {"error": "Order is no longer open"})
+
+
+def _mark_filled(transaction, order_ref, price, seq):
+    if order_ref is not None:
+        transaction.update(order_ref, {
+            "status": "filled",
+            "fillPrice": price,
+            "filledAt": firestore.SERVER_TIMESTAMP,
+            "tradeSeq": seq,
+        })
+
+
+def _buy(transaction, user_ref, symbol, quantity, live_price, client_price, order_ref=None):
+    snapshot = user_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        raise TradeRejected(404, {"error": "User not found"})
+    _open_order(transaction, order_ref)
+
+    user_data = snapshot.to_dict() or {}
+    live_price = _fill_price(live_price)
+    client_price = live_price if client_price is None else client_price
+    current_balance = float(user_data.get("balance") or 0.0)
+    total_cost = live_price * quantity
+
+    # CRITICAL: Validate balance BEFORE executing the trade
+    if total_cost > current_balance:
+        raise TradeRejected(403, {
+            "error": "Insufficient balance",
+            "balance": current_balance,
+            "required": round(total_cost, 2)
+        })
+
+    new_balance = round(current_balance - total_cost, 2)
+    profit = round((live_price - client_price) * quantity, 2) if live_price > client_price else 0
+    loss = round((client_price - live_price) * quantity, 2) if client_price > live_price else 0
+
+    positions, migrated = _positions(transaction, user_ref, user_data)
+    positions[symbol] = apply_buy(positions.get(symbol), quantity, live_price)
+    seq = _next_seq(transaction, user_ref, user_data)
+
+    transaction.set(user_ref, {
+        "balance": new_balance,
+        "tradeSeq": seq,
+        "profit": profit,
+        "loss": loss,
+        "pl": profit - loss,
+        "positions": positions if migrated else {symbol: positions[symbol]},
+    }, merge=True)
+    transaction.create(user_ref.collection("trades").document(), {
+        "symbol": symbol,
+        "quantity": quantity,
+        "buy_price": client_price,
+        "live_price": live_price,
+        "timestamp": firestore.SERVER_TIMESTAMP,
+        "pl": profit - loss,
+        "buy": True,
+        "seq": seq,
+    })
+    _mark_filled(transaction, order_ref, live_price, seq)
+    standing = leaderboard.standing(dict(user_data, balance=new_balance), positions)
+    return {"balance": new_balance, "totalCost": round(total_cost, 2)}, standing
+
+
+def _sell(transaction, user_ref, symbol, quantity, live_price, record, order_ref=None):
+    snapshot = user_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        raise TradeRejected(404, {"error": "User not found"})
+    _open_order(transaction, order_ref)
+
+    user_data = snapshot.to_dict() or {}
+    live_price = _fill_price(live_price)
+    positions, migrated = _positions(transaction, user_ref, user_data)
+    position = positions.get(symbol)
+    owned_quantity = float((position or {}).get("quantity", 0))
+
+    # SERVER-SIDE: Validate the user owns enough shares
+    if quantity > owned_quantity:
+        raise TradeRejected(403, {
+            "error": "Insufficient shares",
+            "owned": owned_quantity,
+            "requested": quantity
+        })
+
+    current_balance = float(user_data.get("balance") or 0.0)
+    sell_value = live_price * quantity
+    new_balance = round(current_balance + sell_value, 2)
+    positions[symbol] = apply_sell(position, quantity, live_price)
+    seq = _next_seq(transaction, user_ref, user_data)
+
+    transaction.set(user_ref, {
+        "balance": new_balance,
+        "tradeSeq": seq,
+        "positions": positions if migrated else {symbol: positions[symbol]},
+    }, merge=True)
+    transaction.create(user_ref.collection("trades").document(), dict(record, livePrice=live_price, sell=True, seq=seq))
+    _mark_filled(transaction, order_ref, live_price, seq)
+    standing = leaderboard.standing(dict(user_data, balance=new_balance), positions)
+    return {"balance": new_balance, "sellValue": round(sell_value, 2)}, standing
+
+
+def _batch(transaction, user_ref, entries):
+    """
+    Apply journaled orders (backend.journal) for one user, in order, at the
+    price each was acknowledged at. Orders that fail validation are rejected
+    on their own; the rest commit together: one user-document write plus a
+    trade document per order, keyed by the order's id. Orders flagged
+    "check" may already have been committed by an earlier attempt, so their
+    trade document is looked up first and they are skipped if it exists.
+    A filled outcome carries the balance right after that order.
+    Returns ({id: outcome}, standing, {"balance", "positions"}).
+    """
+    snapshot = user_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return {e["id"]: {"status": "rejected", "error": "User not found"} for e in entries}, None, None
+    trades_ref = user_ref.collection("trades")
+    applied = {
+        e["id"] for e in entries
+        if e.get("check") and trades_ref.document(e["id"]).get(transaction=transaction).exists
+    }
+
+    user_data = snapshot.to_dict() or {}
+    positions, migrated = _positions(transaction, user_ref, user_data)
+    balance = float(user_data.get("balance") or 0.0)
+    seq = _next_seq(transaction, user_ref, user_data) - 1
+    outcomes, writes, touched, fields = {}, [], set(), {}
+    for e in entries:
+        if e["id"] in applied:
+            outcomes[e["id"]] = {"status": "filled"}
+            continue
+        symbol, quantity, price = e["symbol"], e["quantity"], e["price"]
+        if e["side"] == "buy":
+            total_cost = price * quantity
+            if total_cost > balance:
+                outcomes[e["id"]] = {"status": "rejected", "error": "Insufficient balance"}
+                continue
+            client_price = price if e.get("clientPrice") is None else e["clientPrice"]
+            profit = round((price - client_price) * quantity, 2) if price > client_price else 0
+            loss = round((client_price - price) * quantity, 2) if client_price > price else 0
+            balance = round(balance - total_cost, 2)
+            positions[symbol] = apply_buy(positions.get(symbol), quantity, price)
+            fields.update(profit=profit, loss=loss, pl=profit - loss)
+            trade = {
+                "symbol": symbol,
+                "quantity": quantity,
+                "buy_price": client_price,
+                "live_price": price,
+                "timestamp": firestore.SERVER_TIMESTAMP,
+                "pl": profit - loss,
+                "buy": True,
+            }
+        else:
+            position = positions.get(symbol)
+            if quantity > float((position or {}).get("quantity", 0)):
+                outcomes[e["id"]] = {"status": "rejected", "error": "Insufficient shares"}
+                continue
+            balance = round(balance + price * quantity, 2)
+            positions[symbol] = apply_sell(position, quantity, price)
+            trade = dict(e["record"], livePrice=price, sell=True, timestamp=firestore.SERVER_TIMESTAMP)
+        seq += 1
+        touched.add(symbol)
+        writes.append((e["id"], dict(trade, seq=seq, journaledAt=e["ts"])))
+        outcomes[e["id"]] = {"status": "filled", "seq": seq, "balance": balance}
+
+    if writes:
+        transaction.set(user_ref, dict(
+            fields,
+            balance=balance,
+            tradeSeq=seq,
+            positions=positions if migrated else {symbol: positions[symbol] for symbol in touched},
+        ), merge=True)
+        for trade_id, trade in writes:
+            transaction.create(trades_ref.document(trade_id), trade)
+    standing = leaderboard.standing(dict(user_data, balance=balance), positions)
+    return outcomes, standing, {"balance": balance, "positions": positions}
+
+
+def _run(db, fn, *args):
+    from google.api_core.exceptions import Aborted
+    try:
+        # Wrapped per call so the Firestore SDK is only imported once an order comes in
+        return firestore.transactional(fn)(db.transaction(max_attempts=TRADE_TXN_ATTEMPTS), *args)
+    except ValueError as e:
+        # The client library raises ValueError (from Aborted) once every attempt lost
+        if isinstance(e.__cause__, Aborted):
+            raise TradeConflict(str(e)) from e
+        raise
+
+
+def _post_standing(uid, standing):
+    """Give the leaderboard `uid`'s committed standing; its next rebuild catches up if this fails."""
+    try:
+        leaderboard.update(uid, *standing)
+    except Exception as e:
+        log.warning("Leaderboard update for %s failed: %s", uid, e)
+
+
+def execute_buy(db, uid, symbol, quantity, live_price, client_price, order_ref=None):
+    """
+    Buy `quantity` shares at `live_price` for `uid` in one transaction.
+    `live_price` may be a Future still fetching the price, so the quote and
+    the user-document read overlap; `client_price` defaults to it. With
+    `order_ref` the resting order must still be open and is marked filled
+    in the same commit.
+    Returns {"balance", "totalCost"}; raises TradeRejected or TradeConflict.
+    """
+    user_ref = db.collection("users").document(uid)
+    result, standing = _run(db, _buy, user_ref, symbol, quantity, live_price, client_price, order_ref)
+    _post_standing(uid, standing)
+    return result
+
+
+def execute_sell(db, uid, symbol, quantity, live_price, record, order_ref=None):
+    """
+    Sell `quantity` shares at `live_price` (a number or a Future) for `uid`
+    in one transaction. `record` holds the client-supplied trade fields stored alongside the fill.
+    `order_ref` works as for execute_buy.
+    Returns {"balance", "sellValue"}; raises TradeRejected or TradeConflict.
+    """
+    user_ref = db.collection("users").document(uid)
+    result, standing = _run(db, _sell, user_ref, symbol, quantity, live_price, record, order_ref)
+    _post_standing(uid, standing)
+    return result
+
+
+def execute_batch(db, uid, entries):
+    """
+    Commit journaled orders for `uid` in one transaction (see _batch).
+    Returns ({id: outcome}, committed {"balance", "positions"} or None if the
+    user doesn't exist); raises TradeConflict like the single-order calls.
+    """
+    user_ref = db.collection("users").document(uid)
+    outcomes, standing, state = _run(db, _batch, user_ref, entries)
+    if standing is not None and any(o["status"] == "filled" for o in outcomes.values()):
+        _post_standing(uid, standing)
+    return outcomes, state
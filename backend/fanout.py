@@ -0,0 +1,45 @@
+"""
+Shared thread pool for running independent upstream calls concurrently.
+
+yfinance and the Firestore client are blocking libraries, so a request that
+needs several of them (a live price and the user document, a quote and its
+previous close, chunks of a download) submits them here and waits on all of
+them instead of paying for each round trip in turn. The pool is created on
+first use, i.e. after gunicorn has forked the worker.
+"""
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+IO_POOL_SIZE = int(os.environ.get("IO_POOL_SIZE", 32))
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=IO_POOL_SIZE, thread_name_prefix="io")
+    return _pool
+
+
+def submit(fn, *args, **kwargs):
+    """Start fn(*args, **kwargs) on the I/O pool and return its Future."""
+    return pool().submit(fn, *args, **kwargs)
+
+
+def gather(*calls):
+    """
+    Run (fn, *args) tuples concurrently and return their results in order.
+    The first exception raised by any call is re-raised.
+    """
+    futures = [submit(fn, *args) for fn, *args in calls]
+    return [f.result() for f in futures]
+
+
+def resolve(value):
+    """`value`, or its result if it is a Future."""
+    return value.result() if isinstance(value, Future) else value
@@ -0,0 +1,72 @@
+"""
+Firebase Admin app and the shared Firestore client.
+
+create_app() only hands over the parsed FIREBASE_CONFIG; the Admin SDK is
+imported and initialized on first use. Each process gets one Firestore
+client, created the first time get_db() is called in that process. gRPC
+channels don't survive fork, so a client created in a gunicorn master
+(e.g. with --preload) is dropped in the children and recreated there.
+"""
+import os
+import threading
+
+from backend.lazy import lazy
+
+firebase_admin = lazy("firebase_admin")
+credentials = lazy("firebase_admin.credentials")
+firestore = lazy("firebase_admin.firestore")
+
+_config = None
+_initialized = False
+_client = None
+_lock = threading.RLock()
+
+
+def configure(config):
+    """Service-account config (parsed FIREBASE_CONFIG) used for lazy initialization."""
+    global _config
+    _config = config
+
+
+def project_id():
+    """The configured Firebase project id, if any."""
+    return (_config or {}).get("project_id")
+
+
+def init_firebase():
+    """Initialize the default Firebase app if this process hasn't yet."""
+    global _initialized
+    if not _initialized:
+        with _lock:
+            if not _initialized:
+                if _config is None:
+                    raise RuntimeError("Firebase is not configured; create_app() must run first")
+                try:
+                    firebase_admin.get_app()
+                except ValueError:
+                    firebase_admin.initialize_app(credentials.Certificate(_config))
+                _initialized = True
+
+
+def get_db():
+    """This process's Firestore client."""
+    global _client
+    client = _client
+    if client is None:
+        with _lock:
+            if _client is None:
+                from backend.metrics import instrument_firestore
+                init_firebase()
+                instrument_firestore()
+                _client = firestore.client()
+            client = _client
+    return client
+
+
+def _after_fork():
+    global _client, _lock
+    _client = None
+    _lock = threading.RLock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
@@ -0,0 +1,252 @@
+"""
+Technical indicators over the stored bars (backend.bars), for /api/indicators.
+
+    sma:window            simple moving average of close
+    ema:span              exponential moving average of close
+    rsi:period            Wilder's relative strength index
+    macd:fast:slow:signal MACD line, signal line and histogram
+    bbands:window:k       Bollinger bands (mean +/- k population std devs)
+    vwap:window           volume-weighted average price; intraday bars reset
+                          each exchange session, daily bars use a rolling window
+
+Every indicator is computed over the whole stored series, so the requested
+period is never in its warm-up, and then sliced like /api/stock-data.
+
+Each one is written as a step over a run of bars that carries a small state
+(the previous EMA values, the last window-1 inputs, the running session
+sums), vectorized over the run. The series are memoized per (symbol,
+interval, indicator, params) with LRU eviction, along with the state they
+ended in; when the store gains bars only the new ones are stepped through.
+The newest stored bar may still be forming and get overwritten, so it is
+always stepped on its own and the kept state is the one from before it.
+"""
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from backend.bars import load
+from backend.lazy import lazy
+
+pd = lazy("pandas")
+
+INDICATOR_CACHE_SIZE = int(os.environ.get("INDICATOR_CACHE_SIZE", 500))
+INDICATOR_MAX_WINDOW = 500
+INDICATOR_MAX_PER_REQUEST = 10
+
+INDICATOR_STATS = {
+    "hits": 0,          # nothing new since the cached series
+    "incremental": 0,   # only new bars stepped through
+    "full": 0,          # computed over every stored bar
+    "evictions": 0,
+}
+
+# (symbol, interval, name, params) -> {"first_t", "last_bar", "n", "values", "state"}
+_cache = OrderedDict()
+_lock = threading.Lock()
+
+
+# ---- kernels ----
+def _ema(x, alpha, prev):
+    """EMA of `x` continuing from `prev` (None starts at x[0]); returns (ema, last)."""
+    if len(x) == 0:
+        return x.astype(float), prev
+    seed = x if prev is None else np.concatenate([[prev], x])
+    out = pd.Series(seed).ewm(alpha=alpha, adjust=False).mean().to_numpy(copy=True)
+    if prev is not None:
+        out = out[1:]
+    return out, float(out[-1])
+
+
+def _rolling(x, tail, window, fn):
+    """fn over each `window`-long run ending at each element of `x`, given the inputs before it."""
+    full = np.concatenate([tail, x])
+    out = np.full(len(x), np.nan)
+    if len(full) >= window and len(x):
+        values = fn(sliding_window_view(full, window))[-len(x):]
+        out[len(x) - len(values):] = values
+    return out, full[len(full) - (window - 1):] if window > 1 else full[:0]
+
+
+def _warm(out, count, needed):
+    """NaN out positions where fewer than `needed` inputs had been seen (count = seen before the run)."""
+    seen = count + np.arange(1, len(out) + 1)
+    out[seen < needed] = np.nan
+    return out
+
+
+def _sma(bars, state, params, tz):
+    (window,) = params
+    tail = state if state is not None else np.zeros(0)
+    mean, tail = _rolling(bars["close"], tail, window, lambda w: w.mean(axis=1))
+    return {"sma": mean}, tail
+
+
+def _ema_step(bars, state, params, tz):
+    (span,) = params
+    prev, count = state or (None, 0)
+    ema, last = _ema(bars["close"], 2 / (span + 1), prev)
+    return {"ema": _warm(ema, count, span)}, (last, count + len(bars))
+
+
+def _rsi(bars, state, params, tz):
+    (period,) = params
+    prev_close, gain, loss, count = state or (None, None, None, 0)
+    close = bars["close"]
+    if len(close) == 0:
+        return {"rsi": np.zeros(0)}, state
+    delta = np.diff(close, prepend=np.nan if prev_close is None else prev_close)
+    # The very first bar has no change; it only seeds prev_close
+    first = 1 if prev_close is None else 0
+    avg_gain, gain = _ema(np.clip(delta[first:], 0, None), 1 / period, gain)
+    avg_loss, loss = _ema(np.clip(-delta[first:], 0, None), 1 / period, loss)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rsi = np.where(avg_loss == 0, 100.0, 100 - 100 / (1 + avg_gain / avg_loss))
+    rsi = _warm(rsi, count, period)
+    out = np.concatenate([np.full(first, np.nan), rsi])
+    return {"rsi": out}, (float(close[-1]), gain, loss, count + len(rsi))
+
+
+def _macd(bars, state, params, tz):
+    fast, slow, signal = params
+    fast_prev, slow_prev, signal_prev, count = state or (None, None, None, 0)
+    fast_ema, fast_prev = _ema(bars["close"], 2 / (fast + 1), fast_prev)
+    slow_ema, slow_prev = _ema(bars["close"], 2 / (slow + 1), slow_prev)
+    line = fast_ema - slow_ema
+    signal_line, signal_prev = _ema(line, 2 / (signal + 1), signal_prev)
+    line, signal_line = _warm(line, count, slow), _warm(signal_line, count, slow + signal - 1)
+    return (
+        {"macd": line, "signal": signal_line, "hist": line - signal_line},
+        (fast_prev, slow_prev, signal_prev, count + len(bars)),
+    )
+
+
+def _bbands(bars, state, params, tz):
+    window, k = params
+    tail = state if state is not None else np.zeros(0)
+    mean, _ = _rolling(bars["close"], tail, window, lambda w: w.mean(axis=1))
+    std, tail = _rolling(bars["close"], tail, window, lambda w: w.std(axis=1))
+    return {"middle": mean, "upper": mean + k * std, "lower": mean - k * std}, tail
+
+
+def _vwap(bars, state, params, tz, intraday):
+    typical = (bars["high"] + bars["low"] + bars["close"]) / 3
+    pv, volume = typical * bars["volume"], np.asarray(bars["volume"], dtype=float)
+    if not intraday:
+        (window,) = params
+        pv_tail, volume_tail = state if state is not None else (np.zeros(0), np.zeros(0))
+        pv_sum, pv_tail = _rolling(pv, pv_tail, window, lambda w: w.sum(axis=1))
+        volume_sum, volume_tail = _rolling(volume, volume_tail, window, lambda w: w.sum(axis=1))
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return {"vwap": pv_sum / volume_sum}, (pv_tail, volume_tail)
+
+    # Running sums that restart at each session (local calendar day)
+    day, pv_carry, volume_carry = state or (None, 0.0, 0.0)
+    if len(bars) == 0:
+        return {"vwap": np.zeros(0)}, state
+    days = pd.to_datetime(bars["t"], unit="s", utc=True).tz_convert(tz).strftime("%Y-%m-%d").to_numpy()
+    if days[0] == day:
+        pv, volume = pv.copy(), volume.copy()
+        pv[0] += pv_carry
+        volume[0] += volume_carry
+    starts = np.flatnonzero(np.r_[True, days[1:] != days[:-1]])
+    session_start = starts[np.searchsorted(starts, np.arange(len(days)), side="right") - 1]
+    pv_cum, volume_cum = np.cumsum(pv), np.cumsum(volume)
+    pv_before = np.r_[0.0, pv_cum][session_start]
+    volume_before = np.r_[0.0, volume_cum][session_start]
+    pv_session, volume_session = pv_cum - pv_before, volume_cum - volume_before
+    with np.errstate(divide="ignore", invalid="ignore"):
+        vwap = pv_session / volume_session
+    return {"vwap": vwap}, (days[-1], float(pv_session[-1]), float(volume_session[-1]))
+
+
+# name -> (default params, param types, step)
+INDICATORS = {
+    "sma": ((20,), (int,), _sma),
+    "ema": ((20,), (int,), _ema_step),
+    "rsi": ((14,), (int,), _rsi),
+    "macd": ((12, 26, 9), (int, int, int), _macd),
+    "bbands": ((20, 2.0), (int, float), _bbands),
+    "vwap": ((20,), (int,), None),
+}
+
+
+def _step(name, interval):
+    if name == "vwap":
+        intraday = interval.endswith("m")
+        return lambda bars, state, params, tz: _vwap(bars, state, params, tz, intraday)
+    return INDICATORS[name][2]
+
+
+def parse(spec):
+    """"macd:12:26:9" -> ("macd", (12, 26, 9)), filling in defaults. Raises ValueError."""
+    name, *given = spec.strip().lower().split(":")
+    if name not in INDICATORS:
+        raise ValueError(f"Unknown indicator {name}; expected one of {', '.join(INDICATORS)}")
+    defaults, types, _ = INDICATORS[name]
+    if len(given) > len(defaults):
+        raise ValueError(f"{name} takes at most {len(defaults)} parameters")
+    try:
+        params = tuple(kind(value) for kind, value in zip(types, given)) + defaults[len(given):]
+    except ValueError:
+        raise ValueError(f"Bad parameters for {name}: {spec}")
+    if not all(0 < p <= INDICATOR_MAX_WINDOW for p in params):
+        raise ValueError(f"{name} parameters must be between 1 and {INDICATOR_MAX_WINDOW}")
+    return name, params
+
+
+# ---- memoized series ----
+def _extend(entry, bars, step, params, tz):
+    """Series for all of `bars`, reusing `entry` if it is a prefix of them. Returns (entry, how)."""
+    n = len(bars)
+    last_bar = bars[-1].tobytes()
+    if (entry is not None and entry["first_t"] == bars["t"][0] and entry["n"] <= n
+            and bars["t"][entry["n"] - 1] == entry["last_t"]):
+        if entry["n"] == n and entry["last_bar"] == last_bar:
+            return entry, "hits"
+        # Step again from the old newest bar, which may have been overwritten since
+        k, state, how = entry["n"] - 1, entry["state"], "incremental"
+    else:
+        k, state, how = 0, None, "full"
+
+    settled, state = step(bars[k:n - 1], state, params, tz)
+    newest, _ = step(bars[n - 1:], state, params, tz)
+    values = {
+        key: np.concatenate([entry["values"][key][:k], settled[key], newest[key]]) if k else
+        np.concatenate([settled[key], newest[key]])
+        for key in newest
+    }
+    return {
+        "first_t": bars["t"][0],
+        "last_t": bars["t"][n - 1],
+        "last_bar": last_bar,
+        "n": n,
+        "values": values,
+        "state": state,
+    }, how
+
+
+def series(symbol, interval, name, params, bars=None, tz=None):
+    """{output: float array} aligned with the stored bars for (symbol, interval)."""
+    if bars is None:
+        bars, tz = load(symbol, interval)
+    if len(bars) == 0:
+        return {}
+    key = (symbol.upper(), interval, name, params)
+    with _lock:
+        entry = _cache.get(key)
+        if entry is not None:
+            _cache.move_to_end(key)
+    entry, how = _extend(entry, bars, _step(name, interval), params, tz)
+    with _lock:
+        INDICATOR_STATS[how] += 1
+        current = _cache.get(key)
+        if current is None or current["n"] <= entry["n"]:
+            _cache[key] = entry
+            _cache.move_to_end(key)
+        while len(_cache) > INDICATOR_CACHE_SIZE:
+            _cache.popitem(last=False)
+            INDICATOR_STATS["evictions"] += 1
+    return entry["values"]
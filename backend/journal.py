@@ -0,0 +1,448 @@
+"""
+Write-ahead trade journal (opt-in: set TRADE_JOURNAL_DIR).
+
+With the journal on, /dashboard/update_balance and /dashboard/update_sell
+no longer wait on a Firestore transaction. An order is priced from the
+quote cache and checked against this worker's view of the user, which is
+the last committed balance and positions plus the user's orders still in
+the journal. It is then appended to a local append-only file, fsynced,
+and acknowledged with status "pending" (HTTP 202).
+A background flusher commits pending orders to Firestore in batches, one
+transaction per user (execution.execute_batch), and journals the outcome.
+
+    <dir>/<host>-<pid>-<random>.journal, one JSON object per line:
+        {"op": "order", "id", "uid", "side", "symbol", "quantity", "price",
+         "clientPrice", "record", "ts", "check"}
+        {"op": "done", "id", "status": "filled" | "rejected", "error"}
+
+Firestore re-validates every order when it flushes. An order that another
+worker's trades made unaffordable is rejected then; GET /dashboard/journal/<id>
+reports how an order ended. A flush that fails on contention or an outage is
+retried; an order that can never commit (a malformed entry) is rejected
+instead of holding up the user's other orders. Concurrent fsyncs are
+grouped: each append waits for one fsync that covers every line written
+before it.
+
+Idempotency: the trade document id is the order id. The id comes from the
+client's Idempotency-Key header when one is sent, and a repeated key gets
+the first order's acknowledgement back. Orders that may already be in
+Firestore have their trade document looked up before the batch writes:
+- orders with a client key
+- orders replayed from a previous process
+- orders whose commit failed with an unknown result
+
+Replay: each process holds an flock on its own file, named uniquely per
+process start so a restarted container that reuses the hostname and PID
+never mistakes a dead process's file for its own. On start (create_app
+calls ensure_flusher), the flusher claims every file nobody holds, copies
+the unfinished orders into its own journal and deletes the old file. A
+file is truncated whenever nothing in it is pending.
+
+A repeated key gets the balance the first acknowledgement reported, or the
+committed balance after the order once it has filled. Orders replayed from
+another process have no acknowledgement balance, so theirs leaves "balance"
+out until then.
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from backend import fanout
+from backend.execution import execute_batch, TradeRejected, TradeConflict
+from backend.firebase import get_db
+from backend.positions import apply_buy, apply_sell, positions_from_trades
+from backend.quotes import get_price
+
+log = logging.getLogger(__name__)
+
+TRADE_JOURNAL_DIR = os.environ.get("TRADE_JOURNAL_DIR", "")
+JOURNAL_BATCH_SIZE = int(os.environ.get("JOURNAL_BATCH_SIZE", 500))     # orders per flush
+JOURNAL_LINGER = float(os.environ.get("JOURNAL_LINGER", 0.02))          # seconds to gather a burst
+JOURNAL_RETRY = 1.0          # seconds before retrying a user whose flush failed
+JOURNAL_VIEW_TTL = 30.0      # seconds a committed user view is trusted without pending orders
+JOURNAL_OUTCOMES = 10000     # finished orders remembered for status lookups and repeated keys
+
+JOURNAL_STATS = {
+    "acked": 0,
+    "rejected": 0,     # at acknowledgement
+    "filled": 0,
+    "failed": 0,       # rejected at flush
+    "retries": 0,
+    "replayed": 0,
+}
+
+_pending = OrderedDict()     # id -> order entry, oldest first
+_by_user = {}                # uid -> that user's pending entries, oldest first
+_outcomes = OrderedDict()    # id -> {"status", "error"?, "id", "uid", "side", "quantity", "price", "balance"}
+_committed = {}              # uid -> {"balance", "positions", "loaded"}
+_retry_at = {}               # uid -> monotonic time its next flush may run
+_lock = threading.RLock()
+_wake = threading.Event()
+_thread = None
+_journal = None
+
+
+def enabled():
+    return bool(TRADE_JOURNAL_DIR)
+
+
+class Journal:
+    """This process's journal file, with grouped fsyncs."""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        # Unique per process start: hostname and PID repeat across container restarts
+        name = f"{os.uname().nodename}-{os.getpid()}-{uuid.uuid4().hex[:12]}.journal"
+        self.path = os.path.join(directory, name)
+        self._file = open(self.path, "a", encoding="utf-8")
+        fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._write_lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self.written = 0   # lines written
+        self.synced = 0    # lines known to be on disk
+
+    def write(self, entries):
+        """Append entries (not yet durable); returns the position to sync() to."""
+        lines = "".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in entries)
+        with self._write_lock:
+            self._file.write(lines)
+            self._file.flush()
+            self.written += len(entries)
+            return self.written
+
+    def sync(self, position):
+        """Block until every line up to `position` is on disk."""
+        with self._sync_lock:
+            if self.synced >= position:
+                return   # an fsync that started after our write already covered it
+            target = self.written
+            os.fsync(self._file.fileno())
+            self.synced = target
+
+    def append(self, entries):
+        self.sync(self.write(entries))
+
+    def truncate(self):
+        with self._write_lock:
+            self._file.truncate(0)
+
+
+def _read(path):
+    """Orders in a journal file that have no "done" line, in order."""
+    orders = OrderedDict()
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break   # torn last line from a crash; it was never acknowledged
+            if entry.get("op") == "order":
+                orders[entry["id"]] = entry
+            else:
+                orders.pop(entry.get("id"), None)
+    return list(orders.values())
+
+
+def _replay(journal):
+    """Adopt the unfinished orders of journals no live process holds."""
+    for name in sorted(os.listdir(TRADE_JOURNAL_DIR)):
+        path = os.path.join(TRADE_JOURNAL_DIR, name)
+        if not name.endswith(".journal") or path == journal.path:
+            continue
+        with open(path, "a+", encoding="utf-8") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                continue   # its process is still running
+            orders = [dict(entry, check=True) for entry in _read(path)]
+            if orders:
+                journal.append(orders)
+                with _lock:
+                    for entry in orders:
+                        _add(dict(entry, balance=None, position=0))
+                    JOURNAL_STATS["replayed"] += len(orders)
+                log.info("Replayed %d journaled orders from %s", len(orders), name)
+            os.unlink(path)
+
+
+# ---- the worker's view of a user ----
+def _stale(uid):
+    """True if the committed view of `uid` must be (re)loaded. Caller holds _lock."""
+    committed = _committed.get(uid)
+    if committed is None:
+        return True
+    return uid not in _by_user and time.monotonic() - committed["loaded"] > JOURNAL_VIEW_TTL
+
+
+def _load(db, uid):
+    doc = db.collection("users").document(uid).get()
+    if not doc.exists:
+        raise TradeRejected(404, {"error": "User not found"})
+    data = doc.to_dict() or {}
+    positions = data.get("positions")
+    if positions is None:
+        positions = positions_from_trades([t.to_dict() for t in doc.reference.collection("trades").stream()])
+    with _lock:
+        if uid not in _committed or _stale(uid):
+            _remember(uid, float(data.get("balance") or 0.0), positions)
+
+
+def _add(entry):
+    """Caller holds _lock."""
+    if entry["id"] not in _pending:
+        _pending[entry["id"]] = entry
+        _by_user.setdefault(entry["uid"], []).append(entry)
+
+
+def _drop(entry):
+    """Caller holds _lock."""
+    del _pending[entry["id"]]
+    waiting = _by_user[entry["uid"]]
+    waiting.remove(entry)
+    if not waiting:
+        del _by_user[entry["uid"]]
+
+
+def _remember(uid, balance, positions):
+    _committed[uid] = {"balance": balance, "positions": positions, "loaded": time.monotonic()}
+
+
+def _view(uid):
+    """Balance and positions after the committed state and every pending order. Caller holds _lock."""
+    committed = _committed[uid]
+    balance, positions = committed["balance"], dict(committed["positions"])
+    for e in _by_user.get(uid, ()):
+        if e["side"] == "buy":
+            balance = round(balance - e["price"] * e["quantity"], 2)
+            positions[e["symbol"]] = apply_buy(positions.get(e["symbol"]), e["quantity"], e["price"])
+        else:
+            balance = round(balance + e["price"] * e["quantity"], 2)
+            positions[e["symbol"]] = apply_sell(positions.get(e["symbol"]), e["quantity"], e["price"])
+    return balance, positions
+
+
+# ---- acknowledging ----
+def _order_id(uid, key):
+    if not key:
+        return uuid.uuid4().hex
+    return hashlib.sha256(f"{uid}\0{key}".encode()).hexdigest()[:32]
+
+
+def _ack(entry, balance):
+    total = round(entry["price"] * entry["quantity"], 2)
+    ack = {
+        "id": entry["id"],
+        "status": status(entry["id"])["status"],
+        "totalCost" if entry["side"] == "buy" else "sellValue": total,
+    }
+    if balance is not None:
+        ack["balance"] = balance
+    return ack
+
+
+def submit(db, uid, side, symbol, quantity, client_price=None, record=None, key=None):
+    """
+    Validate an order against this worker's view of `uid`, journal it and
+    return the acknowledgement {"id", "status", "balance"?, "totalCost" |
+    "sellValue"}. Raises TradeRejected like execute_buy/execute_sell.
+    """
+    ensure_flusher()
+    order_id = _order_id(uid, key)
+    with _lock:
+        repeated = _pending.get(order_id) or _outcomes.get(order_id)
+        stale = _stale(uid)
+    if repeated is not None:
+        return _ack(repeated, repeated.get("balance"))
+
+    # The user document is only read for a user this worker hasn't seen lately
+    if stale:
+        _load(db, uid)
+    price = get_price(symbol)
+    if price is None:
+        raise TradeRejected(500, {"error": "Could not fetch price for symbol"})
+    entry = {
+        "op": "order",
+        "id": order_id,
+        "uid": uid,
+        "side": side,
+        "symbol": symbol,
+        "quantity": quantity,
+        "price": price,
+        "clientPrice": client_price,
+        "record": record,
+        "ts": time.time(),
+        "check": bool(key),
+    }
+    with _lock:
+        if order_id in _pending:
+            return _ack(_pending[order_id], _pending[order_id]["balance"])
+        if uid not in _committed:
+            raise TradeRejected(404, {"error": "User not found"})   # dropped by a flush since _load
+        balance, positions = _view(uid)
+        if side == "buy" and price * quantity > balance:
+            JOURNAL_STATS["rejected"] += 1
+            raise TradeRejected(403, {
+                "error": "Insufficient balance",
+                "balance": balance,
+                "required": round(price * quantity, 2),
+            })
+        owned = float((positions.get(symbol) or {}).get("quantity", 0))
+        if side == "sell" and quantity > owned:
+            JOURNAL_STATS["rejected"] += 1
+            raise TradeRejected(403, {"error": "Insufficient shares", "owned": owned, "requested": quantity})
+        position = _journal.write([entry])
+        delta = -price * quantity if side == "buy" else price * quantity
+        entry["balance"] = round(balance + delta, 2)   # kept in memory only, for repeated keys
+        entry["position"] = position
+        _add(entry)
+    _journal.sync(position)
+    with _lock:
+        JOURNAL_STATS["acked"] += 1
+    _wake.set()
+    return _ack(entry, entry["balance"])
+
+
+def status(order_id):
+    """{"status": "pending" | "filled" | "rejected" | "unknown", "error"?} for an order id."""
+    with _lock:
+        if order_id in _pending:
+            return {"status": "pending"}
+        found = _outcomes.get(order_id)
+    if found is None:
+        return {"status": "unknown"}
+    return {k: v for k, v in found.items() if k in ("status", "error")}
+
+
+# ---- flushing ----
+def _never_commits():
+    """Errors that say the orders themselves are bad (malformed entries), so retrying can't help."""
+    from google.api_core.exceptions import InvalidArgument
+    return KeyError, TypeError, ValueError, InvalidArgument
+
+
+def _flush_user(db, uid, entries):
+    """
+    (outcomes, committed state) for one user's orders, or None to retry them
+    later (contention, an outage, an unknown commit result). Orders that can
+    never commit are rejected: a batch that fails that way is retried one
+    order at a time, so only the bad ones are.
+    """
+    try:
+        return execute_batch(db, uid, [{k: v for k, v in e.items() if k not in ("balance", "position")}
+                                       for e in entries])
+    except TradeConflict as e:
+        log.warning("Journal flush for %s kept conflicting: %s", uid, e)
+        return None
+    except _never_commits() as e:
+        if len(entries) == 1:
+            log.error("Journaled order %s for %s can't be committed, rejecting it: %r",
+                      entries[0]["id"], uid, e)
+            return {entries[0]["id"]: {"status": "rejected", "error": "Order could not be processed"}}, None
+        error = e
+    except Exception as e:
+        log.error("Journal flush for %s failed: %s", uid, e)
+        return None
+
+    log.warning("Journal flush for %s failed (%r); committing its orders one at a time", uid, error)
+    outcomes, state = {}, None
+    for entry in entries:
+        result = _flush_user(db, uid, [entry])
+        if result is None:
+            return None   # the ones already committed are found by their trade documents next time
+        outcomes.update(result[0])
+        state = result[1] or state
+    return outcomes, state
+
+
+def flush(db=None):
+    """Commit up to JOURNAL_BATCH_SIZE durable pending orders; returns how many finished."""
+    db = db or get_db()
+    now = time.monotonic()
+    with _lock:
+        batch, taken = OrderedDict(), 0
+        for entry in _pending.values():
+            if taken >= JOURNAL_BATCH_SIZE or entry["position"] > _journal.synced:
+                break
+            if _retry_at.get(entry["uid"], 0) <= now:
+                batch.setdefault(entry["uid"], []).append(entry)
+                taken += 1
+    if not batch:
+        return 0
+
+    results = fanout.gather(*((_flush_user, db, uid, entries) for uid, entries in batch.items()))
+    done = []
+    with _lock:
+        for (uid, entries), result in zip(batch.items(), results):
+            if result is None:
+                # Unknown whether it committed: look before writing next time
+                for entry in entries:
+                    entry["check"] = True
+                _retry_at[uid] = now + JOURNAL_RETRY
+                JOURNAL_STATS["retries"] += len(entries)
+                continue
+            outcomes, state = result
+            _retry_at.pop(uid, None)
+            for entry in entries:
+                outcome = outcomes[entry["id"]]
+                done.append(dict(outcome, op="done", id=entry["id"]))
+                _outcomes[entry["id"]] = dict(outcome, id=entry["id"], uid=uid, price=entry["price"], side=entry["side"],
+                                              quantity=entry["quantity"],
+                                              balance=outcome.get("balance", entry["balance"]))
+                JOURNAL_STATS["filled" if outcome["status"] == "filled" else "failed"] += 1
+                _drop(entry)
+            if state is not None:
+                _remember(uid, state["balance"], state["positions"])
+            else:
+                _committed.pop(uid, None)
+        while len(_outcomes) > JOURNAL_OUTCOMES:
+            _outcomes.popitem(last=False)
+        position = _journal.write(done) if done else 0
+    if done:
+        _journal.sync(position)
+        with _lock:
+            # Only once the outcomes are on disk; an order written since keeps the file
+            if not _pending:
+                _journal.truncate()
+    return len(done)
+
+
+def _run():
+    while True:
+        _wake.wait()
+        time.sleep(JOURNAL_LINGER)
+        _wake.clear()
+        try:
+            flush()
+        except Exception as e:
+            log.error("Journal flush failed: %s", e)
+        with _lock:
+            remaining = bool(_pending)
+        if remaining:
+            time.sleep(min(JOURNAL_RETRY, max(JOURNAL_LINGER, 0.01)))
+            _wake.set()
+
+
+def ensure_flusher():
+    """Open this process's journal, replay abandoned ones and start the flusher, once."""
+    global _journal, _thread
+    with _lock:
+        if _journal is None:
+            _journal = Journal(TRADE_JOURNAL_DIR)
+            _replay(_journal)
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name="journal-flusher", daemon=True)
+            _thread.start()
+            _wake.set()
+
+
+def lag():
+    """(pending orders, seconds since the oldest was acknowledged)."""
+    with _lock:
+        oldest = next(iter(_pending.values()), None)
+        return len(_pending), (time.time() - oldest["ts"]) if oldest else 0.0
@@ -0,0 +1,75 @@
+"""
+Deferred imports and the import-time report.
+
+Heavy libraries (pandas, the Firebase SDK) are bound at module level as
+LazyModule proxies and only imported on first attribute access, so booting a
+worker doesn't pay for code paths it hasn't served yet. Every timed import,
+eager (the blueprint modules imported by create_app) or lazy, is recorded in
+IMPORT_TIMES in load order:
+
+    flask --app app import-report
+"""
+import sys
+import time
+import logging
+import importlib
+import threading
+
+import click
+
+log = logging.getLogger(__name__)
+
+IMPORT_TIMES = {}  # module name -> seconds to import (inclusive of anything it pulled in first)
+_lock = threading.RLock()
+
+
+def timed_import(name):
+    """importlib.import_module(name), recording the time if this call loaded it.
+    A module already pulled in by an earlier import isn't listed on its own."""
+    with _lock:
+        loaded = name in sys.modules
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        elapsed = time.perf_counter() - started
+        if not loaded:
+            IMPORT_TIMES[name] = elapsed
+            log.info("Imported %s in %.1f ms", name, elapsed * 1000)
+    return module
+
+
+class LazyModule:
+    """Stands in for a module until an attribute is first used."""
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def __getattr__(self, attr):
+        module = self._module
+        if module is None:
+            module = self._module = timed_import(self._name)
+        return getattr(module, attr)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy(name):
+    return LazyModule(name)
+
+
+def report():
+    """[(module, milliseconds)] in load order."""
+    return [(name, round(seconds * 1000, 1)) for name, seconds in IMPORT_TIMES.items()]
+
+
+@click.command("import-report")
+def import_report_command():
+    """Print how long each timed module took to import in this process."""
+    # Load the lazy modules too so their cost shows up
+    for name in ("pandas", "firebase_admin.firestore", "firebase_admin.auth"):
+        timed_import(name)
+    for name, ms in report():
+        click.echo(f"{ms:>9.1f} ms  {name}")
+    click.echo(f"{sum(ms for _, ms in report()):>9.1f} ms  total")
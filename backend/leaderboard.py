@@ -0,0 +1,274 @@
+"""
+Leaderboard of all users by equity and by return.
+
+    equity    = cash balance + open positions at market price
+    returnPct = (equity - starting balance) / starting balance * 100
+
+Each entry keeps the user's cash and holdings. execute_buy/execute_sell call
+update() after each commit, which moves one user in two sorted lists
+(bisect), so top(100) is a slice. Every LEADERBOARD_REVALUE seconds the
+syncer thread marks every held symbol to the cached market quote
+(backend.quotes) and re-sorts the board, so unrealized gains and losses
+count. A symbol with no quote yet is valued at its cost basis.
+
+Workers publish their changes to backend.shared_cache and pick up everyone
+else's every LEADERBOARD_SYNC seconds. The shared store (SHARED_CACHE_PATH)
+persists the board across restarts; when it has no board (a new path, or
+/tmp wiped by a reboot) one worker's syncer thread rebuilds it from
+Firestore. Requests never wait for that: update() only records the change
+and top()/rank() serve whatever the board holds so far (empty until the
+first sync). Serving processes start the syncer at startup (app.py). The
+board can also be rebuilt by hand with
+
+    flask --app app leaderboard-rebuild
+"""
+import os
+import time
+import bisect
+import logging
+import threading
+
+import click
+
+from backend import shared_cache
+from backend.firebase import get_db
+from backend.quotes import get_quotes
+
+log = logging.getLogger(__name__)
+
+STARTING_BALANCE = 10000.0   # what /auth/register credits a new user
+LEADERBOARD_SYNC = float(os.environ.get("LEADERBOARD_SYNC", 30))  # seconds between shared-store syncs
+LEADERBOARD_REVALUE = float(os.environ.get("LEADERBOARD_REVALUE", 60))  # seconds between re-marks to market
+LEADERBOARD_MAX = 100
+LEADERBOARD_LEASE_TTL = 120  # seconds one worker may spend rebuilding from Firestore
+_KEEP = 10 * 365 * 86400     # shared-store lifetime of an entry
+
+RANKINGS = ("equity", "returnPct")
+
+# uid -> {"uid", "name", "cash", "holdings": {symbol: [quantity, cost basis]},
+#         "starting", "updated", "equity", "returnPct"}
+_entries = {}
+_ranked = {by: [] for by in RANKINGS}   # by -> sorted [(-value, uid)]
+_marks = {}                  # symbol -> last market price
+_dirty = set()
+_synced = None               # `stored` time of the newest shared entry seen; None until loaded
+_revalued = 0.0              # monotonic time of the last re-mark
+_lock = threading.RLock()
+_load_lock = threading.Lock()
+_loaded = False              # this process has made sure the shared store holds a board
+_thread = None
+
+
+def standing(user_data, positions):
+    """(name, cash, holdings, starting balance) for a user document and its positions map."""
+    holdings = {
+        symbol: [float(p["quantity"]), float(p.get("costBasis") or 0)]
+        for symbol, p in positions.items() if (p.get("quantity") or 0) > 0
+    }
+    return (user_data.get("name") or "", float(user_data.get("balance") or 0.0), holdings,
+            float(user_data.get("startingBalance") or STARTING_BALANCE))
+
+
+def _value(entry):
+    """Set entry's equity and returnPct from its holdings at the current marks. Caller holds _lock."""
+    equity = entry["cash"]
+    for symbol, (quantity, cost) in entry["holdings"].items():
+        mark = _marks.get(symbol)
+        equity += quantity * mark if mark is not None else cost
+    starting = entry["starting"]
+    entry["equity"] = round(equity, 2)
+    entry["returnPct"] = round((equity - starting) / starting * 100, 4) if starting else 0.0
+    return entry
+
+
+def _entry(uid, name, cash, holdings, starting, updated):
+    return {
+        "uid": uid,
+        "name": name,
+        "cash": round(cash, 2),
+        "holdings": holdings,
+        "starting": starting,
+        "updated": updated,
+    }
+
+
+def _apply(entry):
+    """Put `entry` into the board unless we already have a newer one. Caller holds _lock."""
+    uid = entry["uid"]
+    if "cash" not in entry:
+        return False   # written before entries carried holdings; the first-use rebuild replaces it
+    old = _entries.get(uid)
+    if old is not None:
+        if old["updated"] > entry["updated"]:
+            return False
+        for by, ranked in _ranked.items():
+            i = bisect.bisect_left(ranked, (-old[by], uid))
+            if i < len(ranked) and ranked[i][1] == uid:
+                del ranked[i]
+    entry = _value(dict(entry))
+    _entries[uid] = entry
+    for by, ranked in _ranked.items():
+        bisect.insort(ranked, (-entry[by], uid))
+    return True
+
+
+def update(uid, name, cash, holdings, starting=STARTING_BALANCE):
+    """Record a user's new standing after a committed trade."""
+    with _lock:
+        _apply(_entry(uid, name, cash, holdings, starting, time.time()))
+        _dirty.add(uid)
+    ensure_syncer()
+
+
+# ---- marking to market ----
+def revalue():
+    """Re-mark every held symbol to the cached market quote and re-sort the board."""
+    global _revalued
+    with _lock:
+        symbols = sorted({symbol for e in _entries.values() for symbol in e["holdings"]})
+    marks = {q["symbol"]: q["price"] for q in get_quotes(symbols) if q["price"] is not None} if symbols else {}
+    with _lock:
+        _marks.clear()
+        _marks.update(marks)
+        for entry in _entries.values():
+            _value(entry)
+        for by in RANKINGS:
+            _ranked[by] = sorted((-e[by], uid) for uid, e in _entries.items())
+        _revalued = time.monotonic()
+    return len(marks)
+
+
+# ---- cross-worker sync and persistence ----
+def _publishable(entry):
+    return {k: v for k, v in entry.items() if k not in ("equity", "returnPct")}
+
+
+def _load_or_rebuild():
+    """Make sure the shared store holds a board, rebuilding it from Firestore if it has none."""
+    global _loaded
+    with _load_lock:
+        if _loaded:
+            return
+        if shared_cache.get("leaderboard-built") is None:
+            if shared_cache.acquire("leaderboard-built", LEADERBOARD_LEASE_TTL):
+                rebuild_here = True
+            else:
+                shared_cache.wait_released(["leaderboard-built"], LEADERBOARD_LEASE_TTL)
+                rebuild_here = shared_cache.get("leaderboard-built") is None
+            if rebuild_here:
+                try:
+                    count = rebuild(get_db())
+                    log.info("Leaderboard rebuilt from Firestore for %d users", count)
+                finally:
+                    shared_cache.release("leaderboard-built")
+        _loaded = True
+
+
+def sync():
+    """Publish this worker's changes and apply everyone else's since the last sync."""
+    global _synced
+    with _lock:
+        first = _synced is None
+    if first:
+        _load_or_rebuild()
+    with _lock:
+        changed = {f"leaderboard:{uid}": _publishable(_entries[uid]) for uid in _dirty}
+        _dirty.clear()
+        since = _synced or 0.0
+    shared_cache.put_many(changed, _KEEP)
+    found = shared_cache.get_prefix("leaderboard:", since=since)
+    with _lock:
+        for found_entry, _ in found.values():
+            _apply(found_entry)
+        # Overlap a little so a write that landed during this sync isn't skipped
+        newest = max((stored for _, stored in found.values()), default=since)
+        _synced = max(since, newest - 1.0)
+
+
+def _run():
+    # The first sync loads (or rebuilds) the board, waiting on another worker's rebuild if need be
+    while True:
+        try:
+            sync()
+        except Exception as e:
+            log.warning("Leaderboard sync failed: %s", e)
+        try:
+            if time.monotonic() - _revalued >= LEADERBOARD_REVALUE:
+                revalue()
+        except Exception as e:
+            log.warning("Leaderboard revalue failed: %s", e)
+        time.sleep(min(LEADERBOARD_SYNC, LEADERBOARD_REVALUE))
+
+
+def ensure_syncer():
+    """Start the syncer thread if it isn't running; never syncs on the caller's thread."""
+    global _thread
+    with _lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_run, name="leaderboard-sync", daemon=True)
+            _thread.start()
+
+
+# ---- reads ----
+def top(count=LEADERBOARD_MAX, by="equity"):
+    """The first `count` entries by `by` ("equity" or "returnPct"), each with its rank."""
+    ensure_syncer()
+    with _lock:
+        head = _ranked[by][:count]
+        return [dict(_entries[uid], rank=i + 1) for i, (_, uid) in enumerate(head)]
+
+
+def rank(uid, by="equity"):
+    """1-based rank of `uid` by `by`, or None if they aren't on the board."""
+    ensure_syncer()
+    with _lock:
+        entry = _entries.get(uid)
+        if entry is None:
+            return None
+        return bisect.bisect_left(_ranked[by], (-entry[by], uid)) + 1
+
+
+def user_entry(uid):
+    with _lock:
+        found = _entries.get(uid)
+        return dict(found) if found else None
+
+
+# ---- rebuild ----
+def rebuild(db):
+    """Recompute every user's standing from the user documents; returns the user count."""
+    from backend.positions import positions_from_trades
+
+    now = time.time()
+    rebuilt = {}
+    for doc in db.collection("users").stream():
+        user_data = doc.to_dict() or {}
+        positions = user_data.get("positions")
+        if positions is None:
+            trades = doc.reference.collection("trades").stream()
+            positions = positions_from_trades([t.to_dict() for t in trades])
+        rebuilt[doc.id] = _entry(doc.id, *standing(user_data, positions), now)
+
+    with _lock:
+        # Trades recorded while the users were being read stay (and stay unpublished)
+        newer = [e for e in _entries.values() if e["updated"] > now]
+        _entries.clear()
+        for ranked in _ranked.values():
+            ranked.clear()
+        for rebuilt_entry in rebuilt.values():
+            _apply(rebuilt_entry)
+        for newer_entry in newer:
+            _apply(newer_entry)
+        _dirty.intersection_update(e["uid"] for e in newer)
+    shared_cache.delete_prefix("leaderboard:")
+    shared_cache.put_many({f"leaderboard:{uid}": e for uid, e in rebuilt.items()}, _KEEP)
+    shared_cache.put("leaderboard-built", now, _KEEP)
+    revalue()
+    return len(rebuilt)
+
+
+@click.command("leaderboard-rebuild")
+def rebuild_command():
+    """Rebuild the leaderboard from every user document."""
+    count = rebuild(get_db())
+    click.echo(f"Leaderboard rebuilt for {count} users")
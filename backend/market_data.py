@@ -0,0 +1,358 @@
+"""
+Market-data providers.
+
+All upstream market data (quotes, bars, the ticker universe) goes through the
+provider returned by get_provider(). The default wraps yfinance. Setting
+
+    MARKET_DATA_PROVIDER=synthetic
+
+swaps in a seeded random-walk generator so the whole app runs with no network,
+which is what load tests and latency reproductions should use. Synthetic knobs:
+
+    MARKET_DATA_SEED         seed for every generated series (default 42)
+    MARKET_DATA_LATENCY_MS   mean injected latency per upstream call (default 0)
+    MARKET_DATA_ERROR_RATE   probability an upstream call raises (default 0)
+
+Every provider implements the same four calls, shaped like yfinance output:
+    history(symbol, period=None, interval="1d", start=None) -> OHLCV DataFrame
+    info(symbol) -> {"currentPrice", "previousClose", "shortName"}
+    download(symbols, period, interval) -> (DataFrame with (field, symbol) columns, {symbol: error})
+    tickers() -> [{"symbol", "name"}, ...]
+"""
+import os
+import time
+import zlib
+import random
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+from backend.lazy import lazy
+from backend.metrics import timed_upstream
+
+pd = lazy("pandas")
+
+SP500_CONSTITUENTS_URL = "https://raw.githubusercontent.com/datasets/s-and-p-500-companies/master/data/constituents.csv"
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+class MarketDataError(Exception):
+    pass
+
+
+def download_errors(frame, symbols, period):
+    """{symbol: error} for symbols a multi-ticker download has no closes for."""
+    if frame is None or frame.empty:
+        return {symbol: "Download returned no data" for symbol in symbols}
+    closes = frame["Close"] if "Close" in frame.columns.get_level_values(0) else None
+    errors = {}
+    for symbol in symbols:
+        if closes is None or symbol not in closes.columns:
+            errors[symbol] = "Symbol missing from download (invalid or delisted?)"
+        elif closes[symbol].isna().all():
+            errors[symbol] = f"No closes in the last {period} (delisted or not trading?)"
+    return errors
+
+
+def parse_constituents(text):
+    """[{symbol, name}] from the constituents CSV (Symbol,Name,Sector)."""
+    tickers = []
+    seen = set()
+    for line in text.strip().splitlines()[1:]:  # skip header
+        parts = line.split(",")
+        if len(parts) >= 2:
+            symbol = parts[0].strip()
+            name = parts[1].strip()
+            if symbol and symbol not in seen:
+                seen.add(symbol)
+                tickers.append({"symbol": symbol, "name": name})
+    return tickers
+
+
+class YFinanceProvider:
+    """Live data from Yahoo Finance (the app's original behavior)."""
+
+    name = "yfinance"
+
+    def history(self, symbol, period=None, interval="1d", start=None):
+        import yfinance as yf
+        ticker = yf.Ticker(symbol)
+        if start is not None:
+            return ticker.history(start=start, interval=interval)
+        return ticker.history(period=period, interval=interval)
+
+    def info(self, symbol):
+        import yfinance as yf
+        info = yf.Ticker(symbol).info or {}
+        return {
+            "currentPrice": info.get("currentPrice"),
+            "previousClose": info.get("previousClose"),
+            "shortName": info.get("shortName"),
+        }
+
+    def download(self, symbols, period, interval):
+        import yfinance as yf
+        frame = yf.download(
+            symbols, period=period, interval=interval, group_by="column",
+            threads=True, progress=False, multi_level_index=True,
+        )
+        # yfinance keeps per-symbol failures in its per-call download state,
+        # not in anything returned; read them off the frame instead
+        return frame, download_errors(frame, symbols, period)
+
+    def tickers(self):
+        from backend.trade import fetch_text_with_ua
+        return parse_constituents(fetch_text_with_ua(SP500_CONSTITUENTS_URL, timeout=10))
+
+
+class SyntheticProvider:
+    """
+    Deterministic random-walk market data.
+
+    Daily closes are a geometric random walk from ORIGIN seeded per symbol, so
+    the same (seed, symbol) always produces the same history. Intraday bars
+    are a Brownian bridge from each session's open to its close, also seeded
+    per day, so 5m/15m bars agree with the daily series. Sessions are
+    09:30-16:00 America/New_York on weekdays; bars after "now" don't exist yet.
+    """
+
+    name = "synthetic"
+    ORIGIN = "2015-01-02"
+    TZ = "America/New_York"
+    SESSION_MINUTES = 390
+    INTERVAL_MINUTES = {"1m": 1, "5m": 5, "15m": 15, "30m": 30, "1h": 60}
+    PERIOD_DAYS = {"1d": 1, "5d": 5, "1mo": 31, "3mo": 92, "6mo": 183, "1y": 366, "2y": 731, "5y": 1827}
+
+    def __init__(self, seed=42, latency_ms=0.0, error_rate=0.0):
+        self.seed = int(seed)
+        self.latency_ms = float(latency_ms)
+        self.error_rate = float(error_rate)
+        self._chaos = random.Random(self.seed)
+        self._chaos_lock = threading.Lock()
+
+    # ---- injected latency / errors ----
+    def _upstream_call(self):
+        with self._chaos_lock:
+            delay = self._chaos.expovariate(1.0 / self.latency_ms) if self.latency_ms > 0 else 0.0
+            fail = self._chaos.random() < self.error_rate
+        if delay:
+            time.sleep(delay / 1000.0)
+        if fail:
+            raise MarketDataError("Injected synthetic market data error")
+
+    # ---- series generation ----
+    def _symbol_key(self, symbol):
+        return zlib.crc32(symbol.upper().encode())
+
+    def _rng(self, symbol, *stream):
+        return np.random.default_rng([self.seed, self._symbol_key(symbol), *stream])
+
+    @lru_cache(maxsize=1024)
+    def _daily(self, symbol, through):
+        """Daily OHLCV from ORIGIN through the `through` date (inclusive), plus daily vol."""
+        days = pd.bdate_range(self.ORIGIN, through)
+        n = len(days)
+        params = self._rng(symbol, 0)
+        base = float(np.exp(params.uniform(np.log(15), np.log(600))))
+        vol = params.uniform(0.01, 0.03)
+        drift = params.normal(0.0003, 0.0002)
+        # One generator per series: extending `through` only appends, old bars never change
+        close = base * np.exp(np.cumsum(self._rng(symbol, 1).normal(drift, vol, size=n)))
+        gap = self._rng(symbol, 2).normal(0, vol / 4, size=n)
+        open_ = np.concatenate([[base], close[:-1]]) * np.exp(gap)
+        high = np.maximum(open_, close) * (1 + np.abs(self._rng(symbol, 3).normal(0, vol / 2, size=n)))
+        low = np.minimum(open_, close) * (1 - np.abs(self._rng(symbol, 4).normal(0, vol / 2, size=n)))
+        volume = np.round(self._rng(symbol, 5).lognormal(15, 0.5, size=n))
+        frame = pd.DataFrame(
+            {"Open": open_, "High": high, "Low": low, "Close": close, "Volume": volume},
+            index=days.tz_localize(self.TZ),
+        )
+        return frame, vol
+
+    def _intraday_day(self, symbol, day, minutes, daily_row, vol):
+        """One session of intraday bars as a Brownian bridge from open to close."""
+        n = self.SESSION_MINUTES // minutes
+        rng = self._rng(symbol, 6, day.toordinal(), minutes)
+        steps = rng.normal(0, 1, size=n)
+        walk = np.concatenate([[0.0], np.cumsum(steps)])
+        frac = np.arange(n + 1) / n
+        bridge = walk - frac * walk[-1]
+        log_open, log_close = np.log(daily_row["Open"]), np.log(daily_row["Close"])
+        path = np.exp(log_open + frac * (log_close - log_open) + bridge * vol / np.sqrt(n))
+        opens, closes = path[:-1], path[1:]
+        spread = np.abs(rng.normal(0, vol / np.sqrt(n) / 2, size=(2, n)))
+        start = pd.Timestamp(day).tz_localize(self.TZ) + pd.Timedelta(hours=9, minutes=30)
+        index = pd.date_range(start, periods=n, freq=f"{minutes}min")
+        return pd.DataFrame({
+            "Open": opens,
+            "High": np.maximum(opens, closes) * (1 + spread[0]),
+            "Low": np.minimum(opens, closes) * (1 - spread[1]),
+            "Close": closes,
+            "Volume": np.round(daily_row["Volume"] / n * rng.uniform(0.5, 1.5, size=n)),
+        }, index=index)
+
+    def _bars(self, symbol, interval, start, now):
+        today = now.tz_localize(None).normalize()
+        daily, vol = self._daily(symbol.upper(), today)
+        sessions = daily
+        # Today's daily bar only exists once the session has opened
+        opened = now >= today.tz_localize(self.TZ) + pd.Timedelta(hours=9, minutes=30)
+        if not opened:
+            daily = sessions = daily[daily.index.tz_localize(None) < today]
+        elif now < today.tz_localize(self.TZ) + pd.Timedelta(hours=16) and daily.index[-1].tz_localize(None) == today:
+            # Mid-session the daily bar is still forming: roll it up from intraday so far
+            session = self._intraday_day(symbol, today.date(), 5, daily.iloc[-1], vol)
+            session = session[session.index <= now]
+            daily = daily.copy()
+            daily.iloc[-1, daily.columns.get_indexer(["High", "Low", "Close", "Volume"])] = [
+                session["High"].max(), session["Low"].min(), session["Close"].iloc[-1], session["Volume"].sum(),
+            ]
+
+        if interval in ("1d", "1wk", "1mo"):
+            frame = daily[daily.index >= start.normalize()]
+            if interval == "1wk":
+                frame = frame.resample("W-MON", label="left", closed="left").agg(
+                    {"Open": "first", "High": "max", "Low": "min", "Close": "last", "Volume": "sum"}
+                ).dropna()
+            elif interval == "1mo":
+                frame = frame.resample("MS").agg(
+                    {"Open": "first", "High": "max", "Low": "min", "Close": "last", "Volume": "sum"}
+                ).dropna()
+            return frame
+
+        minutes = self.INTERVAL_MINUTES.get(interval)
+        if minutes is None:
+            raise MarketDataError(f"Unsupported interval {interval}")
+        # Intraday paths bridge to the full-day close, not the rolled-up partial bar
+        sessions = sessions[sessions.index >= start.normalize()]
+        frames = [
+            self._intraday_day(symbol, ts.date(), minutes, row, vol)
+            for ts, row in sessions.iterrows()
+        ]
+        if not frames:
+            return daily.iloc[0:0]
+        frame = pd.concat(frames)
+        return frame[(frame.index >= start) & (frame.index <= now)]
+
+    def _now(self):
+        return pd.Timestamp.now(tz=self.TZ).floor("s")
+
+    # ---- provider interface ----
+    def history(self, symbol, period=None, interval="1d", start=None):
+        self._upstream_call()
+        now = self._now()
+        if start is not None:
+            start = pd.Timestamp(start)
+            start = start.tz_localize(self.TZ) if start.tzinfo is None else start.tz_convert(self.TZ)
+        elif period in ("1d", "5d"):
+            # Trading sessions, not calendar days, like Yahoo
+            sessions = int(period[0])
+            days = pd.bdate_range(end=now.tz_localize(None).normalize(), periods=sessions + 1)
+            start = days[1 if now.hour * 60 + now.minute >= 570 or now.weekday() >= 5 else 0].tz_localize(self.TZ)
+        else:
+            start = now - pd.Timedelta(days=self.PERIOD_DAYS.get(period or "1mo", 31))
+        return self._bars(symbol, interval, start, now)
+
+    def info(self, symbol):
+        self._upstream_call()
+        now = self._now()
+        daily, _ = self._daily(symbol.upper(), now.tz_localize(None).normalize())
+        intraday = self._bars(symbol, "5m", now - pd.Timedelta(days=5), now)
+        current = float(intraday["Close"].iloc[-1]) if not intraday.empty else float(daily["Close"].iloc[-1])
+        session_day = intraday.index[-1].normalize() if not intraday.empty else daily.index[-1]
+        previous = daily[daily.index < session_day]
+        return {
+            "currentPrice": round(current, 4),
+            "previousClose": round(float(previous["Close"].iloc[-1]), 4) if not previous.empty else None,
+            "shortName": _builtin_names().get(symbol.upper(), symbol.upper()),
+        }
+
+    def download(self, symbols, period, interval):
+        self._upstream_call()
+        frames = {}
+        errors = {}
+        for symbol in symbols:
+            try:
+                with self._chaos_lock:
+                    fail = self._chaos.random() < self.error_rate
+                if fail:
+                    raise MarketDataError("Injected synthetic market data error")
+                now = self._now()
+                start = now - pd.Timedelta(days=self.PERIOD_DAYS.get(period, 31))
+                frames[symbol] = self._bars(symbol, interval, start, now)
+            except MarketDataError as e:
+                errors[symbol] = str(e)
+        if not frames:
+            return pd.DataFrame(), errors
+        frame = pd.concat(frames, axis=1).swaplevel(0, 1, axis=1).sort_index(axis=1)
+        return frame, errors
+
+    def tickers(self):
+        self._upstream_call()
+        from backend.trade import BUILTIN_TICKERS
+        return [dict(t) for t in BUILTIN_TICKERS]
+
+
+def _builtin_names():
+    from backend.trade import BUILTIN_TICKERS
+    return {t["symbol"]: t["name"] for t in BUILTIN_TICKERS}
+
+
+class InstrumentedProvider:
+    """Times every upstream call on the wrapped provider (see backend.metrics)."""
+
+    METHODS = ("history", "info", "download", "tickers")
+
+    def __init__(self, provider):
+        self.provider = provider
+        self.name = provider.name
+
+    def __getattr__(self, attr):
+        value = getattr(self.provider, attr)
+        if attr not in self.METHODS:
+            return value
+
+        def call(*args, **kwargs):
+            with timed_upstream(self.name, attr):
+                return value(*args, **kwargs)
+        return call
+
+
+def _instrumented(provider):
+    if provider is None or isinstance(provider, InstrumentedProvider):
+        return provider
+    return InstrumentedProvider(provider)
+
+
+def provider_from_env():
+    kind = os.environ.get("MARKET_DATA_PROVIDER", "yfinance").strip().lower()
+    if kind == "synthetic":
+        return SyntheticProvider(
+            seed=os.environ.get("MARKET_DATA_SEED", 42),
+            latency_ms=os.environ.get("MARKET_DATA_LATENCY_MS", 0),
+            error_rate=os.environ.get("MARKET_DATA_ERROR_RATE", 0),
+        )
+    if kind != "yfinance":
+        raise RuntimeError(f"Unknown MARKET_DATA_PROVIDER {kind!r}")
+    return YFinanceProvider()
+
+
+def get_provider():
+    """The process-wide provider, chosen from MARKET_DATA_PROVIDER on first use."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = _instrumented(provider_from_env())
+    return _provider
+
+
+def set_provider(provider):
+    """Install a provider explicitly (benchmarks, tests). Returns the previous one."""
+    global _provider
+    with _provider_lock:
+        previous, _provider = _provider, _instrumented(provider)
+    return previous
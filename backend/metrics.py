@@ -0,0 +1,293 @@
+"""
+In-process metrics, exposed in Prometheus text format on /metrics.
+
+    http_request_duration_seconds{blueprint, route, method, status}  histogram
+    http_requests_in_flight                                            gauge
+    upstream_call_duration_seconds{service, operation, outcome}        histogram
+    upstream_calls_in_flight{service}                                   gauge
+
+Request timing hooks are installed by init_app(app). Market-data calls are
+timed by backend.market_data (service = provider name, operation = history /
+info / download / tickers); Firestore calls by patching the client classes when the client is created
+(service = "firestore", operation = get / set / update / create / delete /
+add / stream / commit). Cache and subsystem state (quote cache hit ratio,
+SSE subscribers, ...) is read from registered collectors at scrape time.
+
+Everything is a dict lookup plus a bisect under a lock per observation, so it
+is cheap enough to leave on.
+"""
+import time
+import bisect
+import threading
+from functools import wraps
+
+from flask import Blueprint, Response, g, request
+
+metrics_bp = Blueprint("metrics", __name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _label_str(labels):
+    if not labels:
+        return ""
+    parts = []
+    for key, value in labels:
+        value = str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return "{" + ",".join(parts) + "}"
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}  # label values -> [bucket counts..., sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 2)
+            if index < len(self.buckets):
+                series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        with self._lock:
+            snapshot = {k: list(v) for k, v in self._series.items()}
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for label_values, series in sorted(snapshot.items()):
+            labels = list(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_label_str(labels + [('le', bound)])} {cumulative}")
+            lines.append(f"{self.name}_bucket{_label_str(labels + [('le', '+Inf')])} {series[-1]}")
+            lines.append(f"{self.name}_sum{_label_str(labels)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_label_str(labels)} {series[-1]}")
+        return lines
+
+
+class Gauge:
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values):
+        self.inc(*label_values, amount=-1)
+
+    def render(self):
+        with self._lock:
+            snapshot = dict(self._values)
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge"]
+        for label_values, value in sorted(snapshot.items()):
+            lines.append(f"{self.name}{_label_str(list(zip(self.label_names, label_values)))} {value}")
+        return lines
+
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route.",
+    ("blueprint", "route", "method", "status"),
+)
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled.")
+UPSTREAM_LATENCY = Histogram(
+    "upstream_call_duration_seconds", "Market data and Firestore call latency.",
+    ("service", "operation", "outcome"),
+)
+UPSTREAM_IN_FLIGHT = Gauge("upstream_calls_in_flight", "Upstream calls currently running.", ("service",))
+
+_METRICS = [REQUEST_LATENCY, REQUESTS_IN_FLIGHT, UPSTREAM_LATENCY, UPSTREAM_IN_FLIGHT]
+_collectors = []  # callables returning [(name, type, help, {labels tuple: value})]
+
+# Nested upstream calls (Firestore add -> create) are only counted once
+_local = threading.local()
+
+
+def register_collector(fn):
+    """Add a scrape-time collector: fn() -> [(name, type, help, {((label, value), ...): number})]."""
+    _collectors.append(fn)
+    return fn
+
+
+class timed_upstream:
+    """
+    Context manager timing one upstream call: with timed_upstream("yfinance", "history"): ...
+    Calls made inside a timed call are not counted again unless nested=True.
+    """
+
+    def __init__(self, service, operation, nested=False):
+        self.service = service
+        self.operation = operation
+        self.nested = nested
+
+    def __enter__(self):
+        self.outer = self.nested or not getattr(_local, "depth", 0)
+        if not self.nested:
+            _local.depth = getattr(_local, "depth", 0) + 1
+        if self.outer:
+            UPSTREAM_IN_FLIGHT.inc(self.service)
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self.nested:
+            _local.depth -= 1
+        if self.outer:
+            UPSTREAM_IN_FLIGHT.dec(self.service)
+            UPSTREAM_LATENCY.observe(time.perf_counter() - self.started, self.service, self.operation,
+                                     "error" if exc_type else "ok")
+        return False
+
+
+def _timed_stream(service, operation, fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        # Streams do their I/O while being iterated; time until exhausted. The
+        # caller runs other calls between items, so this timer doesn't suppress them.
+        timer = timed_upstream(service, operation, nested=True).__enter__()
+        try:
+            yield from fn(*args, **kwargs)
+        except GeneratorExit:
+            timer.__exit__(None, None, None)  # the caller stopped early
+            raise
+        except BaseException as e:
+            timer.__exit__(type(e), e, None)
+            raise
+        timer.__exit__(None, None, None)
+    return wrapper
+
+
+def _timed_call(service, operation, fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with timed_upstream(service, operation):
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+def instrument_firestore():
+    """Patch the Firestore client classes so every call is timed (idempotent)."""
+    from google.cloud.firestore_v1 import batch, collection, document, query, transaction
+
+    targets = [
+        (document.DocumentReference, ("get", "set", "update", "create", "delete")),
+        (collection.CollectionReference, ("add",)),
+        (batch.WriteBatch, ("commit",)),
+    ]
+    for cls, names in targets:
+        for name in names:
+            fn = getattr(cls, name)
+            if not getattr(fn, "_metrics_wrapped", False):
+                wrapped = _timed_call("firestore", name, fn)
+                wrapped._metrics_wrapped = True
+                setattr(cls, name, wrapped)
+
+    if not getattr(query.Query.stream, "_metrics_wrapped", False):
+        wrapped = _timed_stream("firestore", "stream", query.Query.stream)
+        wrapped._metrics_wrapped = True
+        query.Query.stream = wrapped
+    if not getattr(transaction.Transaction._commit, "_metrics_wrapped", False):
+        wrapped = _timed_call("firestore", "commit", transaction.Transaction._commit)
+        wrapped._metrics_wrapped = True
+        transaction.Transaction._commit = wrapped
+
+
+# ---- app state read at scrape time ----
+@register_collector
+def _app_state():
+    from backend import lazy, quotes, movers, indicators, journal
+    from backend.stream import hub
+
+    stats = quotes.cache_stats()
+    families = [
+        ("quote_cache_events_total", "counter", "Quote cache lookups and upstream fetches by kind.",
+         {(("kind", k),): stats[k] for k in quotes.QUOTE_STATS}),
+        ("quote_cache_hit_ratio", "gauge", "Fraction of quote lookups served from memory.",
+         {(): stats["hitRatio"]}),
+        ("quote_cache_entries", "gauge", "Symbols held in the quote cache.", {(): stats["size"]}),
+        ("quote_fetches_in_flight", "gauge", "Quote fetches other callers can wait on.", {(): stats["inflight"]}),
+        ("sse_subscribers", "gauge", "Open live-price streams.", {(): hub.subscriber_count()}),
+        ("sse_rejected_total", "counter", "Live-price streams refused at the per-worker cap.", {(): hub.rejected}),
+        ("indicator_cache_events_total", "counter", "Indicator series served, by how much was computed.",
+         {(("kind", k),): v for k, v in indicators.INDICATOR_STATS.items()}),
+    ]
+    families.append(("startup_import_seconds", "gauge", "Time spent importing each module in this process.",
+                     {(("module", name),): round(seconds, 6) for name, seconds in lazy.IMPORT_TIMES.items()}))
+    if journal.enabled():
+        pending, lag = journal.lag()
+        families += [
+            ("journal_events_total", "counter", "Journaled orders by what happened to them.",
+             {(("kind", k),): v for k, v in journal.JOURNAL_STATS.items()}),
+            ("journal_pending_orders", "gauge", "Acknowledged orders not yet committed to Firestore.", {(): pending}),
+            ("journal_lag_seconds", "gauge", "Age of the oldest acknowledged order not yet committed.",
+             {(): round(lag, 3)}),
+        ]
+    snapshot = movers.current()
+    if snapshot is not None:
+        families.append(("movers_snapshot_age_seconds", "gauge", "Age of the market movers snapshot.",
+                         {(): round(time.time() - snapshot["generated"], 3)}))
+    return families
+
+
+# ---- request hooks ----
+def _before_request():
+    g._metrics_started = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
+
+
+def _after_request(response):
+    g._metrics_status = response.status_code
+    return response
+
+
+def _teardown_request(exc):
+    started = g.pop("_metrics_started", None)
+    if started is None:
+        return
+    REQUESTS_IN_FLIGHT.dec()
+    route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    status = g.pop("_metrics_status", 500)
+    REQUEST_LATENCY.observe(time.perf_counter() - started, request.blueprint or "app", route,
+                            request.method, status)
+
+
+def init_app(app):
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    app.register_blueprint(metrics_bp)
+
+
+def render():
+    lines = []
+    for metric in _METRICS:
+        lines.extend(metric.render())
+    for collector in _collectors:
+        try:
+            families = collector()
+        except Exception:
+            continue  # a broken collector must not take /metrics down
+        for name, kind, help_text, samples in families:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples.items():
+                lines.append(f"{name}{_label_str(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+@metrics_bp.route("/metrics")
+def metrics():
+    return Response(render(), mimetype="text/plain; version=0.0.4")
@@ -0,0 +1,216 @@
+"""
+Market movers snapshot for the dashboard.
+
+A background thread periodically downloads the last few daily bars for the
+whole ticker universe (the list cached by backend.trade) in a few batched
+calls and ranks it into top gainers, top losers, most active and a random
+sample pool. Requests read the prebuilt snapshot from memory; until the
+first build lands they get an unpriced one over the builtin tickers, whose
+prices the dashboard fills in from the live-price feed.
+
+The snapshot is shared between worker processes through backend.shared_cache:
+a worker due for a refresh first takes a newer snapshot another worker has
+published, and only the worker holding the "movers" lease downloads the
+universe, so the host makes one set of downloads per MOVERS_REFRESH.
+"""
+import os
+import time
+import random
+import logging
+import threading
+
+import numpy as np
+
+from backend import fanout, shared_cache
+from backend.lazy import lazy
+from backend.market_data import get_provider
+from backend.quotes import last_two
+
+pd = lazy("pandas")
+
+log = logging.getLogger(__name__)
+
+MOVERS_REFRESH = float(os.environ.get("MOVERS_REFRESH", 300))  # seconds between snapshots
+MOVERS_TOP_N = 10
+MOVERS_SAMPLE_SIZE = 50   # pool the random watchlist is drawn from
+MOVERS_CHUNK = 100        # symbols per upstream download
+MOVERS_LEASE_TTL = 60     # seconds one worker may spend building for everyone
+
+_snapshot = None
+_built_from = None        # the ticker list object the snapshot ranked
+_wake = threading.Event()
+_build_lock = threading.Lock()
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def _universe():
+    from backend.trade import TICKER_CACHE, BUILTIN_TICKERS
+    return TICKER_CACHE["tickers"] or BUILTIN_TICKERS
+
+
+def _download_chunk(chunk):
+    try:
+        frame, _ = get_provider().download(chunk, period="5d", interval="1d")
+    except Exception as e:
+        log.warning("Movers download failed for %d symbols: %s", len(chunk), e)
+        return None
+    return frame
+
+
+def _download(symbols):
+    """(closes, volumes) frames with one column per symbol, chunks downloaded concurrently."""
+    chunks = [symbols[i:i + MOVERS_CHUNK] for i in range(0, len(symbols), MOVERS_CHUNK)]
+    frames = fanout.gather(*((_download_chunk, chunk) for chunk in chunks))
+    closes, volumes = [], []
+    for chunk, frame in zip(chunks, frames):
+        if frame is None or frame.empty:
+            continue
+        for field, out in (("Close", closes), ("Volume", volumes)):
+            part = frame[field]
+            if isinstance(part, pd.Series):
+                part = part.to_frame(chunk[0])
+            out.append(part)
+    if not closes:
+        empty = pd.DataFrame(columns=symbols, dtype=float)
+        return empty, empty
+    return (pd.concat(closes, axis=1).reindex(columns=symbols).astype(float),
+            pd.concat(volumes, axis=1).reindex(columns=symbols).astype(float))
+
+
+def build_snapshot(tickers):
+    """Rank `tickers` ([{symbol, name}]) by today's move and volume."""
+    names = {t["symbol"]: t.get("name") or t["symbol"] for t in tickers}
+    symbols = list(names)
+    closes, volumes = _download(symbols)
+
+    price, prev_close = last_two(closes)
+    volume, _ = last_two(volumes)
+    change = price - prev_close
+    change_percent = change / prev_close.where(prev_close > 0) * 100
+
+    table = pd.DataFrame({
+        "price": price, "previousClose": prev_close, "change": change,
+        "changePercent": change_percent, "volume": volume,
+    }).dropna(subset=["price", "previousClose"])
+    table = table[np.isfinite(table["changePercent"])]
+
+    def rows(frame):
+        return [{
+            "name": names[symbol],
+            "symbol": symbol,
+            "price": round(r.price, 2),
+            "previousClose": round(r.previousClose, 2),
+            "change": round(r.change, 2),
+            "changePercent": round(r.changePercent, 2),
+            "volume": int(r.volume) if pd.notna(r.volume) else None,
+        } for symbol, r in zip(frame.index, frame.itertuples())]
+
+    by_move = table.sort_values("changePercent")
+    sample = table.sample(n=min(MOVERS_SAMPLE_SIZE, len(table))) if len(table) else table
+    return {
+        "generated": time.time(),
+        "universe": len(symbols),
+        "priced": len(table),
+        "gainers": rows(by_move.iloc[::-1].head(MOVERS_TOP_N)),
+        "losers": rows(by_move.head(MOVERS_TOP_N)),
+        "active": rows(table.nlargest(MOVERS_TOP_N, "volume")),
+        "sample": rows(sample),
+    }
+
+
+def _shared_snapshot(tickers):
+    """A snapshot of this universe published by any worker since ours, or None."""
+    found = shared_cache.get("movers")
+    if found is None:
+        return None
+    snapshot = found[0]
+    if snapshot.get("universe") != len(tickers):
+        return None
+    if _snapshot is not None and snapshot["generated"] <= _snapshot["generated"]:
+        return None
+    return snapshot
+
+
+def _build():
+    global _snapshot, _built_from
+    tickers = _universe()
+    snapshot = _shared_snapshot(tickers)
+    if snapshot is None and not shared_cache.acquire("movers", MOVERS_LEASE_TTL):
+        shared_cache.wait_released(["movers"], MOVERS_LEASE_TTL)
+        snapshot = _shared_snapshot(tickers)
+
+    if snapshot is not None:
+        log.info("Movers snapshot loaded from shared cache: %d/%d symbols priced",
+                 snapshot["priced"], snapshot["universe"])
+    else:
+        try:
+            snapshot = build_snapshot(tickers)
+            shared_cache.put("movers", snapshot, MOVERS_REFRESH, stored=snapshot["generated"])
+        finally:
+            shared_cache.release("movers")
+        log.info("Movers snapshot built: %d/%d symbols priced", snapshot["priced"], snapshot["universe"])
+    _snapshot, _built_from = snapshot, tickers
+    return _snapshot
+
+
+def refresh():
+    """Rebuild the snapshot now (one builder at a time)."""
+    with _build_lock:
+        return _build()
+
+
+def _placeholder():
+    """Unpriced snapshot of the builtin tickers, served before the first build."""
+    from backend.trade import BUILTIN_TICKERS
+    rows = [{"name": t["name"], "symbol": t["symbol"], "price": None, "previousClose": None,
+             "change": None, "changePercent": None, "volume": None} for t in BUILTIN_TICKERS]
+    return {"generated": None, "universe": len(rows), "priced": 0,
+            "gainers": [], "losers": [], "active": [], "sample": rows}
+
+
+def _run():
+    while True:
+        _wake.wait(MOVERS_REFRESH)
+        _wake.clear()
+        try:
+            refresh()
+        except Exception as e:
+            log.error("Movers refresh failed, keeping previous snapshot: %s", e)
+
+
+def _ensure_refresher():
+    """Start the refresher thread; its first pass builds the snapshot straight away."""
+    global _thread
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            if _snapshot is None:
+                _wake.set()
+            _thread = threading.Thread(target=_run, name="movers-refresher", daemon=True)
+            _thread.start()
+
+
+def current():
+    """The latest snapshot without building one, or None."""
+    return _snapshot
+
+
+def get_snapshot():
+    """
+    Current snapshot, never built on the request thread: before the
+    refresher's first build finishes this is the unpriced builtin one.
+    """
+    snapshot = _snapshot
+    if snapshot is None:
+        snapshot = _placeholder()
+    elif _universe() is not _built_from:
+        # The full ticker list landed after we ranked the builtin one
+        _wake.set()
+    _ensure_refresher()
+    return snapshot
+
+
+def watchlist(count=5):
+    """`count` random rows from the snapshot's sample pool."""
+    pool = get_snapshot()["sample"]
+    return random.sample(pool, min(count, len(pool)))
@@ -0,0 +1,347 @@
+"""
+Resting limit and stop orders.
+
+    users/{uid}/orders/{id} = {
+        uid, symbol, side: "buy" | "sell", type: "limit" | "stop",
+        quantity, triggerPrice, status: "open" | "filled" | "cancelled" | "rejected",
+        created, fillPrice, filledAt, tradeSeq, error
+    }
+
+    buy  limit  fills once price <= triggerPrice
+    sell stop   fills once price <= triggerPrice
+    sell limit  fills once price >= triggerPrice
+    buy  stop   fills once price >= triggerPrice
+
+The trigger engine keeps every open order in a per-symbol OrderBook of two
+lists sorted by trigger price, one per direction. It listens to the price
+hub, so each changed quote costs two bisects plus the orders it actually
+crossed, however many orders are resting. Fills run through
+execute_buy/execute_sell at the tick price like a market order, with the
+order marked filled in the same transaction, so an order can't fill twice
+and a cancelled order can't fill at all. Balance and holdings are checked
+at fill time; an order that fails them is marked rejected.
+
+One worker runs the engine at a time (an "orders-engine" lease in
+backend.shared_cache, renewed every ORDERS_LEASE_RENEW seconds). It loads
+the open orders once and then follows them with a Firestore listener on the
+same collection-group query, which is how it learns about orders placed,
+filled or cancelled on other workers without re-reading the rest. Clients
+that can't listen (the bench's in-memory Firestore) reload on each renewal.
+"""
+import os
+import time
+import bisect
+import logging
+import itertools
+import threading
+
+from backend import fanout, shared_cache
+from backend.execution import execute_buy, execute_sell, TradeRejected
+from backend.firebase import get_db, firestore
+from backend.quotes import normalize_symbol
+from backend.stream import hub
+
+log = logging.getLogger(__name__)
+
+ORDERS_LEASE_RENEW = float(os.environ.get("ORDERS_LEASE_RENEW", 30))  # seconds between engine lease renewals
+ORDER_SIDES = ("buy", "sell")
+ORDER_TYPES = ("limit", "stop")
+MAX_OPEN_ORDERS = 200   # per user
+
+_INF = float("inf")
+
+
+def _fires_below(order):
+    """True if the order triggers when the price falls to its trigger (buy limit, sell stop)."""
+    return (order["side"] == "buy") == (order["type"] == "limit")
+
+
+class OrderBook:
+    """Open orders for one symbol, as (triggerPrice, arrival, id) in two sorted lists."""
+
+    def __init__(self):
+        self.below = []   # fire when price <= trigger
+        self.above = []   # fire when price >= trigger
+
+    def __len__(self):
+        return len(self.below) + len(self.above)
+
+    def _side(self, order):
+        return self.below if _fires_below(order) else self.above
+
+    def add(self, order, arrival):
+        bisect.insort(self._side(order), (order["triggerPrice"], arrival, order["id"]))
+
+    def remove(self, order, arrival):
+        side = self._side(order)
+        key = (order["triggerPrice"], arrival, order["id"])
+        i = bisect.bisect_left(side, key)
+        if i < len(side) and side[i] == key:
+            del side[i]
+
+    def crossed(self, price):
+        """Remove and return the ids of every order `price` triggers, oldest first per level."""
+        i = bisect.bisect_left(self.below, (price,))
+        j = bisect.bisect_right(self.above, (price, _INF))
+        fired = self.below[i:] + self.above[:j]
+        del self.below[i:]
+        del self.above[:j]
+        return [order_id for _, _, order_id in fired]
+
+
+class TriggerEngine:
+    def __init__(self):
+        self._books = {}      # symbol -> OrderBook
+        self._orders = {}     # id -> (order, arrival)
+        self._arrivals = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._orders)
+
+    def symbols(self):
+        with self._lock:
+            return [s for s, book in self._books.items() if book]
+
+    def mark(self):
+        """Arrival number to pass to replace(), taken before loading orders."""
+        return next(self._arrivals)
+
+    def add(self, order, check_last=True):
+        with self._lock:
+            if order["id"] in self._orders:
+                return
+            arrival = next(self._arrivals)
+            self._orders[order["id"]] = (order, arrival)
+            self._books.setdefault(order["symbol"], OrderBook()).add(order, arrival)
+        # Already crossed at the last known price: fire without waiting for a change
+        quote = hub.last_quote(order["symbol"]) if check_last else None
+        if quote is not None:
+            self.on_quotes({order["symbol"]: quote})
+        hub.poke()
+
+    def discard(self, order_id):
+        with self._lock:
+            found = self._orders.pop(order_id, None)
+            if found is not None:
+                order, arrival = found
+                self._books[order["symbol"]].remove(order, arrival)
+
+    def replace(self, orders, since=None):
+        """Swap in a freshly loaded set of open orders, keeping ones added after mark() `since`."""
+        with self._lock:
+            kept = [order for order, arrival in self._orders.values() if since is not None and arrival > since]
+            self._books, self._orders = {}, {}
+            for order in list(orders) + kept:
+                if order["id"] in self._orders:
+                    continue
+                arrival = next(self._arrivals)
+                self._orders[order["id"]] = (order, arrival)
+                self._books.setdefault(order["symbol"], OrderBook()).add(order, arrival)
+
+    def on_quotes(self, quotes):
+        """Price hub listener: fill every order the new prices crossed."""
+        fired = []
+        with self._lock:
+            for symbol, quote in quotes.items():
+                book = self._books.get(symbol)
+                if not book or quote.get("price") is None:
+                    continue
+                for order_id in book.crossed(quote["price"]):
+                    order, _ = self._orders.pop(order_id)
+                    fired.append((order, quote["price"]))
+        for order, price in fired:
+            fanout.submit(_fill, order, price)
+
+
+engine = TriggerEngine()
+
+
+# ---- fills ----
+def _order_ref(db, order):
+    return db.collection("users").document(order["uid"]).collection("orders").document(order["id"])
+
+
+def _fill(order, price):
+    db = get_db()
+    order_ref = _order_ref(db, order)
+    try:
+        if order["side"] == "buy":
+            execute_buy(db, order["uid"], order["symbol"], order["quantity"], price, None, order_ref)
+        else:
+            record = {
+                "symbol": order["symbol"],
+                "quantity": order["quantity"],
+                "oldQuantity": order["quantity"],
+                "price": price,
+                "total": round(price * order["quantity"], 2),
+                "timestamp": firestore.SERVER_TIMESTAMP,
+                "clientTimestamp": None,
+                "orderId": order["id"],
+            }
+            execute_sell(db, order["uid"], order["symbol"], order["quantity"], price, record, order_ref)
+        log.info("Filled %s %s order %s at %s", order["type"], order["side"], order["id"], price)
+    except TradeRejected as e:
+        if e.status == 409:
+            return  # cancelled, or already filled by another worker
+        order_ref.update({"status": "rejected", "error": e.body.get("error"), "rejectedPrice": price})
+    except Exception as e:
+        # TradeConflict or an upstream error: leave it open for the next crossing price
+        log.warning("Order %s fill failed, keeping it open: %s", order["id"], e)
+        engine.add(order, check_last=False)
+
+
+# ---- engine lifecycle ----
+_thread = None
+_thread_lock = threading.Lock()
+
+
+def _order_json(doc):
+    order = doc.to_dict() or {}
+    order["id"] = doc.id
+    return order
+
+
+def _status_is(status):
+    from google.cloud.firestore_v1.base_query import FieldFilter
+    return FieldFilter("status", "==", status)
+
+
+def _open_orders(db):
+    return db.collection_group("orders").where(filter=_status_is("open"))
+
+
+def load_open_orders(db):
+    return [_order_json(doc) for doc in _open_orders(db).stream()]
+
+
+def _watch_open_orders(db):
+    """
+    Listen to the open orders: the first snapshot replaces the engine's
+    orders, later ones add new orders and drop ones filled or cancelled
+    elsewhere. Returns the Watch, or None if the client can't listen.
+    """
+    query = _open_orders(db)
+    if not hasattr(query, "on_snapshot"):
+        return None
+    mark = engine.mark()
+    loaded = threading.Event()
+
+    def on_snapshot(docs, changes, read_time):
+        try:
+            if not loaded.is_set():
+                engine.replace([_order_json(doc) for doc in docs], since=mark)
+                loaded.set()
+                log.info("Order engine active with %d open orders", len(engine))
+                hub.poke()
+                return
+            for change in changes:
+                if change.type.name == "REMOVED":
+                    engine.discard(change.document.id)
+                else:
+                    engine.add(_order_json(change.document))
+        except Exception as e:
+            log.error("Open order update failed: %s", e)
+
+    return query.on_snapshot(on_snapshot)
+
+
+def _run():
+    active, watch = False, None
+    while True:
+        try:
+            if shared_cache.acquire("orders-engine", ORDERS_LEASE_RENEW * 3):
+                if watch is not None and not watch.is_active:
+                    # The listen stream died; a new one starts from a full snapshot
+                    watch.unsubscribe()
+                    watch = None
+                if watch is None:
+                    watch = _watch_open_orders(get_db())
+                if watch is None:
+                    mark = engine.mark()
+                    engine.replace(load_open_orders(get_db()), since=mark)
+                    if not active:
+                        log.info("Order engine active with %d open orders", len(engine))
+                    hub.poke()
+                active = True
+            elif active:
+                if watch is not None:
+                    watch.unsubscribe()
+                    watch = None
+                engine.replace([])
+                active = False
+        except Exception as e:
+            log.error("Order engine refresh failed: %s", e)
+        time.sleep(ORDERS_LEASE_RENEW)
+
+
+def ensure_engine():
+    """Start the engine loop and hub listener once per process."""
+    global _thread
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            hub.add_listener(engine.on_quotes, engine.symbols)
+            _thread = threading.Thread(target=_run, name="order-engine", daemon=True)
+            _thread.start()
+
+
+# ---- placing and cancelling ----
+def place(db, uid, data):
+    """Validate and store a new resting order; returns it, or raises TradeRejected."""
+    symbol = normalize_symbol(data.get("symbol"))
+    side, order_type = data.get("side"), data.get("type")
+    try:
+        quantity = float(data.get("quantity"))
+        trigger = float(data.get("triggerPrice"))
+    except (TypeError, ValueError):
+        raise TradeRejected(400, {"error": "quantity and triggerPrice must be numbers"})
+    if not symbol or side not in ORDER_SIDES or order_type not in ORDER_TYPES:
+        raise TradeRejected(400, {"error": "symbol, side (buy|sell) and type (limit|stop) are required"})
+    if quantity <= 0 or trigger <= 0:
+        raise TradeRejected(400, {"error": "quantity and triggerPrice must be positive"})
+
+    orders_ref = db.collection("users").document(uid).collection("orders")
+    open_count = sum(1 for _ in orders_ref.where(filter=_status_is("open")).stream())
+    if open_count >= MAX_OPEN_ORDERS:
+        raise TradeRejected(403, {"error": f"At most {MAX_OPEN_ORDERS} open orders"})
+
+    order = {
+        "uid": uid,
+        "symbol": symbol,
+        "side": side,
+        "type": order_type,
+        "quantity": quantity,
+        "triggerPrice": trigger,
+        "status": "open",
+        "created": firestore.SERVER_TIMESTAMP,
+    }
+    _, ref = orders_ref.add(order)
+    order = dict(order, id=ref.id)
+    order.pop("created")
+    engine.add(order)
+    return order
+
+
+def cancel(db, uid, order_id):
+    """Cancel an open order; raises TradeRejected if it is unknown or no longer open."""
+    order_ref = db.collection("users").document(uid).collection("orders").document(order_id)
+
+    @firestore.transactional
+    def _cancel(transaction):
+        snapshot = order_ref.get(transaction=transaction)
+        if not snapshot.exists:
+            raise TradeRejected(404, {"error": "Order not found"})
+        if (snapshot.to_dict() or {}).get("status") != "open":
+            raise TradeRejected(409, {"error": "Order is no longer open"})
+        transaction.update(order_ref, {"status": "cancelled", "cancelledAt": firestore.SERVER_TIMESTAMP})
+
+    _cancel(db.transaction())
+    engine.discard(order_id)
+
+
+def list_orders(db, uid, status=None):
+    orders_ref = db.collection("users").document(uid).collection("orders")
+    if status:
+        orders_ref = orders_ref.where(filter=_status_is(status))
+    return [_order_json(doc) for doc in orders_ref.stream()]
@@ -1,127 +1,445 @@
-from flask import Blueprint, render_template,jsonify,request
+from flask import Blueprint, render_template,jsonify,request, Response, stream_with_context, current_app as app
 from flask_jwt_extended import jwt_required, get_jwt_identity
 portfolio_bp = Blueprint("portfolio", __name__)
-import yfinance as yf
-import pandas as pd
-import random
-import ssl
-from urllib.request import urlopen
-import firebase_admin
-from firebase_admin import credentials, firestore
-from firebase_admin import auth
-
-def get_db():
-    return firestore.client()
+import os
+import click
+import numpy as np
+import threading
+from datetime import datetime, timezone
+from collections import OrderedDict
+from dateutil.tz import tzlocal
+from backend.firebase import get_db, firestore
+from backend.lazy import lazy
+from backend.sessions import request_uid
+from backend.quotes import get_quotes
+from backend import charts
+
+pd = lazy("pandas")
+
+def parse_timestamp(ts):
+    """Handle all possible Firestore timestamp formats."""
+    if ts is None:
+        return None
+    # Firestore DatetimeWithNanoseconds (has .timestamp() method)
+    if hasattr(ts, 'timestamp'):
+        return pd.Timestamp.fromtimestamp(ts.timestamp())
+    # Dict format {"_seconds": ..., "_nanoseconds": ...}
+    if isinstance(ts, dict) and "_seconds" in ts:
+        return pd.Timestamp.fromtimestamp(ts["_seconds"])
+    # Raw epoch (ms or seconds)
+    if isinstance(ts, (int, float)):
+        return pd.Timestamp.fromtimestamp(ts / 1000 if ts > 1e10 else ts)
+    # String format
+    if isinstance(ts, str):
+        try:
+            return pd.Timestamp(ts)
+        except Exception:
+            return None
+    return None
+
+def _legacy_timestamp(ts):
+    """UTC datetime for a trade timestamp that isn't a Firestore Timestamp, or None."""
+    if hasattr(ts, "timestamp") or isinstance(ts, bool) or ts is None:
+        return None
+    if isinstance(ts, dict) and "_seconds" in ts:
+        return datetime.fromtimestamp(ts["_seconds"], tz=timezone.utc)
+    if isinstance(ts, (int, float)):
+        return datetime.fromtimestamp(ts / 1000 if ts > 1e10 else ts, tz=timezone.utc)
+    if isinstance(ts, str):
+        parsed = parse_timestamp(ts)
+        if parsed is None:
+            return None
+        return (parsed.tz_localize("UTC") if parsed.tzinfo is None else parsed).to_pydatetime()
+    return None
+
+
+@click.command("backfill-trade-timestamps")
+@click.option("--uid", default=None, help="Only migrate this user.")
+def backfill_timestamps_command(uid):
+    """
+    Rewrite trades whose `timestamp` is a number, string or {_seconds} map
+    (sells written before they used the server time) as Firestore Timestamps,
+    keeping the old value in clientTimestamp. Firestore orders numbers before
+    Timestamps, so until this runs those trades sort last in /portfolio/trades.
+    """
+    db = get_db()
+    uids = [uid] if uid else [doc.id for doc in db.collection("users").stream()]
+    total = 0
+    for user_id in uids:
+        batch, pending, migrated = db.batch(), 0, 0
+        for doc in db.collection("users").document(user_id).collection("trades").stream():
+            data = doc.to_dict()
+            converted = _legacy_timestamp(data.get("timestamp"))
+            if converted is None:
+                continue
+            update = {"timestamp": converted}
+            if "clientTimestamp" not in data:
+                update["clientTimestamp"] = data["timestamp"]
+            batch.update(doc.reference, update)
+            pending += 1
+            migrated += 1
+            if pending == 400:   # Firestore allows 500 writes per batch
+                batch.commit()
+                batch, pending = db.batch(), 0
+        if pending:
+            batch.commit()
+        total += migrated
+        click.echo(f"{user_id}: {migrated} trades")
+    click.echo(f"Migrated {total} trades across {len(uids)} users")
+
 
 @portfolio_bp.route("/portfolio")
 def portfolio():
     return render_template("portfolio.html")
 
+TRADES_PAGE_SIZE = 50
+TRADES_MAX_PAGE = 500
+
+
+def _trade_json(doc):
+    trade_data = doc.to_dict()
+    trade_data["id"] = doc.id
+    return trade_data
+
+
 @portfolio_bp.route("/portfolio/trades")
 def trades():
-    uid=request.args.get("uid")
-    db = get_db() 
-    user_ref=db.collection("users").document(uid).collection("trades")
-    docs = user_ref.stream()
-    result=[]
-    for doc in docs:
-        trade_data= doc.to_dict()
-        trade_data["id"] = doc.id
-        result.append(trade_data)
-    return jsonify(result)
+    """
+    Trade history for ?uid=.
+    - ?limit=N[&after=<trade id>]: newest-first page of at most N trades
+      (default 50, max 500) as {trades, nextCursor}; pass nextCursor back as
+      `after` for the next page.
+    - ?format=ndjson: one JSON trade per line, newest first, written as they
+      are read from Firestore (limit/after apply too).
+    - no params: the whole history as a JSON array (kept for older clients).
+    Both ordered modes need every `timestamp` to be a Firestore Timestamp;
+    older sells stored a client epoch number, which Firestore sorts after all
+    Timestamps. `flask --app app backfill-trade-timestamps` converts them.
+    """
+    uid = request_uid()
+    if not uid:
+        return jsonify({"error": "Missing uid"}), 400
+    db = get_db()
+    trades_ref = db.collection("users").document(uid).collection("trades")
+
+    stream_mode = request.args.get("format") == "ndjson"
+    if not stream_mode and "limit" not in request.args and "after" not in request.args:
+        return jsonify([_trade_json(doc) for doc in trades_ref.stream()])
+
+    try:
+        limit = request.args.get("limit")
+        limit = min(int(limit), TRADES_MAX_PAGE) if limit else (None if stream_mode else TRADES_PAGE_SIZE)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+    if limit is not None and limit <= 0:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    query = trades_ref.order_by("timestamp", direction=firestore.Query.DESCENDING)
+    after = request.args.get("after")
+    if after:
+        cursor = trades_ref.document(after).get()
+        if not cursor.exists:
+            return jsonify({"error": "Unknown cursor"}), 400
+        query = query.start_after(cursor)
+
+    if stream_mode:
+        if limit is not None:
+            query = query.limit(limit)
+
+        def generate():
+            for doc in query.stream():
+                yield app.json.dumps(_trade_json(doc)) + "\n"
+        return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+    # One extra row tells us whether there is a next page
+    page = [_trade_json(doc) for doc in query.limit(limit + 1).stream()]
+    has_more = len(page) > limit
+    page = page[:limit]
+    return jsonify({
+        "trades": page,
+        "nextCursor": page[-1]["id"] if has_more else None
+    })
+
+
+def _user_positions(user_ref, user_data):
+    held = user_data.get("positions")
+    if held is None:
+        # User predates the positions map (see `flask backfill-positions`)
+        from backend.positions import positions_from_trades
+        held = positions_from_trades([doc.to_dict() for doc in user_ref.collection("trades").stream()])
+    return held
+
+
+@portfolio_bp.route("/portfolio/positions")
+def positions():
+    """Current holdings for ?uid= from the positions map on the user document."""
+    uid = request_uid()
+    if not uid:
+        return jsonify({"error": "Missing uid"}), 400
+    user_ref = get_db().collection("users").document(uid)
+    user_doc = user_ref.get()
+    if not user_doc.exists:
+        return jsonify({"error": "User not found"}), 404
+
+    held = _user_positions(user_ref, user_doc.to_dict() or {})
+    return jsonify({"positions": {s: p for s, p in held.items() if p.get("quantity", 0) > 0}})
+
+
+# ---- valuation ----
+# Seconds /portfolio/summary waits for quotes before valuing with stale/null prices
+SUMMARY_QUOTES_DEADLINE = float(os.environ.get("SUMMARY_QUOTES_DEADLINE", 2.0))
+
+
+def value_positions(held, quotes):
+    """
+    Value a positions map against quote rows (as returned by get_quotes) in
+    one pass over arrays. Closed positions only contribute realized P&L.
+    Symbols without a price are listed but left out of market value and weights.
+    """
+    symbols = list(held)
+    quantity = np.array([float(held[s].get("quantity") or 0) for s in symbols])
+    cost = np.array([float(held[s].get("costBasis") or 0) for s in symbols])
+    realized = np.array([float(held[s].get("realizedPL") or 0) for s in symbols])
+    quote_of = {q["symbol"]: q for q in quotes}
+    price = np.array([quote_of.get(s, {}).get("price") for s in symbols], dtype=float)
+    prev_close = np.array([quote_of.get(s, {}).get("previousClose") for s in symbols], dtype=float)
+
+    open_ = quantity > 0
+    priced = open_ & ~np.isnan(price)
+    avg_cost = np.divide(cost, quantity, out=np.zeros_like(cost), where=open_)
+    market_value = np.where(priced, price * quantity, np.nan)
+    unrealized = market_value - cost
+    unrealized_pct = np.divide(unrealized * 100, cost, out=np.full_like(cost, np.nan), where=priced & (cost > 0))
+    day_change = np.where(priced & ~np.isnan(prev_close), (price - prev_close) * quantity, np.nan)
+    total_value = np.nansum(market_value)
+    weight = market_value / total_value if total_value > 0 else np.full_like(market_value, np.nan)
+
+    def num(x):
+        return None if np.isnan(x) else round(float(x), 4)
+
+    rows = []
+    for i in np.flatnonzero(open_)[np.argsort(-np.nan_to_num(market_value[open_], nan=-1.0), kind="stable")]:
+        quote = quote_of.get(symbols[i], {})
+        rows.append({
+            "symbol": symbols[i],
+            "quantity": float(quantity[i]),
+            "avgCost": num(avg_cost[i]),
+            "costBasis": num(cost[i]),
+            "price": num(price[i]),
+            "marketValue": num(market_value[i]),
+            "unrealizedPL": num(unrealized[i]),
+            "unrealizedPLPercent": num(unrealized_pct[i]),
+            "realizedPL": num(realized[i]),
+            "dayChange": num(day_change[i]),
+            "weight": num(weight[i]),
+            "stale": bool(quote.get("stale")),
+            "error": quote.get("error"),
+        })
+
+    return rows, {
+        "marketValue": round(float(total_value), 4),
+        "costBasis": round(float(cost[open_].sum()), 4),
+        "unrealizedPL": round(float(np.nansum(unrealized[priced])), 4),
+        "realizedPL": round(float(realized.sum()), 4),
+        "dayChange": round(float(np.nansum(day_change)), 4),
+        "positions": int(open_.sum()),
+        "unpriced": [symbols[i] for i in np.flatnonzero(open_ & ~priced)],
+    }
+
+
+@portfolio_bp.route("/portfolio/summary")
+def summary():
+    """
+    Holdings for ?uid= valued at live prices: per symbol quantity, average
+    cost, market value, unrealized and realized P&L and portfolio weight,
+    plus totals. All open symbols are quoted in one batched lookup.
+    """
+    uid = request_uid()
+    if not uid:
+        return jsonify({"error": "Missing uid"}), 400
+    user_ref = get_db().collection("users").document(uid)
+    user_doc = user_ref.get()
+    if not user_doc.exists:
+        return jsonify({"error": "User not found"}), 404
+
+    user_data = user_doc.to_dict() or {}
+    held = _user_positions(user_ref, user_data)
+    symbols = [s for s, p in held.items() if (p.get("quantity") or 0) > 0]
+    quotes = get_quotes(symbols, deadline=SUMMARY_QUOTES_DEADLINE) if symbols else []
+    rows, totals = value_positions(held, quotes)
+
+    cash = float(user_data.get("balance") or 0.0)
+    totals["totalPL"] = round(totals["unrealizedPL"] + totals["realizedPL"], 4)
+    totals["cash"] = round(cash, 4)
+    totals["equity"] = round(cash + totals["marketValue"], 4)
+    return jsonify({"positions": rows, "totals": totals})
+
+
+# ---- cumulative buy/sell series, cached per user ----
+# uid -> {"seq", "t", "buyValue", "sellValue", "buy", "sell"}; arrays sorted by t
+CHART_CACHE_SIZE = 1024
+BUCKETS = {
+    "hour": "%b %d, %H:00",
+    "day": "%b %d",
+}
+_chart_cache = OrderedDict()
+_chart_lock = threading.Lock()
+
+
+def timestamps_ns(values):
+    """Vectorised parse_timestamp: epoch nanoseconds (UTC) per value; unparseable -> now."""
+    values = pd.Series(list(values), dtype=object)
+    numeric = pd.to_numeric(values.where(values.map(type).isin((int, float))), errors="coerce")
+    seconds = numeric.where(numeric <= 1e10, numeric / 1000)
+    dicts = values.map(lambda v: v.get("_seconds") if isinstance(v, dict) else None)
+    seconds = seconds.fillna(pd.to_numeric(dicts, errors="coerce"))
+    others = values.where(seconds.isna() & values.map(lambda v: not isinstance(v, dict)))
+    parsed = pd.to_datetime(others, utc=True, errors="coerce", format="mixed").dt.as_unit("ns")
+
+    ns = np.where(seconds.notna(), (seconds.fillna(0) * 1e9).astype("int64"), parsed.array.asi8)
+    ns[pd.isna(parsed).to_numpy() & seconds.isna().to_numpy()] = pd.Timestamp.now(tz="UTC").value
+    return ns
+
+
+def _trade_values(docs):
+    """(t, buy value, sell value) arrays for trade dicts, sorted by time."""
+    frame = pd.DataFrame.from_records(docs, columns=["timestamp", "quantity", "buy_price", "price", "buy", "sell"])
+    quantity = pd.to_numeric(frame["quantity"], errors="coerce").fillna(0).to_numpy(float)
+    # buy_price if set and non-zero, else price (sells store the fill as `price`)
+    buy_price = pd.to_numeric(frame["buy_price"], errors="coerce").fillna(0)
+    price = buy_price.where(buy_price != 0, pd.to_numeric(frame["price"], errors="coerce")).fillna(0)
+    value = price.to_numpy(float) * quantity
+    is_buy = frame["buy"].where(frame["buy"].notna(), False).map(bool).to_numpy()
+    is_sell = ~is_buy & frame["sell"].where(frame["sell"].notna(), False).map(bool).to_numpy()
+
+    t = timestamps_ns(frame["timestamp"])
+    order = np.argsort(t, kind="stable")
+    return t[order], np.where(is_buy, value, 0.0)[order], np.where(is_sell, value, 0.0)[order]
+
+
+def _series(seq, t, buy_value, sell_value):
+    return {
+        "seq": seq,
+        "t": t,
+        "buyValue": buy_value,
+        "sellValue": sell_value,
+        "buy": np.cumsum(buy_value),
+        "sell": np.cumsum(sell_value),
+    }
+
+
+def _extend(cached, seq, t, buy_value, sell_value):
+    """Cached series plus newer trades; only the new tail is summed when they sort last."""
+    if len(cached["t"]) and len(t) and t[0] < cached["t"][-1]:
+        # A trade landed out of order: re-sort the raw values (no Firestore reads)
+        all_t = np.concatenate([cached["t"], t])
+        order = np.argsort(all_t, kind="stable")
+        return _series(seq, all_t[order],
+                       np.concatenate([cached["buyValue"], buy_value])[order],
+                       np.concatenate([cached["sellValue"], sell_value])[order])
+    base_buy = cached["buy"][-1] if len(cached["buy"]) else 0.0
+    base_sell = cached["sell"][-1] if len(cached["sell"]) else 0.0
+    return {
+        "seq": seq,
+        "t": np.concatenate([cached["t"], t]),
+        "buyValue": np.concatenate([cached["buyValue"], buy_value]),
+        "sellValue": np.concatenate([cached["sellValue"], sell_value]),
+        "buy": np.concatenate([cached["buy"], base_buy + np.cumsum(buy_value)]),
+        "sell": np.concatenate([cached["sell"], base_sell + np.cumsum(sell_value)]),
+    }
+
+
+def trade_series(db, uid):
+    """
+    Cumulative buy/sell value series for `uid`. Cached per user and keyed on
+    the user's latest trade number (`tradeSeq`): an unchanged user costs one
+    document read, and new trades are fetched with `seq > cached` and
+    appended. Users without `tradeSeq` are recomputed every time.
+    """
+    user_ref = db.collection("users").document(uid)
+    user_doc = user_ref.get()
+    seq = (user_doc.to_dict() or {}).get("tradeSeq") if user_doc.exists else None
+    trades_ref = user_ref.collection("trades")
+
+    with _chart_lock:
+        cached = _chart_cache.get(uid)
+        if cached is not None:
+            _chart_cache.move_to_end(uid)
+    if seq is not None and cached is not None and cached["seq"] == seq:
+        return cached
+
+    if seq is not None and cached is not None and cached["seq"] < seq:
+        from google.cloud.firestore_v1.base_query import FieldFilter
+        query = trades_ref.where(filter=FieldFilter("seq", ">", cached["seq"]))
+        docs = [d for d in (doc.to_dict() for doc in query.stream()) if d["seq"] <= seq]
+        series = _extend(cached, seq, *_trade_values(docs))
+    else:
+        docs = [doc.to_dict() for doc in trades_ref.stream()]
+        if seq is not None:
+            # Trades committed after we read tradeSeq belong to the next refresh
+            docs = [d for d in docs if d.get("seq") is None or d["seq"] <= seq]
+        series = _series(seq, *_trade_values(docs))
+
+    if seq is not None:
+        with _chart_lock:
+            _chart_cache[uid] = series
+            if len(_chart_cache) > CHART_CACHE_SIZE:
+                _chart_cache.popitem(last=False)
+    return series
+
 
 @portfolio_bp.route("/portfolio/chart-data")
 def chart_data():
     """
     Returns chart data showing cumulative buy and sell trade values over time.
+    Optional ?bucket=hour|day keeps only the last point of each bucket;
+    maxPoints and format=compact as in backend.charts.
     """
-    uid = request.args.get("uid")
+    uid = request_uid()
     if not uid:
         return jsonify({"error": "Missing uid"}), 400
-    
+    bucket = request.args.get("bucket")
+    if bucket and bucket not in BUCKETS:
+        return jsonify({"error": "bucket must be one of: " + ", ".join(BUCKETS)}), 400
     try:
-        db = get_db()
-        user_ref = db.collection("users").document(uid).collection("trades")
-        docs = user_ref.stream()
-        
-        trades = []
-        for doc in docs:
-            trade_data = doc.to_dict()
-            trade_data["id"] = doc.id
-            trades.append(trade_data)
-        
-        # ---- Parse timestamps robustly ----
-        def parse_timestamp(ts):
-            """Handle all possible Firestore timestamp formats."""
-            import datetime as dt
-            if ts is None:
-                return None
-            # Firestore DatetimeWithNanoseconds (has .timestamp() method)
-            if hasattr(ts, 'timestamp'):
-                return pd.Timestamp.fromtimestamp(ts.timestamp())
-            # Dict format {"_seconds": ..., "_nanoseconds": ...}
-            if isinstance(ts, dict) and "_seconds" in ts:
-                return pd.Timestamp.fromtimestamp(ts["_seconds"])
-            # Raw epoch (ms or seconds)
-            if isinstance(ts, (int, float)):
-                return pd.Timestamp.fromtimestamp(ts / 1000 if ts > 1e10 else ts)
-            # String format
-            if isinstance(ts, str):
-                try:
-                    return pd.Timestamp(ts)
-                except Exception:
-                    return None
-            return None
+        max_points = charts.max_points(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    compact = charts.compact_requested(request.args)
+
+    try:
+        series = trade_series(get_db(), uid)
+        t, buy, sell = series["t"], series["buy"], series["sell"]
 
-        # Parse and sort trades by time
-        parsed_trades = []
-        for trade in trades:
-            ts = parse_timestamp(trade.get("timestamp"))
-            if ts is None:
-                # If no timestamp, use current time as fallback
-                ts = pd.Timestamp.now()
-            parsed_trades.append((ts, trade))
-        
-        parsed_trades.sort(key=lambda x: x[0])
-        
-        # Build chart data: cumulative values
-        buy_data = []
-        sell_data = []
-        labels = []
-        
-        cumulative_buy_value = 0
-        cumulative_sell_value = 0
-        
-        for ts, trade in parsed_trades:
-            quantity = float(trade.get("quantity", 0))
-            price = float(trade.get("buy_price", 0) or trade.get("price", 0) or 0)
-            trade_value = price * quantity
-            
-            if trade.get("buy"):
-                cumulative_buy_value += trade_value
-            elif trade.get("sell"):
-                cumulative_sell_value += trade_value
-            
-            buy_data.append(round(cumulative_buy_value, 2))
-            sell_data.append(round(cumulative_sell_value, 2))
-            labels.append(ts.strftime("%b %d, %H:%M"))
-        
         # If no trades, return empty data
-        if not labels:
+        if not len(t) and compact:
+            return charts.compact_response(t, {"buyData": buy, "sellData": sell})
+        if not len(t):
             return jsonify({
                 "labels": [],
                 "buyData": [],
                 "sellData": []
             })
-        
+
+        local = pd.DatetimeIndex(t.astype("datetime64[ns]")).tz_localize("UTC").tz_convert(tzlocal())
+        label_format = "%b %d, %H:%M"
+        if bucket:
+            keys = local.normalize().asi8 if bucket == "day" else t // 3_600_000_000_000
+            last = np.flatnonzero(np.r_[keys[1:] != keys[:-1], True])
+            t, local, buy, sell = t[last], local[last], buy[last], sell[last]
+            label_format = BUCKETS[bucket]
+        if max_points:
+            keep = charts.lttb(t, [buy, sell], max_points)
+            t, local, buy, sell = t[keep], local[keep], buy[keep], sell[keep]
+        if compact:
+            return charts.compact_response(t // 1_000_000_000, {"buyData": buy, "sellData": sell})
+
         return jsonify({
-            "labels": labels,
-            "buyData": buy_data,
-            "sellData": sell_data
+            "labels": local.strftime(label_format).tolist(),
+            "buyData": np.round(buy, 2).tolist(),
+            "sellData": np.round(sell, 2).tolist()
         })
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
-        
-         
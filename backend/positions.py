@@ -0,0 +1,102 @@
+"""
+Per-user positions, materialized on the user document.
+
+    users/{uid}.positions = {
+        symbol: {"quantity": float, "costBasis": float, "realizedPL": float}
+    }
+
+costBasis is the total cost of the shares still held (average-cost method),
+so average price = costBasis / quantity. Buys and sells update the entry in
+the same write as the balance, which lets a sell validate ownership from a
+single user-document read instead of scanning the trades subcollection.
+
+Users created before positions existed can be migrated in bulk with
+
+    flask --app app backfill-positions [--uid UID]
+"""
+import click
+
+from backend.firebase import get_db
+from backend.lazy import lazy
+from backend.portfolio import parse_timestamp
+
+pd = lazy("pandas")
+
+
+def empty_position():
+    return {"quantity": 0.0, "costBasis": 0.0, "realizedPL": 0.0}
+
+
+def apply_buy(position, quantity, price):
+    """Return the position after buying `quantity` shares at `price`."""
+    position = dict(empty_position(), **(position or {}))
+    position["quantity"] = round(position["quantity"] + quantity, 6)
+    position["costBasis"] = round(position["costBasis"] + price * quantity, 6)
+    return position
+
+
+def apply_sell(position, quantity, price):
+    """Return the position after selling `quantity` shares at `price`."""
+    position = dict(empty_position(), **(position or {}))
+    held = position["quantity"]
+    avg_cost = position["costBasis"] / held if held > 0 else 0.0
+    remaining = round(held - quantity, 6)
+    position["quantity"] = remaining
+    position["realizedPL"] = round(position["realizedPL"] + (price - avg_cost) * quantity, 6)
+    position["costBasis"] = round(avg_cost * remaining, 6) if remaining > 0 else 0.0
+    return position
+
+
+def trade_fill(trade):
+    """(side, quantity, fill price) for a stored trade record, or None if unusable."""
+    quantity = float(trade.get("quantity") or 0)
+    if quantity <= 0:
+        return None
+    if trade.get("buy"):
+        # Buys are charged at the live price; buy_price is what the client saw
+        return "buy", quantity, float(trade.get("live_price") or trade.get("buy_price") or 0)
+    if trade.get("sell"):
+        return "sell", quantity, float(trade.get("livePrice") or trade.get("price") or 0)
+    return None
+
+
+def positions_from_trades(trades):
+    """Replay trade dicts in time order and return the resulting positions map."""
+    ordered = sorted(
+        trades,
+        key=lambda t: parse_timestamp(t.get("timestamp")) or pd.Timestamp.max,
+    )
+    positions = {}
+    for trade in ordered:
+        fill = trade_fill(trade)
+        symbol = trade.get("symbol")
+        if fill is None or not symbol:
+            continue
+        side, quantity, price = fill
+        if side == "buy":
+            positions[symbol] = apply_buy(positions.get(symbol), quantity, price)
+        else:
+            positions[symbol] = apply_sell(positions.get(symbol), quantity, price)
+    return positions
+
+
+def rebuild_positions(db, uid):
+    """Rebuild one user's positions from their trade history and save them."""
+    user_ref = db.collection("users").document(uid)
+    trades = [doc.to_dict() for doc in user_ref.collection("trades").stream()]
+    positions = positions_from_trades(trades)
+    # Plain update (not merge) so symbols that no longer exist are dropped
+    user_ref.update({"positions": positions})
+    return positions
+
+
+@click.command("backfill-positions")
+@click.option("--uid", default=None, help="Only rebuild this user.")
+def backfill_positions_command(uid):
+    """Rebuild users/{uid}.positions from each user's trades."""
+    db = get_db()
+    uids = [uid] if uid else [doc.id for doc in db.collection("users").stream()]
+    for user_id in uids:
+        positions = rebuild_positions(db, user_id)
+        click.echo(f"{user_id}: {len(positions)} positions")
+    click.echo(f"Backfilled {len(uids)} users")
@@ -0,0 +1,573 @@
+"""
+Shared in-process quote cache.
+
+Every price lookup in the app reads through here instead of calling the
+market-data provider directly. Each field has its own TTL, concurrent misses
+for the same symbol share one upstream fetch (single-flight), and the cache
+is bounded with LRU eviction.
+
+Behind it sits backend.shared_cache: a miss first checks what other worker
+processes have fetched, and a lease per symbol and source makes sure only
+one worker goes upstream for it at a time.
+
+get_quotes() serves many symbols at once, sending all misses out as
+multi-ticker downloads. With a deadline it returns on time with whatever
+arrived, serving expired values (or nulls) for the symbols still in flight.
+
+Fields and where they come from:
+    price          last 5m close of today's session (history; the batch
+                   path reads the same 5m bars, so both mean one thing)
+    currentPrice   info["currentPrice"], used when history is empty (info)
+    previousClose  info["previousClose"] (info)
+    shortName      info["shortName"] (info)
+"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import wait, FIRST_COMPLETED
+
+import numpy as np
+
+from backend import fanout, shared_cache
+from backend.lazy import lazy
+from backend.market_data import get_provider
+
+pd = lazy("pandas")
+
+# Seconds each field stays fresh. Override with QUOTE_TTL_<FIELD> env vars.
+QUOTE_TTL = {
+    "price": float(os.environ.get("QUOTE_TTL_PRICE", 15)),
+    "currentPrice": float(os.environ.get("QUOTE_TTL_PRICE", 15)),
+    "previousClose": float(os.environ.get("QUOTE_TTL_PREV_CLOSE", 3600)),
+    "shortName": float(os.environ.get("QUOTE_TTL_NAME", 86400)),
+}
+QUOTE_CACHE_SIZE = int(os.environ.get("QUOTE_CACHE_SIZE", 2000))
+# Multi-symbol misses are split into downloads of at most this many symbols
+QUOTE_BATCH_CHUNK = int(os.environ.get("QUOTE_BATCH_CHUNK", 25))
+# Seconds a worker may hold the cross-process lease for a fetch; others wait
+# at most this long before fetching themselves
+QUOTE_LEASE_TTL = float(os.environ.get("QUOTE_LEASE_TTL", 10))
+
+DEFAULT_FIELDS = ("price", "previousClose", "shortName")
+
+QUOTE_STATS = {
+    "hits": 0,
+    "misses": 0,
+    "coalesced": 0,   # misses that waited on someone else's fetch
+    "fetches": 0,     # actual upstream calls
+    "shared": 0,      # misses filled from another worker's fetch
+    "errors": 0,
+    "evictions": 0,
+    "hedges": 0,      # single-symbol retries sent after a slow batch
+    "stale": 0,       # expired values served because the deadline passed
+    "timeouts": 0,    # symbols with nothing to serve at the deadline
+}
+
+# symbol -> {"values": {field: value}, "fetched": {field: ts}}
+_cache = OrderedDict()
+_inflight = {}  # (symbol, source) -> _Flight
+_lock = threading.Lock()
+
+
+# ---- upstream sources ----
+def _fetch_history(symbol):
+    hist = get_provider().history(symbol, period="1d", interval="5m")
+    if hist.empty:
+        return {"price": None}
+    return {"price": float(hist["Close"].iloc[-1])}
+
+
+def _fetch_info(symbol):
+    return get_provider().info(symbol)
+
+
+def last_two(frame):
+    """Last and second-to-last valid value per column, without a Python loop."""
+    valid = frame.notna()
+    rank = valid.cumsum()
+    count = valid.sum()
+    return frame.where(valid & rank.eq(count)).max(), frame.where(valid & rank.eq(count - 1)).max()
+
+
+def session_closes(closes):
+    """
+    (latest close, last close of the session before it) per column of
+    intraday closes indexed by exchange-local time.
+    """
+    values = closes.to_numpy(dtype=float)
+    days = closes.index.normalize().tz_localize(None).to_numpy() if len(closes) else np.zeros(0, "datetime64[ns]")
+    last = np.full(values.shape[1], np.nan)
+    previous = np.full(values.shape[1], np.nan)
+    for j in range(values.shape[1]):
+        valid = np.flatnonzero(~np.isnan(values[:, j]))
+        if not len(valid):
+            continue
+        last[j] = values[valid[-1], j]
+        before = valid[days[valid] < days[valid[-1]]]
+        if len(before):
+            previous[j] = values[before[-1], j]
+    return last, previous
+
+
+def _fetch_batch(symbols):
+    """
+    One multi-ticker download of 5m bars for all symbols. Returns
+    {symbol: {"price", "previousClose", "error"}} where price is the latest
+    5m close, as from _fetch_history, and previousClose the last close of
+    the session before it.
+    """
+    frame, errors = get_provider().download(symbols, period="5d", interval="5m")
+
+    if frame is None or frame.empty:
+        closes = pd.DataFrame(columns=symbols, dtype=float, index=pd.DatetimeIndex([], tz="UTC"))
+    else:
+        closes = frame["Close"]
+        if isinstance(closes, pd.Series):
+            closes = closes.to_frame(symbols[0])
+    closes = closes.reindex(columns=symbols).astype(float)
+
+    price, prev_close = session_closes(closes)
+
+    result = {}
+    for symbol, p, pc in zip(symbols, price, prev_close):
+        has_price = not np.isnan(p)
+        result[symbol] = {
+            "price": float(p) if has_price else None,
+            "previousClose": None if np.isnan(pc) else float(pc),
+            "error": None if has_price else (errors.get(symbol) or "No data for symbol"),
+        }
+    return result
+
+
+_SOURCES = {
+    "history": _fetch_history,
+    "info": _fetch_info,
+}
+FIELD_SOURCE = {
+    "price": "history",
+    "currentPrice": "info",
+    "previousClose": "info",
+    "shortName": "info",
+}
+
+
+# ---- cross-process cache ----
+def _shared_key(symbol, field):
+    return f"quote:{symbol}:{field}"
+
+
+def _from_shared(symbols, fields):
+    """{symbol: (values, fetched)} for symbols another worker has all `fields` fresh for."""
+    found = shared_cache.get_many(_shared_key(s, f) for s in symbols for f in fields)
+    result = {}
+    for symbol in symbols:
+        hits = [found.get(_shared_key(symbol, f)) for f in fields]
+        if all(hits):
+            values = {f: value for f, (value, _) in zip(fields, hits)}
+            result[symbol] = values, min(stored for _, stored in hits)
+    return result
+
+
+def _publish(symbol, result, now):
+    fields = [f for f in result if f in FIELD_SOURCE]
+    shared_cache.put_many(
+        {_shared_key(symbol, f): result[f] for f in fields},
+        {_shared_key(symbol, f): QUOTE_TTL[f] for f in fields},
+        stored=now,
+    )
+
+
+def _fetch_shared(symbol, source):
+    """
+    One source for one symbol, fetched by at most one worker at a time. A
+    fresh copy from another worker is used as is; while another worker holds
+    the lease we wait for its result. Returns (result, fetched time).
+    """
+    fields = [f for f, src in FIELD_SOURCE.items() if src == source]
+    lease = f"quote:{symbol}:{source}"
+    shared = _from_shared([symbol], fields)
+    if not shared and not shared_cache.acquire(lease, QUOTE_LEASE_TTL):
+        shared_cache.wait_released([lease], QUOTE_LEASE_TTL)
+        shared = _from_shared([symbol], fields)
+    if shared:
+        with _lock:
+            QUOTE_STATS["shared"] += 1
+        return shared[symbol]
+
+    try:
+        result = _SOURCES[source](symbol)
+        now = time.time()
+        with _lock:
+            QUOTE_STATS["fetches"] += 1
+        _publish(symbol, result, now)
+        return result, now
+    finally:
+        shared_cache.release(lease)
+
+
+def _fetch_batch_shared(symbols):
+    """
+    _fetch_batch across workers: symbols another worker has fresh are taken
+    from the shared cache, symbols another worker is downloading are waited
+    on, and only the rest are downloaded here.
+    Returns ({symbol: row}, {symbol: fetched time}).
+    """
+    fields = ("price", "previousClose")
+    rows, fetched = {}, {}
+
+    def take_shared(pending):
+        found = _from_shared(pending, fields)
+        for symbol, (values, when) in found.items():
+            rows[symbol] = dict(values, error=None)
+            fetched[symbol] = when
+        with _lock:
+            QUOTE_STATS["shared"] += len(found)
+        return [s for s in pending if s not in found]
+
+    def download(batch):
+        result = _fetch_batch(batch)
+        now = time.time()
+        with _lock:
+            QUOTE_STATS["fetches"] += 1
+        for symbol, row in result.items():
+            rows[symbol] = row
+            if row["error"] is None:
+                fetched[symbol] = now
+                _publish(symbol, {"price": row["price"], "previousClose": row["previousClose"]}, now)
+
+    pending = take_shared(symbols)
+    mine = [s for s in pending if shared_cache.acquire(f"quote:{s}:batch", QUOTE_LEASE_TTL)]
+    theirs = [s for s in pending if s not in set(mine)]
+    try:
+        if mine:
+            download(mine)
+    finally:
+        for symbol in mine:
+            shared_cache.release(f"quote:{symbol}:batch")
+
+    if theirs:
+        shared_cache.wait_released([f"quote:{s}:batch" for s in theirs], QUOTE_LEASE_TTL)
+        leftover = take_shared(theirs)
+        if leftover:
+            download(leftover)  # the other worker failed or gave up
+    return rows, fetched
+
+
+class _Flight:
+    """One in-progress upstream fetch that other callers can wait on."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def normalize_symbol(symbol):
+    return (symbol or "").strip().upper()
+
+
+def _lookup(symbol, fields, now):
+    """Return (values, stale_sources) for the cached entry. Caller holds _lock."""
+    entry = _cache.get(symbol)
+    values = {}
+    stale = set()
+    if entry is not None:
+        _cache.move_to_end(symbol)
+    for field in fields:
+        fetched = entry["fetched"].get(field) if entry else None
+        if fetched is not None and now - fetched < QUOTE_TTL[field]:
+            values[field] = entry["values"][field]
+        else:
+            stale.add(FIELD_SOURCE[field])
+    return values, stale
+
+
+def _store(symbol, result, now):
+    """Write a fetch result into the cache. Caller holds _lock."""
+    entry = _cache.get(symbol)
+    if entry is None:
+        entry = _cache[symbol] = {"values": {}, "fetched": {}}
+    entry["values"].update(result)
+    for field in result:
+        entry["fetched"][field] = now
+    _cache.move_to_end(symbol)
+    while len(_cache) > QUOTE_CACHE_SIZE:
+        _cache.popitem(last=False)
+        QUOTE_STATS["evictions"] += 1
+
+
+def _load(symbol, source):
+    """Fetch one source for a symbol, coalescing with any fetch already running."""
+    key = (symbol, source)
+    with _lock:
+        # Another caller may have refreshed this source since we looked
+        fields = [f for f, src in FIELD_SOURCE.items() if src == source]
+        values, stale = _lookup(symbol, fields, time.time())
+        if not stale:
+            return values
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = _inflight[key] = _Flight()
+        else:
+            QUOTE_STATS["coalesced"] += 1
+
+    if not leader:
+        flight.event.wait()
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    try:
+        result, fetched = _fetch_shared(symbol, source)
+        with _lock:
+            _store(symbol, result, fetched)
+        flight.result = result
+        return result
+    except Exception as e:
+        with _lock:
+            QUOTE_STATS["errors"] += 1
+        flight.error = e
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        flight.event.set()
+
+
+def get_quote(symbol, fields=DEFAULT_FIELDS):
+    """
+    Return {field: value} for the requested fields, fetching only the sources
+    whose fields are missing or expired. If "price" is requested and today's
+    history is empty, falls back to info["currentPrice"].
+    Upstream errors are raised to every caller sharing the fetch.
+    """
+    symbol = normalize_symbol(symbol)
+    fields = tuple(fields)
+    with _lock:
+        values, stale = _lookup(symbol, fields, time.time())
+        if stale:
+            QUOTE_STATS["misses"] += 1
+        else:
+            QUOTE_STATS["hits"] += 1
+
+    for source in stale:
+        result = _load(symbol, source)
+        for field in fields:
+            if FIELD_SOURCE[field] == source:
+                values[field] = result.get(field)
+
+    if "price" in fields and values.get("price") is None:
+        values["price"] = get_quote(symbol, ("currentPrice",))["currentPrice"]
+    return values
+
+
+def _load_batch(symbols):
+    """
+    Batch counterpart of _load: symbols already being batch-fetched by another
+    caller are waited on, the rest go out in a single download.
+    Returns {symbol: {"price", "previousClose", "error"}}.
+    """
+    waiting = {}
+    mine = []
+    with _lock:
+        for symbol in symbols:
+            flight = _inflight.get((symbol, "batch"))
+            if flight is None:
+                flight = _inflight[(symbol, "batch")] = _Flight()
+                mine.append(symbol)
+            else:
+                QUOTE_STATS["coalesced"] += 1
+            waiting[symbol] = flight
+
+    if mine:
+        try:
+            fetched, times = _fetch_batch_shared(mine)
+            with _lock:
+                for symbol, when in times.items():
+                    row = fetched[symbol]
+                    _store(symbol, {"price": row["price"], "previousClose": row["previousClose"]}, when)
+            for symbol in mine:
+                waiting[symbol].result = fetched[symbol]
+        except Exception as e:
+            with _lock:
+                QUOTE_STATS["errors"] += 1
+            for symbol in mine:
+                waiting[symbol].error = e
+        finally:
+            with _lock:
+                for symbol in mine:
+                    _inflight.pop((symbol, "batch"), None)
+            for symbol in mine:
+                waiting[symbol].event.set()
+
+    results = {}
+    for symbol, flight in waiting.items():
+        flight.event.wait()
+        if flight.error is not None:
+            results[symbol] = {"price": None, "previousClose": None, "error": str(flight.error)}
+        else:
+            results[symbol] = flight.result
+    return results
+
+
+def _hedge(symbol):
+    """Single-symbol download racing a slow batch; the result is cached like any fetch."""
+    row = _fetch_batch([symbol])[symbol]
+    now = time.time()
+    with _lock:
+        QUOTE_STATS["hedges"] += 1
+        QUOTE_STATS["fetches"] += 1
+        if row["error"] is None:
+            _store(symbol, {"price": row["price"], "previousClose": row["previousClose"]}, now)
+    if row["error"] is None:
+        _publish(symbol, {"price": row["price"], "previousClose": row["previousClose"]}, now)
+    return {symbol: row}
+
+
+def _load_within(symbols, deadline, hedge_after):
+    """
+    _load_batch over chunks of `symbols` on the I/O pool, returning what has
+    arrived after `deadline` seconds. Symbols still pending after
+    `hedge_after` seconds get a single-symbol retry; the first answer wins.
+    Fetches that miss the deadline keep running and fill the cache.
+    """
+    started = time.monotonic()
+    chunks = [symbols[i:i + QUOTE_BATCH_CHUNK] for i in range(0, len(symbols), QUOTE_BATCH_CHUNK)]
+    active = {fanout.submit(_load_batch, chunk) for chunk in chunks}
+    hedged = hedge_after is None
+    rows = {}
+
+    while active and len(rows) < len(symbols):
+        elapsed = time.monotonic() - started
+        next_stop = deadline if hedged else min(hedge_after, deadline)
+        if elapsed >= deadline:
+            break
+        if elapsed >= next_stop:
+            hedged = True
+            active |= {fanout.submit(_hedge, s) for s in symbols if s not in rows}
+            continue
+        done, active = wait(active, timeout=next_stop - elapsed, return_when=FIRST_COMPLETED)
+        for future in done:
+            try:
+                result = future.result()
+            except Exception:
+                continue  # a failed hedge; the batch row (or the deadline) decides
+            for symbol, row in result.items():
+                # An error doesn't beat a later success from a hedge
+                if symbol not in rows or rows[symbol]["error"] is not None:
+                    rows[symbol] = row
+    return rows
+
+
+def _expired(symbol):
+    """Cached price/previousClose regardless of age, or None. Caller holds _lock."""
+    entry = _cache.get(symbol)
+    if entry is None or entry["values"].get("price") is None:
+        return None
+    return {"price": entry["values"]["price"], "previousClose": entry["values"].get("previousClose")}
+
+
+def get_quotes(symbols, deadline=None, hedge_after=None):
+    """
+    Quotes for many symbols at once. Cached symbols are served from memory and
+    misses go out as multi-ticker downloads. Never raises for a single bad
+    symbol; each row carries its own "error" (None on success).
+
+    With `deadline` (seconds) the call returns on time: symbols whose fetch
+    is still running are served from expired cache entries ("stale": true)
+    or as nulls ("timedOut": true). `hedge_after` sends a single-symbol retry
+    for symbols still pending after that many seconds.
+
+    Returns a list in request order of
+    {symbol, price, previousClose, change, changePercent, error, stale, timedOut}.
+    """
+    order = [normalize_symbol(s) for s in symbols]
+    unique = list(dict.fromkeys(s for s in order if s))
+
+    rows = {}
+    missing = []
+    now = time.time()
+    with _lock:
+        for symbol in unique:
+            values, stale = _lookup(symbol, ("price", "previousClose"), now)
+            if stale:
+                missing.append(symbol)
+                QUOTE_STATS["misses"] += 1
+            else:
+                QUOTE_STATS["hits"] += 1
+                rows[symbol] = dict(values, error=None)
+
+    stale_symbols = set()
+    timed_out = set()
+    if missing and deadline is None:
+        rows.update(_load_batch(missing))
+    elif missing:
+        rows.update(_load_within(missing, deadline, hedge_after))
+        with _lock:
+            for symbol in missing:
+                if symbol in rows:
+                    continue
+                # Landed in the cache after our last wake-up
+                values, stale = _lookup(symbol, ("price", "previousClose"), time.time())
+                if not stale:
+                    rows[symbol] = dict(values, error=None)
+                    continue
+                expired = _expired(symbol)
+                if expired is not None:
+                    rows[symbol] = dict(expired, error=None)
+                    stale_symbols.add(symbol)
+                    QUOTE_STATS["stale"] += 1
+                else:
+                    rows[symbol] = {"price": None, "previousClose": None, "error": "Timed out"}
+                    timed_out.add(symbol)
+                    QUOTE_STATS["timeouts"] += 1
+
+    frame = pd.DataFrame.from_dict(rows, orient="index", columns=["price", "previousClose", "error"])
+    frame = frame.reindex(order)
+    price = frame["price"].to_numpy(dtype=float, na_value=np.nan)
+    prev_close = frame["previousClose"].to_numpy(dtype=float, na_value=np.nan)
+    ok = ~np.isnan(price) & ~np.isnan(prev_close) & (prev_close > 0)
+    change = np.where(ok, price - prev_close, 0.0)
+    change_percent = np.where(ok, np.divide(change, prev_close, out=np.zeros_like(change), where=ok) * 100, 0.0)
+
+    errors = frame["error"].tolist()
+    return [
+        {
+            "symbol": symbol,
+            "price": None if np.isnan(p) else float(p),
+            "previousClose": None if np.isnan(pc) else float(pc),
+            "change": float(c),
+            "changePercent": float(cp),
+            "error": err if isinstance(err, str) else (None if symbol else "Invalid symbol"),
+            "stale": symbol in stale_symbols,
+            "timedOut": symbol in timed_out,
+        }
+        for symbol, p, pc, c, cp, err in zip(order, price, prev_close, change, change_percent, errors)
+    ]
+
+
+def get_price(symbol):
+    """Latest price for a symbol, or None if upstream has nothing."""
+    return get_quote(symbol, ("price",))["price"]
+
+
+def cache_stats():
+    with _lock:
+        stats = dict(QUOTE_STATS)
+        stats["size"] = len(_cache)
+        stats["inflight"] = len(_inflight)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hitRatio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+    return stats
+
+
+def invalidate(symbol=None):
+    """Drop one symbol (or everything) from the cache, here and for the other workers."""
+    with _lock:
+        if symbol is None:
+            _cache.clear()
+        else:
+            _cache.pop(normalize_symbol(symbol), None)
+    shared_cache.delete_prefix("quote:" if symbol is None else f"quote:{normalize_symbol(symbol)}:")
@@ -0,0 +1,184 @@
+"""
+Login fast path and request authentication.
+
+Firebase ID tokens are verified locally against Google's public signing
+certificates. The certificates are cached for as long as Google says
+(Cache-Control max-age) and refreshed by a background thread before they
+expire, so a login normally makes no outbound call at all. Verified tokens
+are cached until they expire.
+
+A successful /auth/login returns a short-lived app JWT (flask_jwt_extended)
+whose identity is the Firebase uid. request_uid() authenticates later
+requests from that JWT. The bare ?uid= / body uid of older clients is only
+honoured with ALLOW_LEGACY_UID_AUTH=1: it lets anyone act as any user.
+"""
+import os
+import re
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+from flask import abort, jsonify, make_response, request
+from flask_jwt_extended import create_access_token, get_jwt_identity, verify_jwt_in_request
+
+from backend import firebase
+from backend.lazy import lazy
+from backend.metrics import timed_upstream
+
+log = logging.getLogger(__name__)
+
+google_jwt = lazy("google.auth.jwt")
+firebase_auth = lazy("firebase_admin.auth")
+
+CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
+CERTS_MIN_REFRESH = 60        # seconds; also the retry interval after a failed refresh
+CERTS_REFRESH_AT = 0.8        # refresh once this fraction of max-age has passed
+TOKEN_CACHE_SIZE = 10000
+CLOCK_SKEW = 10               # seconds of iat/exp leeway (a fresh token can look "used too early")
+# Trust a uid sent without a JWT (clients from before app sessions); off by default
+ALLOW_LEGACY_UID_AUTH = os.environ.get("ALLOW_LEGACY_UID_AUTH", "0") == "1"
+
+_certs = {"keys": None, "expires": 0.0}
+_certs_lock = threading.Lock()
+_refresher = None
+_tokens = OrderedDict()       # sha256(token) -> (claims, exp)
+_tokens_lock = threading.Lock()
+
+
+class InvalidIdToken(Exception):
+    pass
+
+
+# ---- Google signing certificates ----
+def _fetch_certs():
+    """(kid -> PEM cert, max-age seconds) from Google."""
+    import requests
+    with timed_upstream("google", "certs"):
+        resp = requests.get(CERTS_URL, timeout=5)
+    resp.raise_for_status()
+    match = re.search(r"max-age=(\d+)", resp.headers.get("Cache-Control", ""))
+    return resp.json(), int(match.group(1)) if match else 3600
+
+
+def _refresh_certs():
+    keys, max_age = _fetch_certs()
+    with _certs_lock:
+        _certs["keys"] = keys
+        _certs["expires"] = time.time() + max_age
+    return max_age
+
+
+def _run_refresher():
+    while True:
+        remaining = _certs["expires"] - time.time()
+        time.sleep(max(remaining * CERTS_REFRESH_AT if remaining > 0 else 0, CERTS_MIN_REFRESH))
+        try:
+            _refresh_certs()
+        except Exception as e:
+            log.warning("Signing certificate refresh failed, keeping cached certs: %s", e)
+
+
+def _ensure_refresher():
+    global _refresher
+    with _certs_lock:
+        if _refresher is None or not _refresher.is_alive():
+            _refresher = threading.Thread(target=_run_refresher, name="cert-refresher", daemon=True)
+            _refresher.start()
+
+
+def signing_certs():
+    """Cached certs; fetched inline only when there are none or they've expired."""
+    if _certs["keys"] is None or time.time() >= _certs["expires"]:
+        _refresh_certs()
+    _ensure_refresher()
+    return _certs["keys"]
+
+
+# ---- ID tokens ----
+def _verify_locally(id_token, project_id):
+    header = google_jwt.decode_header(id_token)
+    if header.get("alg") != "RS256" or not header.get("kid"):
+        raise InvalidIdToken("ID token has an unexpected signing algorithm or no key id")
+    try:
+        claims = google_jwt.decode(id_token, certs=signing_certs(), audience=project_id,
+                                   clock_skew_in_seconds=CLOCK_SKEW)
+    except ValueError as e:
+        raise InvalidIdToken(str(e)) from e
+    if claims.get("iss") != f"https://securetoken.google.com/{project_id}":
+        raise InvalidIdToken("ID token has an incorrect issuer")
+    sub = claims.get("sub")
+    if not isinstance(sub, str) or not sub or len(sub) > 128:
+        raise InvalidIdToken("ID token has an invalid subject")
+    claims["uid"] = sub
+    return claims
+
+
+def verify_id_token(id_token):
+    """
+    Decoded claims (with "uid") for a Firebase ID token, served from cache
+    until the token expires. Raises InvalidIdToken.
+    """
+    if not id_token or not isinstance(id_token, str):
+        raise InvalidIdToken("Missing ID token")
+    key = hashlib.sha256(id_token.encode()).hexdigest()
+    now = time.time()
+    with _tokens_lock:
+        cached = _tokens.get(key)
+        if cached is not None and cached[1] > now:
+            _tokens.move_to_end(key)
+            return dict(cached[0])
+
+    project_id = firebase.project_id()
+    if project_id:
+        claims = _verify_locally(id_token, project_id)
+    else:
+        # No project id in the config to check the audience against; let the SDK do it
+        firebase.init_firebase()
+        try:
+            claims = firebase_auth.verify_id_token(id_token, check_revoked=False,
+                                                   clock_skew_seconds=CLOCK_SKEW)
+        except (ValueError, firebase_auth.InvalidIdTokenError) as e:
+            raise InvalidIdToken(str(e)) from e
+
+    with _tokens_lock:
+        _tokens[key] = (claims, float(claims.get("exp", now)))
+        while len(_tokens) > TOKEN_CACHE_SIZE:
+            _tokens.popitem(last=False)
+    return dict(claims)
+
+
+# ---- app sessions ----
+def issue_session(uid, name=None):
+    """Short-lived app JWT for `uid` (lifetime: JWT_ACCESS_TOKEN_EXPIRES)."""
+    return create_access_token(identity=uid, additional_claims={"name": name})
+
+
+def _deny(status, message):
+    abort(make_response(jsonify({"error": message}), status))
+
+
+def request_uid(data=None, required=True):
+    """
+    The uid this request acts for: the identity of its app JWT
+    (Authorization: Bearer), and any uid in `data` or the query string must
+    match it. Aborts with 401 for a bad or expired JWT, or for none at all
+    when `required`; 403 on a uid mismatch. Without a JWT and not
+    `required`, None. ALLOW_LEGACY_UID_AUTH takes the claimed uid instead.
+    """
+    claimed = (data or {}).get("uid") or request.args.get("uid")
+    if request.headers.get("Authorization", "").startswith("Bearer "):
+        try:
+            verify_jwt_in_request()
+        except Exception:
+            _deny(401, "Session expired, please log in again")
+        identity = get_jwt_identity()
+        if claimed and claimed != identity:
+            _deny(403, "uid does not match the signed-in user")
+        return identity
+    if ALLOW_LEGACY_UID_AUTH:
+        return claimed
+    if required:
+        _deny(401, "Please log in")
+    return None
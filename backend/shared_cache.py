@@ -0,0 +1,186 @@
+"""
+Cache shared by every worker process on one host.
+
+gunicorn workers each have their own memory, so without this each one
+fetches the ticker list and every quote for itself. Entries live in a small
+SQLite database (WAL mode, so readers never block) next to the in-process
+caches, which stay the first stop:
+
+    entries(key, value JSON, stored, expires)
+    leases(key, owner, expires)
+
+A lease makes one worker the refresher for a key: acquire() is a single
+atomic upsert that only succeeds when nobody holds an unexpired lease, and
+the others wait_released() and then read what the holder published. A lease
+expires on its own, so a worker that dies mid-fetch only delays the others.
+
+Set SHARED_CACHE_PATH to an empty string to turn it off (every lookup
+misses and every lease is granted). Storage errors are logged and treated
+the same way, so the shared cache can slow nothing but itself.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import tempfile
+import threading
+
+log = logging.getLogger(__name__)
+
+SHARED_CACHE_PATH = os.environ.get(
+    "SHARED_CACHE_PATH", os.path.join(tempfile.gettempdir(), "stock-app-shared-cache.sqlite3")
+)
+PRUNE_EVERY = 500   # writes between sweeps of expired entries and leases
+
+_local = threading.local()
+_writes = 0
+
+
+def _owner():
+    # One lease holder per process; threads inside a process already coalesce
+    return f"{os.uname().nodename}:{os.getpid()}"
+
+
+def _connect():
+    conn = getattr(_local, "conn", None)
+    if conn is not None and _local.pid == os.getpid():
+        return conn
+    conn = sqlite3.connect(SHARED_CACHE_PATH, timeout=5, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS entries "
+        "(key TEXT PRIMARY KEY, value TEXT NOT NULL, stored REAL NOT NULL, expires REAL NOT NULL)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS leases (key TEXT PRIMARY KEY, owner TEXT NOT NULL, expires REAL NOT NULL)")
+    _local.conn, _local.pid = conn, os.getpid()
+    return conn
+
+
+def enabled():
+    return bool(SHARED_CACHE_PATH)
+
+
+def _run(default, fn):
+    if not enabled():
+        return default
+    try:
+        return fn(_connect())
+    except sqlite3.Error as e:
+        log.warning("Shared cache unavailable: %s", e)
+        return default
+
+
+def _chunks(keys, size=500):
+    # Stay under SQLite's limit on bound variables
+    return [keys[i:i + size] for i in range(0, len(keys), size)]
+
+
+# ---- entries ----
+def get_many(keys):
+    """{key: (value, stored)} for the keys that have an unexpired entry."""
+    keys = list(keys)
+    if not keys:
+        return {}
+
+    def query(conn):
+        found = {}
+        for chunk in _chunks(keys):
+            rows = conn.execute(
+                f"SELECT key, value, stored FROM entries WHERE expires > ? AND key IN ({','.join('?' * len(chunk))})",
+                [time.time(), *chunk],
+            )
+            found.update((key, (json.loads(value), stored)) for key, value, stored in rows)
+        return found
+    return _run({}, query)
+
+
+def get(key):
+    """(value, stored) or None."""
+    return get_many([key]).get(key)
+
+
+def get_prefix(prefix, since=0.0):
+    """{key: (value, stored)} for unexpired keys starting with `prefix` stored after `since`."""
+    def query(conn):
+        rows = conn.execute(
+            "SELECT key, value, stored FROM entries WHERE key >= ? AND key < ? AND stored > ? AND expires > ?",
+            (prefix, prefix + "\uffff", since, time.time()),
+        )
+        return {key: (json.loads(value), stored) for key, value, stored in rows}
+    return _run({}, query)
+
+
+def put_many(items, ttl, stored=None):
+    """Publish {key: JSON-serializable value}, each kept for `ttl` seconds (a number or {key: seconds})."""
+    if not items:
+        return
+    stored = time.time() if stored is None else stored
+    rows = [
+        (key, json.dumps(value), stored, stored + (ttl[key] if isinstance(ttl, dict) else ttl))
+        for key, value in items.items()
+    ]
+
+    def write(conn):
+        global _writes
+        conn.executemany("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)", rows)
+        _writes += len(rows)
+        if _writes >= PRUNE_EVERY:
+            _writes = 0
+            now = time.time()
+            conn.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+            conn.execute("DELETE FROM leases WHERE expires <= ?", (now,))
+    _run(None, write)
+
+
+def put(key, value, ttl, stored=None):
+    put_many({key: value}, ttl, stored)
+
+
+def delete_prefix(prefix):
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    _run(None, lambda conn: conn.execute("DELETE FROM entries WHERE key LIKE ? ESCAPE '\\'", (escaped + "%",)))
+
+
+# ---- leases ----
+def acquire(key, ttl):
+    """True if this process now holds the lease on `key` for `ttl` seconds."""
+    def upsert(conn):
+        now = time.time()
+        cur = conn.execute(
+            "INSERT INTO leases VALUES (?, ?, ?) ON CONFLICT(key) DO UPDATE "
+            "SET owner = excluded.owner, expires = excluded.expires "
+            "WHERE leases.expires <= ? OR leases.owner = excluded.owner",
+            (key, _owner(), now + ttl, now),
+        )
+        return cur.rowcount > 0
+    return _run(True, upsert)
+
+
+def release(key):
+    """Give up the lease on `key` if this process holds it."""
+    _run(None, lambda conn: conn.execute("DELETE FROM leases WHERE key = ? AND owner = ?", (key, _owner())))
+
+
+def wait_released(keys, timeout):
+    """Block until no other process holds a lease on any of `keys` (True) or `timeout` passes (False)."""
+    keys = list(keys)
+    if not keys or not enabled():
+        return True
+    until = time.monotonic() + timeout
+    delay = 0.02
+    while True:
+        held = _run(0, lambda conn: sum(
+            conn.execute(
+                f"SELECT COUNT(*) FROM leases WHERE expires > ? AND owner != ? AND key IN ({','.join('?' * len(chunk))})",
+                [time.time(), _owner(), *chunk],
+            ).fetchone()[0]
+            for chunk in _chunks(keys)
+        ))
+        if not held:
+            return True
+        if time.monotonic() >= until:
+            return False
+        time.sleep(min(delay, max(until - time.monotonic(), 0)))
+        delay = min(delay * 2, 0.2)
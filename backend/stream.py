@@ -0,0 +1,180 @@
+"""
+Live price fan-out for Server-Sent Events.
+
+Clients subscribe to a set of symbols. One background poller per process
+refreshes the union of everything subscribed through the shared quote cache
+and pushes only the quotes that changed since the last tick, so upstream
+traffic scales with distinct symbols instead of open tabs. Server-side
+listeners (the order trigger engine) can watch symbols too and get every
+tick's changed quotes, whether or not any browser is subscribed.
+
+Each open stream holds one request thread for as long as it stays open
+(gunicorn gthread), so a worker accepts at most STREAM_MAX_SUBSCRIBERS of
+them and answers 503 above that. Keep it below the worker's --threads
+(64 in the Procfile) so ordinary requests always have threads left; pages
+fall back to polling /dashboard/live-prices when refused.
+"""
+import os
+import json
+import queue
+import logging
+import threading
+
+from backend.quotes import get_quotes, normalize_symbol
+
+log = logging.getLogger(__name__)
+
+STREAM_POLL_INTERVAL = float(os.environ.get("STREAM_POLL_INTERVAL", 5))
+STREAM_KEEPALIVE = 15        # seconds between comment pings on an idle stream
+STREAM_MAX_SYMBOLS = 50      # per subscription
+STREAM_MAX_SUBSCRIBERS = int(os.environ.get("STREAM_MAX_SUBSCRIBERS", 48))   # per worker process
+SUBSCRIBER_QUEUE_SIZE = 32   # ticks buffered for a slow client before dropping old ones
+
+
+class Subscription:
+    def __init__(self, symbols):
+        self.symbols = frozenset(symbols)
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+    def push(self, quotes):
+        try:
+            self.queue.put_nowait(quotes)
+        except queue.Full:
+            # Slow consumer: drop the oldest tick rather than block the poller
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.queue.put_nowait(quotes)
+
+
+class PriceHub:
+    """Tracks subscribers and runs the single upstream poller for this process."""
+
+    def __init__(self, interval=STREAM_POLL_INTERVAL):
+        self.interval = interval
+        self._subs = set()
+        self._last = {}            # symbol -> last quote pushed
+        self._listeners = []       # (callback({symbol: quote}), symbols callable)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self.rejected = 0          # subscriptions refused at STREAM_MAX_SUBSCRIBERS
+
+    # ---- subscriptions ----
+    def subscribe(self, symbols):
+        """A new Subscription, or None if this process already serves STREAM_MAX_SUBSCRIBERS."""
+        symbols = [s for s in dict.fromkeys(normalize_symbol(s) for s in symbols) if s]
+        sub = Subscription(symbols[:STREAM_MAX_SYMBOLS])
+        with self._lock:
+            if len(self._subs) >= STREAM_MAX_SUBSCRIBERS:
+                self.rejected += 1
+                return None
+            self._subs.add(sub)
+            snapshot = [self._last[s] for s in sub.symbols if s in self._last]
+            self._ensure_poller()
+        # New subscribers get whatever is already known straight away
+        if snapshot:
+            sub.push(snapshot)
+        self._wake.set()
+        return sub
+
+    def unsubscribe(self, sub):
+        with self._lock:
+            self._subs.discard(sub)
+
+    def add_listener(self, callback, symbols):
+        """Call callback({symbol: quote}) with the changed quotes of each tick; symbols() adds to the poll set."""
+        with self._lock:
+            self._listeners.append((callback, symbols))
+        self.poke()
+
+    def poke(self):
+        """Poll now, starting the poller if it had stopped."""
+        with self._lock:
+            self._ensure_poller()
+        self._wake.set()
+
+    def last_quote(self, symbol):
+        with self._lock:
+            return self._last.get(normalize_symbol(symbol))
+
+    def subscriber_count(self):
+        with self._lock:
+            return len(self._subs)
+
+    def symbols(self):
+        with self._lock:
+            subs = list(self._subs)
+            listeners = list(self._listeners)
+        watched = set().union(*(s.symbols for s in subs))
+        for _, symbols in listeners:
+            watched.update(symbols())
+        return sorted(watched)
+
+    # ---- poller ----
+    def _ensure_poller(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="price-hub-poller", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            symbols = self.symbols()
+            if not symbols:
+                with self._lock:
+                    if not self._subs and not any(watched() for _, watched in self._listeners):
+                        # Nobody listening: let the thread exit, the next subscribe (or poke) restarts it
+                        self._thread = None
+                        return
+                continue
+            try:
+                self.tick(symbols)
+            except Exception as e:
+                log.error("Price hub tick failed: %s", e)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def tick(self, symbols):
+        """Refresh `symbols` once and push changed quotes to their subscribers."""
+        changed = {}
+        for quote in get_quotes(symbols):
+            if quote["error"] or quote["price"] is None:
+                continue
+            symbol = quote["symbol"]
+            previous = self._last.get(symbol)
+            if previous is None or previous["price"] != quote["price"] or previous["previousClose"] != quote["previousClose"]:
+                changed[symbol] = quote
+        if not changed:
+            return
+        with self._lock:
+            self._last.update(changed)
+            subs = list(self._subs)
+            listeners = list(self._listeners)
+        for callback, _ in listeners:
+            try:
+                callback(changed)
+            except Exception as e:
+                log.error("Price hub listener failed: %s", e)
+        for sub in subs:
+            quotes = [changed[s] for s in sub.symbols if s in changed]
+            if quotes:
+                sub.push(quotes)
+
+    # ---- SSE ----
+    def events(self, sub):
+        """Generator of SSE frames for one subscription; unsubscribes on disconnect."""
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    quotes = sub.queue.get(timeout=STREAM_KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: quotes\ndata: {json.dumps(quotes)}\n\n"
+        finally:
+            self.unsubscribe(sub)
+
+
+hub = PriceHub()
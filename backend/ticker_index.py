@@ -0,0 +1,161 @@
+"""
+Search index over the ticker universe ({symbol, name} dicts).
+
+Symbols and the words of company names go into one character trie. Every
+node keeps the best score per ticker for keys passing through it, so a
+prefix lookup is a walk of len(query) nodes with no subtree scan. Query words
+that match no prefix fall back to a bounded edit-distance walk of the trie
+("microsfot" -> MSFT). Multi-word queries must match every word.
+
+Lower scores rank higher:
+    exact symbol 0, symbol prefix 1, exact name word 2, name word prefix 3
+    (+0.1 per word position), fuzzy 5 + edit distance
+"""
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+SEARCH_CACHE_SIZE = 256
+MAX_LIMIT = 100
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+
+def _words(text):
+    return _WORD.findall((text or "").lower())
+
+
+def _max_distance(word):
+    if len(word) >= 8:
+        return 2
+    if len(word) >= 4:
+        return 1
+    return 0
+
+
+class _Node:
+    __slots__ = ("children", "prefix", "exact")
+
+    def __init__(self):
+        self.children = {}
+        self.prefix = {}  # ticker id -> best score for keys below this node
+        self.exact = {}   # ticker id -> best score for keys ending here
+
+
+def _keep_best(scores, ticker_id, score):
+    if score < scores.get(ticker_id, float("inf")):
+        scores[ticker_id] = score
+
+
+class TickerIndex:
+    def __init__(self, tickers):
+        self.tickers = tickers
+        self.etag = hashlib.sha1(json.dumps(tickers, sort_keys=True).encode()).hexdigest()
+        self._root = _Node()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        for i, t in enumerate(tickers):
+            symbol = (t.get("symbol") or "").lower()
+            if symbol:
+                self._insert(symbol, i, prefix_score=1, exact_score=0)
+                # "BRK-B" is also reachable as "brkb"
+                compact = "".join(_words(symbol))
+                if compact != symbol:
+                    self._insert(compact, i, prefix_score=1, exact_score=0)
+            for pos, word in enumerate(_words(t.get("name"))):
+                penalty = 0.1 * pos
+                self._insert(word, i, prefix_score=3 + penalty, exact_score=2 + penalty)
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def _insert(self, key, ticker_id, prefix_score, exact_score):
+        node = self._root
+        for ch in key:
+            node = node.children.setdefault(ch, _Node())
+            _keep_best(node.prefix, ticker_id, prefix_score)
+        _keep_best(node.exact, ticker_id, exact_score)
+
+    def _prefix(self, word):
+        node = self._root
+        for ch in word:
+            node = node.children.get(ch)
+            if node is None:
+                return {}
+        scores = dict(node.prefix)
+        for ticker_id, score in node.exact.items():
+            _keep_best(scores, ticker_id, score)
+        return scores
+
+    def _fuzzy(self, word):
+        """Tickers with a key within _max_distance(word) edits of `word` (Levenshtein over the trie)."""
+        limit = _max_distance(word)
+        scores = {}
+        if not limit:
+            return scores
+        first_row = list(range(len(word) + 1))
+        stack = [(child, ch, first_row) for ch, child in self._root.children.items()]
+        while stack:
+            node, ch, prev = stack.pop()
+            row = [prev[0] + 1]
+            for col in range(1, len(word) + 1):
+                cost = 0 if word[col - 1] == ch else 1
+                row.append(min(row[col - 1] + 1, prev[col] + 1, prev[col - 1] + cost))
+            if row[-1] <= limit:
+                for ticker_id in node.exact:
+                    _keep_best(scores, ticker_id, 5 + row[-1])
+            if min(row) <= limit:
+                stack.extend((child, c, row) for c, child in node.children.items())
+        return scores
+
+    def _ranked(self, query):
+        words = _words(query)
+        if not words:
+            return list(range(len(self.tickers)))
+        total = None
+        for word in words:
+            scores = self._prefix(word) or self._fuzzy(word)
+            if total is None:
+                total = scores
+            else:
+                total = {i: s + scores[i] for i, s in total.items() if i in scores}
+            if not total:
+                return []
+        return sorted(total, key=lambda i: (total[i], len(self.tickers[i]["symbol"]), self.tickers[i]["symbol"]))
+
+    def search(self, query, offset=0, limit=20):
+        """
+        (matches, total) for `query`: the ranked page starting at `offset`.
+        An empty query pages through the universe in its stored order.
+        """
+        key = " ".join(_words(query))
+        with self._lock:
+            ranked = self._cache.get(key)
+            if ranked is not None:
+                self._cache.move_to_end(key)
+        if ranked is None:
+            ranked = self._ranked(key)
+            with self._lock:
+                self._cache[key] = ranked
+                if len(self._cache) > SEARCH_CACHE_SIZE:
+                    self._cache.popitem(last=False)
+        page = ranked[offset:offset + limit]
+        return [self.tickers[i] for i in page], len(ranked)
+
+
+_current = None
+_current_lock = threading.Lock()
+
+
+def index_for(tickers):
+    """The index for this exact tickers list, rebuilt when the list object changes."""
+    global _current
+    index = _current
+    if index is not None and index.tickers is tickers:
+        return index
+    with _current_lock:
+        if _current is None or _current.tickers is not tickers:
+            _current = TickerIndex(tickers)
+        return _current
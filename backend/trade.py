@@ -1,22 +1,24 @@
-from flask import Blueprint, render_template, jsonify, request, current_app as app
-import yfinance as yf
-import pandas as pd
+from flask import Blueprint, render_template, jsonify, request, make_response, current_app as app
 import time
 import threading
-import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import numpy as np
+from backend.quotes import get_quote, get_price
+from backend.bars import get_bars, load, window, InvalidSymbol, REFRESH_AFTER
+from backend.market_data import get_provider
+from backend.ticker_index import index_for, MAX_LIMIT
+from backend import backtest, charts, fanout, indicators, shared_cache
+from backend.firebase import get_db
+from backend.lazy import lazy
 
-trade_bp = Blueprint("trade", __name__)
+pd = lazy("pandas")
 
-# Firestore helper
-import firebase_admin
-from firebase_admin import firestore
-def get_db():
-    return firestore.client()
+trade_bp = Blueprint("trade", __name__)
 
 # ----------------- requests helper -----------------
 def requests_session(retries=2, backoff=0.3, status_forcelist=(429,500,502,503,504)):
+    import requests
+    from requests.adapters import HTTPAdapter
+    from urllib3.util.retry import Retry
     s = requests.Session()
     retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=status_forcelist, allowed_methods=["GET","POST"])
     s.mount("https://", HTTPAdapter(max_retries=retry))
@@ -48,6 +50,9 @@ TICKER_CACHE = {
     "all_ready": False,
 }
 TICKER_CACHE_DURATION = 86400  # 24 hours for ticker list
+# Seconds one worker may spend fetching the list for everyone before another takes over
+TICKER_LEASE_TTL = 120
+_ticker_lock = threading.Lock()
 
 # Built-in fallback tickers (top stocks by market cap)
 BUILTIN_TICKERS = [
@@ -103,43 +108,82 @@ BUILTIN_TICKERS = [
     {"symbol": "PYPL", "name": "PayPal Holdings Inc."},
 ]
 
-def _fetch_all_tickers_background():
-    """Background thread: fetch full ticker list from GitHub and store in cache."""
+def _shared_tickers():
+    """(tickers, fetched) published by any worker within TICKER_CACHE_DURATION, or None."""
+    found = shared_cache.get("tickers")
+    return (found[0], found[1]) if found and found[0] else None
+
+
+def _fetch_all_tickers_background(flask_app):
+    """
+    Background thread: load the full ticker list into the cache. The list is
+    shared between workers, so only the worker holding the "tickers" lease
+    asks the market-data provider; the others wait for it and reuse its copy.
+    """
+    log = flask_app.logger
     try:
-        tickers_url = "https://raw.githubusercontent.com/datasets/s-and-p-500-companies/master/data/constituents.csv"
-        text = fetch_text_with_ua(tickers_url, timeout=10)
-        lines = text.strip().splitlines()
-
-        all_tickers = []
-        seen = set()
-        # CSV format: Symbol,Name,Sector
-        for line in lines[1:]:  # skip header
-            parts = line.split(",")
-            if len(parts) >= 2:
-                symbol = parts[0].strip()
-                name = parts[1].strip()
-                if symbol and symbol not in seen:
-                    seen.add(symbol)
-                    all_tickers.append({"symbol": symbol, "name": name})
+        shared = _shared_tickers()
+        if shared is None and not shared_cache.acquire("tickers", TICKER_LEASE_TTL):
+            shared_cache.wait_released(["tickers"], TICKER_LEASE_TTL)
+            shared = _shared_tickers()
+
+        if shared is not None:
+            all_tickers, fetched = shared
+            log.info("Ticker list loaded from shared cache: %d tickers", len(all_tickers))
+        else:
+            try:
+                all_tickers, fetched = get_provider().tickers(), time.time()
+                if all_tickers:
+                    shared_cache.put("tickers", all_tickers, TICKER_CACHE_DURATION, stored=fetched)
+            finally:
+                shared_cache.release("tickers")
 
         if all_tickers:
             TICKER_CACHE["tickers"] = all_tickers
             TICKER_CACHE["all_ready"] = True
-            TICKER_CACHE["timestamp"] = time.time()
-            app.logger.info("Background ticker fetch complete: %d tickers", len(all_tickers))
+            TICKER_CACHE["timestamp"] = fetched
+            log.info("Background ticker fetch complete: %d tickers", len(all_tickers))
         else:
-            app.logger.warning("Background ticker fetch returned empty list, keeping builtin fallback")
+            log.warning("Background ticker fetch returned empty list, keeping builtin fallback")
 
     except Exception as e:
-        app.logger.error("Background ticker fetch failed: %s", e)
+        log.error("Background ticker fetch failed: %s", e)
     finally:
-        TICKER_CACHE["loading"] = False
+        with _ticker_lock:
+            TICKER_CACHE["loading"] = False
 
 
 @trade_bp.route("/trade")
 def trade():
     return render_template("trade.html")
 
+def ensure_tickers():
+    """
+    Current ticker list, kicking off the background fetch when the cache is
+    empty or older than TICKER_CACHE_DURATION. Builtin tickers are served
+    until the full list lands.
+    """
+    now = time.time()
+    fresh = TICKER_CACHE["all_ready"] and now - TICKER_CACHE["timestamp"] < TICKER_CACHE_DURATION
+
+    # If not fresh and not loading yet, start background fetch
+    if not fresh:
+        with _ticker_lock:
+            if TICKER_CACHE["loading"]:
+                return TICKER_CACHE["tickers"]
+            TICKER_CACHE["loading"] = True
+            TICKER_CACHE["initial_ready"] = True
+            # Set builtin tickers as initial cache
+            if not TICKER_CACHE["tickers"]:
+                TICKER_CACHE["tickers"] = BUILTIN_TICKERS[:]
+        thread = threading.Thread(
+            target=_fetch_all_tickers_background, args=(app._get_current_object(),), daemon=True
+        )
+        thread.start()
+
+    return TICKER_CACHE["tickers"]
+
+
 @trade_bp.route("/trade/stocks")
 def get_stocks():
     """
@@ -148,61 +192,85 @@ def get_stocks():
     - Immediately returns builtin tickers if cache is empty
     - Kicks off background fetch for the full S&P 500 list
     - Once loaded, returns the full list
+    The response carries an ETag of the list, so a revalidating client gets
+    304 Not Modified instead of the full JSON until the list changes.
     """
     try:
-        now = time.time()
+        index = index_for(ensure_tickers())
+        complete = TICKER_CACHE["all_ready"]
+        etag = f"{index.etag}-{int(complete)}"
 
-        # If cache is fresh and fully loaded, return it
-        if TICKER_CACHE["all_ready"] and now - TICKER_CACHE["timestamp"] < TICKER_CACHE_DURATION:
-            return jsonify({"stocks": TICKER_CACHE["tickers"], "complete": True})
+        if request.if_none_match.contains(etag):
+            resp = make_response("", 304)
+        else:
+            resp = jsonify({"stocks": index.tickers, "complete": complete})
+        resp.set_etag(etag)
+        # Let the browser keep it but revalidate every time
+        resp.headers["Cache-Control"] = "no-cache"
+        return resp
+
+    except Exception as e:
+        app.logger.error("get_stocks error: %s", e, exc_info=True)
+        return jsonify({"stocks": BUILTIN_TICKERS, "complete": False})
 
-        # If not loading yet, start background fetch
-        if not TICKER_CACHE["loading"]:
-            TICKER_CACHE["loading"] = True
-            TICKER_CACHE["initial_ready"] = True
-            # Set builtin tickers as initial cache
-            if not TICKER_CACHE["tickers"]:
-                TICKER_CACHE["tickers"] = BUILTIN_TICKERS[:]
-            thread = threading.Thread(target=_fetch_all_tickers_background, daemon=True)
-            thread.start()
 
-        # Return whatever we have (builtin or partial)
+@trade_bp.route("/trade/stocks/search")
+def search_stocks():
+    """
+    Ranked ticker search over symbols and company names.
+    Params: q (query), limit (default 20, max 100), cursor (from nextCursor).
+    Returns {results: [{symbol, name}], total, nextCursor, complete}.
+    """
+    query = request.args.get("q", "")
+    try:
+        limit = min(max(int(request.args.get("limit", 20)), 1), MAX_LIMIT)
+    except ValueError:
+        return jsonify({"error": "Invalid limit"}), 400
+
+    try:
+        index = index_for(ensure_tickers())
+
+        # Cursors are "<index version>:<offset>"; one from an older list starts over
+        offset = 0
+        cursor = request.args.get("cursor")
+        if cursor:
+            version, _, raw_offset = cursor.partition(":")
+            if version == index.etag[:12] and raw_offset.isdigit():
+                offset = int(raw_offset)
+
+        results, total = index.search(query, offset, limit)
+        next_offset = offset + len(results)
         return jsonify({
-            "stocks": TICKER_CACHE["tickers"],
-            "complete": TICKER_CACHE["all_ready"]
+            "results": results,
+            "total": total,
+            "nextCursor": f"{index.etag[:12]}:{next_offset}" if next_offset < total else None,
+            "complete": TICKER_CACHE["all_ready"],
         })
 
     except Exception as e:
-        app.logger.error("get_stocks error: %s", e, exc_info=True)
-        return jsonify({"stocks": BUILTIN_TICKERS, "complete": False})
+        app.logger.error("search_stocks error for %r: %s", query, e, exc_info=True)
+        return jsonify({"error": "Search failed"}), 500
 
 
 @trade_bp.route("/trade/stock-price")
 def stock_price():
     """
     Returns live price for a single stock symbol.
-    Uses yfinance history for reliability.
+    Reads through the shared quote cache (backend.quotes).
     """
     symbol = request.args.get("symbol")
     if not symbol:
         return jsonify({"error": "Missing symbol"}), 400
 
     try:
-        ticker = yf.Ticker(symbol)
-        hist = ticker.history(period="1d", interval="5m")
-
-        current_price = None
+        # Price and previous close come from different upstream calls; run them together
+        prev_close_future = fanout.submit(get_quote, symbol, ("previousClose",))
+        current_price = get_price(symbol)
         prev_close = None
 
-        if not hist.empty:
-            current_price = float(hist['Close'].iloc[-1])
-
-        # Try to get previous close from info
+        # Previous close is nice-to-have; don't fail the price on it
         try:
-            info = ticker.info or {}
-            prev_close = info.get("previousClose")
-            if current_price is None:
-                current_price = info.get("currentPrice")
+            prev_close = prev_close_future.result()["previousClose"]
         except Exception:
             pass
 
@@ -232,46 +300,147 @@ def stock_price():
 def buysell():
     return render_template("buy-sell.html")
 
+# Bar interval charted for each period
+PERIOD_INTERVAL = {
+    '1d': '5m',
+    '5d': '15m',
+    '1mo': '1d',
+    '3mo': '1d',
+    '6mo': '1d',
+    '1y': '1wk',
+}
+
+
+def _chart_labels(bars, tz, period):
+    """Labels for charted bars: times for intraday periods, dates otherwise, in the exchange's timezone."""
+    index = pd.to_datetime(bars['t'], unit='s', utc=True).tz_convert(tz)
+    if period in ('1d', '5d'):
+        return index.strftime('%H:%M').tolist()
+    return index.strftime('%Y-%m-%d').tolist()
+
+
 @trade_bp.route('/api/stock-data')
 def stock_data():
     """
     Returns historical intraday data for a specific symbol.
     Supports period param: 1d, 5d, 1mo, 3mo, 6mo, 1y
+    Served from the local bar store (backend.bars), which only asks
+    yfinance for bars newer than what it already has.
+    Optional maxPoints and format=compact, see backend.charts.
     """
     symbol = request.args.get('symbol')
     period = request.args.get('period', '1d')
     if not symbol:
         return jsonify({'error': 'Missing symbol'}), 400
+    try:
+        max_points = charts.max_points(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
 
-    # Map period to appropriate interval
-    interval_map = {
-        '1d': '5m',
-        '5d': '15m',
-        '1mo': '1d',
-        '3mo': '1d',
-        '6mo': '1d',
-        '1y': '1wk',
-    }
-    interval = interval_map.get(period, '5m')
+    interval = PERIOD_INTERVAL.get(period, '5m')
 
     try:
         try:
-            hist = yf.Ticker(symbol).history(period=period, interval=interval)
+            bars, tz = get_bars(symbol, interval, period)
+        except InvalidSymbol as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
             app.logger.error("yfinance history error for %s: %s", symbol, e, exc_info=True)
             return jsonify({'error': 'Failed to fetch stock history'}), 500
 
-        if hist.empty:
+        if len(bars) == 0:
             return jsonify({'error': 'No data available for symbol'}), 404
 
-        prices = hist['Close'].tolist()
-        # Format labels based on period
-        if period in ('1d', '5d'):
-            labels = hist.index.strftime('%H:%M').tolist()
-        else:
-            labels = hist.index.strftime('%Y-%m-%d').tolist()
-
-        return jsonify({'labels': labels, 'prices': prices})
+        if max_points:
+            bars = bars[charts.lttb(bars['t'], [bars['close']], max_points)]
+        if charts.compact_requested(request.args):
+            return charts.compact_response(bars['t'], {'prices': bars['close']}, tz=tz, period=period)
+        prices = bars['close'].tolist()
+        return jsonify({'labels': _chart_labels(bars, tz, period), 'prices': prices})
     except Exception as e:
         app.logger.error("stock_data error for %s: %s", symbol, e, exc_info=True)
         return jsonify({'error': 'Server error fetching stock data'}), 500
+
+
+def _nulls(values):
+    out = np.round(values, 6).astype(object)
+    out[np.isnan(values)] = None
+    return out.tolist()
+
+
+@trade_bp.route('/api/indicators')
+def indicator_data():
+    """
+    Indicator series for the same bars /api/stock-data charts.
+    Params: symbol, period (as /api/stock-data), interval (defaults to the
+    period's), indicators=sma:20,ema:50,rsi:14,macd:12:26:9,bbands:20:2,vwap
+    """
+    symbol = request.args.get('symbol')
+    period = request.args.get('period', '1d')
+    interval = request.args.get('interval') or PERIOD_INTERVAL.get(period, '5m')
+    specs = [s for s in request.args.get('indicators', 'sma').split(',') if s.strip()]
+    if not symbol:
+        return jsonify({'error': 'Missing symbol'}), 400
+    if interval not in REFRESH_AFTER:
+        return jsonify({'error': f"interval must be one of {', '.join(REFRESH_AFTER)}"}), 400
+    if len(specs) > indicators.INDICATOR_MAX_PER_REQUEST:
+        return jsonify({'error': f'At most {indicators.INDICATOR_MAX_PER_REQUEST} indicators'}), 400
+    try:
+        parsed = {spec.strip(): indicators.parse(spec) for spec in specs}
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+    try:
+        try:
+            bars, tz = load(symbol, interval)
+        except InvalidSymbol as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            app.logger.error("yfinance history error for %s: %s", symbol, e, exc_info=True)
+            return jsonify({'error': 'Failed to fetch stock history'}), 500
+
+        shown = window(bars, tz, period)
+        if len(shown) == 0:
+            return jsonify({'error': 'No data available for symbol'}), 404
+
+        result = {}
+        for spec, (name, params) in parsed.items():
+            values = indicators.series(symbol, interval, name, params, bars, tz)
+            # Same tail as the window; NaN (warm-up, no volume) becomes null
+            result[spec] = {key: _nulls(series[-len(shown):]) for key, series in values.items()}
+        return jsonify({
+            'labels': _chart_labels(shown, tz, period),
+            'prices': shown['close'].tolist(),
+            'indicators': result,
+        })
+    except Exception as e:
+        app.logger.error("indicator error for %s: %s", symbol, e, exc_info=True)
+        return jsonify({'error': 'Server error computing indicators'}), 500
+
+
+@trade_bp.route('/api/backtest', methods=['POST'])
+def run_backtest():
+    """
+    Backtest a strategy on daily bars.
+    Body: {symbols: [...], start: "YYYY-MM-DD", end: "YYYY-MM-DD",
+           strategy: "buy_hold" | "sma_cross" | "rsi", params: {...}, initialCash}
+    A list as a param value sweeps over it; see backend.backtest.
+    """
+    data = request.get_json(silent=True) or {}
+    symbols = data.get('symbols') or []
+    if isinstance(symbols, str):
+        symbols = symbols.split(',')
+    try:
+        cash = float(data.get('initialCash', 10000))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'initialCash must be a number'}), 400
+
+    try:
+        result = backtest.run(symbols, data.get('start'), data.get('end'),
+                              data.get('strategy', 'buy_hold'), data.get('params'), cash)
+    except backtest.BacktestError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        app.logger.error("backtest error for %s: %s", symbols, e, exc_info=True)
+        return jsonify({'error': 'Server error running backtest'}), 500
+    return jsonify(result)
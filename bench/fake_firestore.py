@@ -0,0 +1,331 @@
+"""
+In-memory stand-in for the slice of the Firestore client API the app uses.
+
+Good enough to drive every endpoint in a benchmark without a network: nested
+collections, get/set(merge)/update/add/stream, simple queries
+(where/order_by/start_after/limit), SERVER_TIMESTAMP and
+optimistic transactions that work with @firestore.transactional. Every
+operation can be given an artificial latency to approximate Firestore
+round trips (FakeFirestore(latency_ms=...)).
+"""
+import copy
+import time
+import uuid
+import random
+import threading
+import datetime as dt
+from collections import defaultdict
+
+from firebase_admin import firestore
+from google.api_core.exceptions import Aborted, Conflict, NotFound
+
+
+def _now():
+    return dt.datetime.now(dt.timezone.utc)
+
+
+def _resolve(value):
+    """Replace write sentinels with concrete values, recursively."""
+    if value is firestore.SERVER_TIMESTAMP:
+        return _now()
+    if isinstance(value, dict):
+        return {k: _resolve(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_resolve(v) for v in value]
+    return value
+
+
+def _deep_merge(target, updates):
+    for key, value in updates.items():
+        if isinstance(value, dict) and isinstance(target.get(key), dict):
+            _deep_merge(target[key], value)
+        else:
+            target[key] = value
+
+
+def _set_path(target, dotted, value):
+    parts = dotted.split(".")
+    for part in parts[:-1]:
+        target = target.setdefault(part, {})
+    target[parts[-1]] = value
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data):
+        self.reference = reference
+        self.id = reference.id
+        self._data = data
+
+    @property
+    def exists(self):
+        return self._data is not None
+
+    def to_dict(self):
+        return copy.deepcopy(self._data) if self._data is not None else None
+
+    def get(self, field):
+        return (self._data or {}).get(field)
+
+
+class FakeDocumentReference:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def collection(self, name):
+        return FakeCollectionReference(self._db, f"{self.path}/{name}")
+
+    @property
+    def _parent(self):
+        return self._db._collections[self.path.rsplit("/", 1)[0]]
+
+    def get(self, transaction=None):
+        if transaction is None:
+            self._db._op()
+        with self._db._lock:
+            if transaction is not None:
+                transaction._track(self.path)
+            return FakeSnapshot(self, copy.deepcopy(self._parent.get(self.id)))
+
+    def set(self, data, merge=False):
+        self._db._op()
+        self._apply_set(data, merge)
+
+    def update(self, data):
+        self._db._op()
+        self._apply_update(data)
+
+    # ---- raw writes shared with transactions (no op count / latency) ----
+    def _apply_set(self, data, merge=False):
+        data = _resolve(copy.deepcopy(data))
+        with self._db._lock:
+            parent = self._parent
+            if merge and self.id in parent:
+                _deep_merge(parent[self.id], data)
+            else:
+                parent[self.id] = data
+            self._db._bump(self.path)
+
+    def _apply_update(self, data):
+        with self._db._lock:
+            doc = self._parent.get(self.id)
+            if doc is None:
+                raise NotFound(f"No document to update: {self.path}")
+            for key, value in _resolve(copy.deepcopy(data)).items():
+                _set_path(doc, key, value)
+            self._db._bump(self.path)
+
+    def _apply_create(self, data):
+        with self._db._lock:
+            if self.id in self._parent:
+                raise Conflict(f"Document already exists: {self.path}")
+            self._apply_set(data)
+
+
+_OPS = {
+    "==": lambda a, b: a == b,
+    "!=": lambda a, b: a != b,
+    "<": lambda a, b: a < b,
+    "<=": lambda a, b: a <= b,
+    ">": lambda a, b: a > b,
+    ">=": lambda a, b: a >= b,
+    "in": lambda a, b: a in b,
+}
+
+
+class FakeQuery:
+    """where / order_by / start_after / limit over one collection, evaluated on stream()."""
+
+    def __init__(self, collection, filters=(), orders=(), start=None, count=None):
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._start = start
+        self._count = count
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, start=self._start, count=self._count)
+        state.update(changes)
+        return FakeQuery(self._collection, **state)
+
+    def where(self, field_path=None, op_string=None, value=None, filter=None):
+        if filter is not None:
+            field_path, op_string, value = filter.field_path, filter.op_string, filter.value
+        return self._copy(filters=self._filters + ((field_path, op_string, value),))
+
+    def order_by(self, field_path, direction="ASCENDING"):
+        return self._copy(orders=self._orders + ((field_path, direction == "DESCENDING"),))
+
+    def start_after(self, document_fields_or_snapshot):
+        values = document_fields_or_snapshot
+        if isinstance(values, FakeSnapshot):
+            values = values.to_dict() or {}
+        return self._copy(start=values)
+
+    def limit(self, count):
+        return self._copy(count=count)
+
+    def stream(self, transaction=None):
+        snapshots = []
+        for snap in self._collection.stream(transaction=transaction):
+            data = snap.to_dict()
+            if all(f in data and _OPS[op](data[f], v) for f, op, v in self._filters):
+                if all(field in data for field, _ in self._orders):
+                    snapshots.append(snap)
+        for field, descending in reversed(self._orders):
+            snapshots.sort(key=lambda s: s.get(field), reverse=descending)
+        if self._start is not None:
+            cursor = tuple(self._start.get(field) for field, _ in self._orders)
+
+            def after(snap):
+                for (field, descending), bound in zip(self._orders, cursor):
+                    value = snap.get(field)
+                    if value != bound:
+                        return value < bound if descending else value > bound
+                return False
+            snapshots = [s for s in snapshots if after(s)]
+        if self._count is not None:
+            snapshots = snapshots[:self._count]
+        return iter(snapshots)
+
+
+class FakeCollectionReference:
+    def __init__(self, db, path):
+        self._db = db
+        self.path = path
+        self.id = path.rsplit("/", 1)[-1]
+
+    def where(self, *args, **kwargs):
+        return FakeQuery(self).where(*args, **kwargs)
+
+    def order_by(self, *args, **kwargs):
+        return FakeQuery(self).order_by(*args, **kwargs)
+
+    def limit(self, count):
+        return FakeQuery(self).limit(count)
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._db, f"{self.path}/{doc_id or uuid.uuid4().hex[:20]}")
+
+    def add(self, data):
+        ref = self.document()
+        ref.set(data)
+        return _now(), ref
+
+    def stream(self, transaction=None):
+        if transaction is None:
+            self._db._op()
+        with self._db._lock:
+            docs = [(doc_id, copy.deepcopy(data)) for doc_id, data in self._db._collections[self.path].items()]
+            if transaction is not None:
+                for doc_id, _ in docs:
+                    transaction._track(f"{self.path}/{doc_id}")
+        for doc_id, data in docs:
+            yield FakeSnapshot(FakeDocumentReference(self._db, f"{self.path}/{doc_id}"), data)
+
+
+class FakeCollectionGroup:
+    """Every collection named `collection_id`, at any depth."""
+
+    def __init__(self, db, collection_id):
+        self._db = db
+        self._id = collection_id
+
+    def where(self, *args, **kwargs):
+        return FakeQuery(self).where(*args, **kwargs)
+
+    def stream(self, transaction=None):
+        with self._db._lock:
+            paths = [p for p in self._db._collections if p.rsplit("/", 1)[-1] == self._id]
+        for path in paths:
+            yield from FakeCollectionReference(self._db, path).stream(transaction=transaction)
+
+
+class FakeTransaction:
+    """
+    Optimistic transaction compatible with firestore.transactional: reads
+    record document versions, writes are buffered and applied atomically at
+    commit, and a commit whose reads went stale raises Aborted (so the
+    decorator retries it).
+    """
+
+    def __init__(self, db, max_attempts=5):
+        self._db = db
+        self._max_attempts = max_attempts
+        self._read_only = False
+        self._id = None
+        self._reads = {}
+        self._writes = []
+
+    def _track(self, path):
+        self._reads.setdefault(path, self._db._versions.get(path, 0))
+
+    def _clean_up(self):
+        self._id = None
+        self._reads = {}
+        self._writes = []
+
+    def _begin(self, retry_id=None):
+        self._db._op()
+        self._id = uuid.uuid4().bytes
+
+    def _rollback(self):
+        self._clean_up()
+
+    def _commit(self):
+        self._db._op()
+        with self._db._lock:
+            for path, version in self._reads.items():
+                if self._db._versions.get(path, 0) != version:
+                    self._clean_up()
+                    raise Aborted(f"Transaction read of {path} went stale")
+            for write in self._writes:
+                write()
+        self._clean_up()
+        return []
+
+    def set(self, reference, data, merge=False):
+        self._writes.append(lambda: reference._apply_set(data, merge))
+
+    def update(self, reference, data):
+        self._writes.append(lambda: reference._apply_update(data))
+
+    def create(self, reference, data):
+        self._writes.append(lambda: reference._apply_create(data))
+
+
+class FakeFirestore:
+    def __init__(self, latency_ms=0.0, seed=0):
+        # collection path ("users", "users/uid/trades") -> {doc id: data}
+        self._collections = defaultdict(dict)
+        self._versions = {}  # doc path -> write counter, for transaction conflict checks
+        self._lock = threading.RLock()
+        self.latency_ms = latency_ms
+        self._rng = random.Random(seed)
+        self.ops = 0
+
+    def _op(self):
+        with self._lock:
+            self.ops += 1
+            delay = self._rng.expovariate(1.0 / self.latency_ms) if self.latency_ms > 0 else 0.0
+        if delay:
+            time.sleep(delay / 1000.0)
+
+    def _bump(self, path):
+        self._versions[path] = self._versions.get(path, 0) + 1
+
+    def collection(self, name):
+        return FakeCollectionReference(self, name)
+
+    def collection_group(self, collection_id):
+        return FakeCollectionGroup(self, collection_id)
+
+    def transaction(self, max_attempts=5, read_only=False):
+        return FakeTransaction(self, max_attempts=max_attempts)
+
+    def peek(self, path):
+        """Document data at `path` without counting an op or adding latency."""
+        collection, _, doc_id = path.rpartition("/")
+        with self._lock:
+            return copy.deepcopy(self._collections[collection].get(doc_id))
@@ -0,0 +1,316 @@
+"""
+Endpoint benchmark for the Flask app in app.py.
+
+Boots the real app against an in-memory Firestore (bench/fake_firestore.py)
+and the synthetic market-data provider, seeds users with trade history, then
+drives a weighted mix of endpoints from concurrent threads and reports
+throughput and p50/p95/p99 latency per endpoint. Results are written as JSON
+so runs can be compared across commits.
+
+    python -m bench.run_endpoints --requests 5000 --concurrency 32
+    python -m bench.run_endpoints --firestore-latency-ms 20 --market-latency-ms 150
+    python -m bench.run_endpoints --compare bench/results/old.json bench/results/new.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+import subprocess
+import threading
+import datetime as dt
+from contextlib import ExitStack
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bench.fake_firestore import FakeFirestore  # noqa: E402
+
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+
+SYMBOLS = ["AAPL", "MSFT", "AMZN", "GOOGL", "TSLA", "NVDA", "META", "JPM", "V", "UNH",
+           "JNJ", "WMT", "MA", "PG", "HD", "XOM", "DIS", "BAC", "NFLX", "ADBE"]
+
+DEFAULT_MIX = {
+    "stock-price": 30,
+    "live-prices": 20,
+    "updated_balance": 10,
+    "update_sell": 10,
+    "portfolio-trades": 15,
+    "chart-data": 15,
+    "portfolio-summary": 10,
+}
+
+
+# ---- app boot ----
+def boot_app(stack, db, provider, bar_dir):
+    """Import app.py with Firebase pointed at `db` and market data at `provider`."""
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+    from backend import market_data
+
+    stack.enter_context(mock.patch.dict(os.environ, {
+        "FIREBASE_CONFIG": os.environ.get("FIREBASE_CONFIG", "{}"),
+        "JWT_SECRET_KEY": os.environ.get("JWT_SECRET_KEY", "bench-" + os.urandom(16).hex()),
+        "BAR_STORE_DIR": bar_dir,
+    }))
+    stack.enter_context(mock.patch.object(credentials, "Certificate", lambda cfg: None))
+    stack.enter_context(mock.patch.object(firebase_admin, "initialize_app", lambda *a, **k: None))
+    stack.enter_context(mock.patch.object(firestore, "client", lambda *a, **k: db))
+    previous = market_data.set_provider(provider)
+    stack.callback(market_data.set_provider, previous)
+
+    from backend import bars, shared_cache
+    stack.enter_context(mock.patch.object(bars, "BAR_STORE_DIR", bar_dir))
+    # A fresh shared cache per run, so one run can't warm the next
+    stack.enter_context(mock.patch.object(shared_cache, "SHARED_CACHE_PATH",
+                                          os.path.join(bar_dir, "shared-cache.sqlite3")))
+
+    import app as app_module
+    return app_module.app
+
+
+def seed_users(db, users, trades_per_user, rng):
+    """Users with a large balance, a few holdings and `trades_per_user` historical buys."""
+    from backend.positions import positions_from_trades
+
+    uids = []
+    start = time.time() - 90 * 86400
+    for i in range(users):
+        uid = f"bench-user-{i:04d}"
+        trades_ref = db.collection("users").document(uid).collection("trades")
+        trades = []
+        for j in range(trades_per_user):
+            symbol = rng.choice(SYMBOLS)
+            price = round(rng.uniform(20, 500), 2)
+            trades.append({
+                "symbol": symbol,
+                "quantity": float(rng.randint(1, 20)),
+                "buy_price": price,
+                "live_price": price,
+                "timestamp": dt.datetime.fromtimestamp(start + j * 600, tz=dt.timezone.utc),
+                "pl": 0,
+                "buy": True,
+                "seq": j + 1,
+            })
+        for trade in trades:
+            trades_ref.add(trade)
+        db.collection("users").document(uid).set({
+            "name": uid,
+            "email": f"{uid}@example.com",
+            "balance": 10_000_000.0,
+            "startingBalance": 10_000_000.0,
+            "profit": 0,
+            "loss": 0,
+            "positions": positions_from_trades(trades),
+            "tradeSeq": len(trades),
+        })
+        uids.append(uid)
+    return uids
+
+
+# ---- request mix ----
+def build_request(kind, rng, uid, db):
+    """(method, url, json_body) for one request of `kind`."""
+    symbol = rng.choice(SYMBOLS)
+    if kind == "stock-price":
+        return "GET", f"/trade/stock-price?symbol={symbol}", None
+    if kind == "live-prices":
+        return "POST", "/dashboard/live-prices", {"symbols": rng.sample(SYMBOLS, 5)}
+    if kind == "updated_balance":
+        return "POST", "/dashboard/updated_balance", {
+            "uid": uid, "symbol": symbol, "quantity": rng.randint(1, 5), "price": "100.00",
+        }
+    if kind == "update_sell":
+        positions = (db.peek(f"users/{uid}") or {}).get("positions") or {}
+        held = [s for s, p in positions.items() if p.get("quantity", 0) >= 1]
+        symbol = rng.choice(held) if held else symbol
+        return "POST", "/dashboard/update_sell", {
+            "uid": uid, "symbol": symbol, "quantity": 1, "price": "100.00",
+            "totalValue": 100.0, "timestamp": int(time.time() * 1000),
+        }
+    if kind == "portfolio-trades":
+        return "GET", f"/portfolio/trades?uid={uid}", None
+    if kind == "chart-data":
+        return "GET", f"/portfolio/chart-data?uid={uid}", None
+    if kind == "portfolio-summary":
+        return "GET", f"/portfolio/summary?uid={uid}", None
+    raise ValueError(f"Unknown endpoint kind {kind}")
+
+
+def sign_in(app, uids):
+    """uid -> Authorization header with an app session for that user."""
+    from backend.sessions import issue_session
+    with app.app_context():
+        return {uid: {"Authorization": f"Bearer {issue_session(uid, uid)}"} for uid in uids}
+
+
+def run_load(app, db, uids, mix, total, concurrency, seed):
+    kinds = list(mix)
+    weights = [mix[k] for k in kinds]
+    samples = {k: [] for k in kinds}
+    statuses = {k: {} for k in kinds}
+    lock = threading.Lock()
+    per_worker = [total // concurrency + (1 if i < total % concurrency else 0) for i in range(concurrency)]
+
+    def worker(index):
+        rng = random.Random(seed * 1000 + index)
+        client = app.test_client()
+        local = []
+        for _ in range(per_worker[index]):
+            kind = rng.choices(kinds, weights)[0]
+            uid = rng.choice(list(uids))
+            method, url, body = build_request(kind, rng, uid, db)
+            started = time.perf_counter()
+            resp = client.open(url, method=method, json=body, headers=uids[uid])
+            resp.get_data()
+            local.append((kind, time.perf_counter() - started, resp.status_code))
+        with lock:
+            for kind, elapsed, status in local:
+                samples[kind].append(elapsed)
+                statuses[kind][status] = statuses[kind].get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    wall = time.perf_counter() - started
+    return samples, statuses, wall
+
+
+def summarize(samples, statuses, wall):
+    endpoints = {}
+    for kind, values in samples.items():
+        if not values:
+            continue
+        ms = np.asarray(values) * 1000
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+        endpoints[kind] = {
+            "count": len(values),
+            "throughput": round(len(values) / wall, 2),
+            "mean_ms": round(float(ms.mean()), 3),
+            "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3),
+            "p99_ms": round(float(p99), 3),
+            "max_ms": round(float(ms.max()), 3),
+            "statuses": {str(k): v for k, v in sorted(statuses[kind].items())},
+        }
+    total = sum(e["count"] for e in endpoints.values())
+    return {
+        "wall_seconds": round(wall, 3),
+        "total_requests": total,
+        "throughput": round(total / wall, 2) if wall else 0.0,
+        "endpoints": endpoints,
+    }
+
+
+def print_report(report):
+    print(f"{'endpoint':<18}{'count':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}  statuses")
+    for kind, e in report["endpoints"].items():
+        print(f"{kind:<18}{e['count']:>7}{e['throughput']:>9.1f}{e['p50_ms']:>9.2f}"
+              f"{e['p95_ms']:>9.2f}{e['p99_ms']:>9.2f}  {e['statuses']}")
+    print(f"total {report['total_requests']} requests in {report['wall_seconds']}s "
+          f"({report['throughput']} req/s)")
+
+
+def compare(old_path, new_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    print(f"{old.get('git', '?')} -> {new.get('git', '?')}")
+    print(f"{'endpoint':<18}{'p50 ms':>22}{'p95 ms':>22}{'p99 ms':>22}{'req/s':>22}")
+    for kind, n in new["report"]["endpoints"].items():
+        o = old["report"]["endpoints"].get(kind)
+        if o is None:
+            continue
+        cells = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "throughput"):
+            delta = (n[key] - o[key]) / o[key] * 100 if o[key] else 0.0
+            cells.append(f"{o[key]:.1f}->{n[key]:.1f} ({delta:+.0f}%)")
+        print(f"{kind:<18}" + "".join(f"{c:>22}" for c in cells))
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, stderr=subprocess.DEVNULL, text=True,
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_mix(text):
+    if not text:
+        return dict(DEFAULT_MIX)
+    mix = {}
+    for part in text.split(","):
+        kind, _, weight = part.partition("=")
+        if kind.strip() not in DEFAULT_MIX:
+            raise SystemExit(f"Unknown endpoint in --mix: {kind}")
+        mix[kind.strip()] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--warmup", type=int, default=200, help="requests run before measuring")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--trades-per-user", type=int, default=200)
+    parser.add_argument("--mix", default="", help="e.g. stock-price=5,update_sell=1 (default: built-in mix)")
+    parser.add_argument("--firestore-latency-ms", type=float, default=0.0)
+    parser.add_argument("--market-latency-ms", type=float, default=0.0)
+    parser.add_argument("--market-error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=None, help="results JSON path (default bench/results/<time>-<git>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files and exit")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    logging.disable(logging.WARNING)
+    from backend.market_data import SyntheticProvider
+
+    mix = parse_mix(args.mix)
+    db = FakeFirestore(latency_ms=args.firestore_latency_ms, seed=args.seed)
+    provider = SyntheticProvider(seed=args.seed, latency_ms=args.market_latency_ms,
+                                 error_rate=args.market_error_rate)
+
+    with ExitStack() as stack, tempfile.TemporaryDirectory() as bar_dir:
+        app = boot_app(stack, db, provider, bar_dir)
+        uids = sign_in(app, seed_users(db, args.users, args.trades_per_user, random.Random(args.seed)))
+        if args.warmup:
+            run_load(app, db, uids, mix, args.warmup, args.concurrency, args.seed + 1)
+        ops_before = db.ops
+        samples, statuses, wall = run_load(app, db, uids, mix, args.requests, args.concurrency, args.seed)
+        report = summarize(samples, statuses, wall)
+        report["firestore_ops"] = db.ops - ops_before
+
+    print_report(report)
+    result = {
+        "git": git_revision(),
+        "timestamp": dt.datetime.now(dt.timezone.utc).isoformat(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("compare", "output")} | {"mix": mix},
+        "report": report,
+    }
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"{dt.datetime.now():%Y%m%d-%H%M%S}-{result['git'] or 'nogit'}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,21 @@
 const originalFetch = window.fetch;
 window.fetch = function (url, options = {}) {
   const token = localStorage.getItem("jwt");
+  if (!token) {
+    return originalFetch(url, options);
+  }
 
   options.headers = {
     ...(options.headers || {}),
     Authorization: "Bearer " + token
   };
 
-  return originalFetch(url, options);
+  return originalFetch(url, options).then((res) => {
+    // The session from /auth/login has expired; sign in again for a new one
+    if (res.status === 401) {
+      localStorage.removeItem("jwt");
+      window.location.href = "/auth/login";
+    }
+    return res;
+  });
 };
-
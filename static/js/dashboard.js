@@ -182,7 +182,24 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   }
 
-  // Fetch and update live prices
+  // Apply a batch of price updates to the watchlist cards
+  function applyPriceUpdates(priceData) {
+    priceData.forEach((priceInfo) => {
+      const card = watchlistContainer.querySelector(`[data-symbol="${priceInfo.symbol}"]`);
+      if (card) {
+        // Update the stock data
+        const stockIndex = watchlistStocks.findIndex(s => s.symbol === priceInfo.symbol);
+        if (stockIndex !== -1) {
+          watchlistStocks[stockIndex].price = priceInfo.price;
+          watchlistStocks[stockIndex].change = priceInfo.change;
+          watchlistStocks[stockIndex].changePercent = priceInfo.changePercent;
+        }
+        updateStockCard(card, priceInfo);
+      }
+    });
+  }
+
+  // Fetch and update live prices (polling fallback)
   async function updateLivePrices() {
     if (watchlistStocks.length === 0) return;
 
@@ -192,24 +209,48 @@ document.addEventListener("DOMContentLoaded", () => {
         method: "POST",
         body: JSON.stringify({ symbols })
       });
+      applyPriceUpdates(priceData);
+    } catch (err) {
+      console.error("Error updating live prices:", err.status || err.message, err.body || "");
+    }
+  }
+
+  // Subscribe to server-pushed prices; fall back to polling without EventSource
+  // or when the server refuses the stream (503 at its per-worker cap)
+  let priceStream = null;
+  function startLivePrices() {
+    if (priceStream) priceStream.close();
+    if (priceUpdateInterval) clearInterval(priceUpdateInterval);
+    if (watchlistStocks.length === 0) return;
 
-      // Update each stock card
-      priceData.forEach((priceInfo) => {
-        const card = watchlistContainer.querySelector(`[data-symbol="${priceInfo.symbol}"]`);
-        if (card) {
-          // Update the stock data
-          const stockIndex = watchlistStocks.findIndex(s => s.symbol === priceInfo.symbol);
-          if (stockIndex !== -1) {
-            watchlistStocks[stockIndex].price = priceInfo.price;
-            watchlistStocks[stockIndex].change = priceInfo.change;
-            watchlistStocks[stockIndex].changePercent = priceInfo.changePercent;
-          }
-          updateStockCard(card, priceInfo);
+    if (window.EventSource) {
+      const symbols = watchlistStocks.map(s => s.symbol).join(",");
+      priceStream = new EventSource(`/dashboard/stream?symbols=${encodeURIComponent(symbols)}`);
+      priceStream.addEventListener("quotes", (e) => {
+        try {
+          applyPriceUpdates(JSON.parse(e.data));
+        } catch (err) {
+          console.error("Bad price stream event:", err);
         }
       });
-    } catch (err) {
-      console.error("Error updating live prices:", err.status || err.message, err.body || "");
+      priceStream.addEventListener("error", () => {
+        // A refused stream is CLOSED for good; a dropped one reconnects on its own
+        if (priceStream.readyState === EventSource.CLOSED) {
+          priceStream = null;
+          startPolling();
+        }
+      });
+      return;
     }
+
+    startPolling();
+  }
+
+  function startPolling() {
+    if (priceUpdateInterval) clearInterval(priceUpdateInterval);
+    priceUpdateInterval = setInterval(updateLivePrices, 10000);
+    // Initial live price update after 2 seconds
+    setTimeout(updateLivePrices, 2000);
   }
 
   // Load and render watchlist
@@ -236,14 +277,8 @@ document.addEventListener("DOMContentLoaded", () => {
           watchlistContainer.appendChild(card);
         });
 
-        // Start live price updates every 10 seconds
-        if (priceUpdateInterval) {
-          clearInterval(priceUpdateInterval);
-        }
-        priceUpdateInterval = setInterval(updateLivePrices, 10000);
-        
-        // Initial live price update after 2 seconds
-        setTimeout(updateLivePrices, 2000);
+        // Start live price updates
+        startLivePrices();
       }
     } catch (err) {
       console.error("Error fetching watchlist:", err.status || err.message, err.body || "");
@@ -265,8 +300,11 @@ document.addEventListener("DOMContentLoaded", () => {
     }
   })();
 
-  // Cleanup interval on page unload
+  // Cleanup stream/interval on page unload
   window.addEventListener("beforeunload", () => {
+    if (priceStream) {
+      priceStream.close();
+    }
     if (priceUpdateInterval) {
       clearInterval(priceUpdateInterval);
     }
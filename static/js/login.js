@@ -37,6 +37,7 @@
 
       const data = await res.json();
       if (!res.ok) throw data;
+      localStorage.setItem("jwt", data.token);
       
       window.location.href = "/dashboard";
     } catch (err) {
@@ -1,3 +1,5 @@
+import { fetchSeries, formatTimes } from "./series.js";
+
 const uid = localStorage.getItem("uid");
 
 // Initialize chart
@@ -6,12 +8,17 @@ let portfolioChart = null;
 // Fetch and render chart data
 async function renderChart() {
   try {
-    const response = await fetch(`/portfolio/chart-data?uid=${uid}`);
-    const chartData = await response.json();
-
     const ctx = document.getElementById('portfolioChart');
     if (!ctx) return;
 
+    const maxPoints = Math.max(100, ctx.clientWidth || 0);
+    const series = await fetchSeries(`/portfolio/chart-data?uid=${uid}&maxPoints=${maxPoints}&format=compact`);
+    const chartData = series.columns ? {
+      labels: formatTimes(series.t, { month: "short", day: "2-digit", hour: "2-digit", minute: "2-digit", hourCycle: "h23" }),
+      buyData: series.columns.buyData,
+      sellData: series.columns.sellData,
+    } : series;
+
     if (portfolioChart) {
       portfolioChart.destroy();
     }
@@ -107,99 +114,111 @@ async function renderChart() {
   }
 }
 
-// Fetch live prices for stocks
-async function fetchLivePrices(symbols) {
-  try {
-    const response = await fetch("/dashboard/live-prices", {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-        "Authorization": `Bearer ${localStorage.getItem("token")}`
-      },
-      body: JSON.stringify({ symbols })
-    });
-    const data = await response.json();
-    const priceMap = {};
-    data.forEach(item => {
-      priceMap[item.symbol] = item.price || 0;
-    });
-    return priceMap;
-  } catch (error) {
-    console.error("Error fetching live prices:", error);
-    return {};
+// Re-render live price, market value and P/L cells for a list of quotes
+function applyQuotes(holdings, quotes) {
+  quotes.forEach((quote) => {
+    const holding = holdings[quote.symbol];
+    if (!holding || !quote.price) return;
+    holding.livePrice = quote.price;
+
+    const row = document.querySelector(`.table-Row[data-symbol="${quote.symbol}"]`);
+    if (!row) return;
+    const marketValue = holding.livePrice * holding.quantity;
+    const pl = marketValue - holding.totalCost;
+    row.querySelector(".liveprice").textContent = `₹${holding.livePrice.toFixed(2)}`;
+    row.querySelector(".total").textContent = `₹${marketValue.toFixed(2)}`;
+    const plCell = row.querySelector(".pl");
+    plCell.textContent = `${pl >= 0 ? "+" : ""}₹${pl.toFixed(2)}`;
+    plCell.className = `pl ${pl >= 0 ? "positive" : "negative"}`;
+  });
+
+  let total = 0;
+  Object.values(holdings).forEach((h) => {
+    if (h.quantity > 0) total += h.livePrice * h.quantity;
+  });
+  document.getElementById("total-value").textContent = `${total.toFixed(2)}`;
+}
+
+// Poll /dashboard/live-prices every 10 s (no EventSource, or the stream was refused)
+function pollLivePrices(holdings, symbols) {
+  const update = async () => {
+    try {
+      const res = await fetch("/dashboard/live-prices", {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ symbols }),
+      });
+      if (res.ok) applyQuotes(holdings, await res.json());
+    } catch (err) {
+      console.error("Error updating live prices:", err);
+    }
+  };
+  update();
+  setInterval(update, 10000);
+}
+
+// Subscribe to pushed quotes; fall back to polling when the stream is
+// unavailable or refused (503 past the server's per-worker stream cap)
+function subscribeLivePrices(holdings, symbols) {
+  if (symbols.length === 0) return;
+  if (!window.EventSource) {
+    pollLivePrices(holdings, symbols);
+    return;
   }
+
+  const stream = new EventSource(`/dashboard/stream?symbols=${encodeURIComponent(symbols.join(","))}`);
+  stream.addEventListener("quotes", (e) => {
+    try {
+      applyQuotes(holdings, JSON.parse(e.data));
+    } catch (err) {
+      console.error("Bad price stream event:", err);
+    }
+  });
+  stream.addEventListener("error", () => {
+    // A refused stream is CLOSED for good; a dropped one reconnects on its own
+    if (stream.readyState === EventSource.CLOSED) {
+      pollLivePrices(holdings, symbols);
+    }
+  });
+  window.addEventListener("beforeunload", () => stream.close());
 }
 
-// Main portfolio rendering
-fetch(`/portfolio/trades?uid=${uid}`)
+// Main portfolio rendering: holdings valued server-side in one call
+fetch(`/portfolio/summary?uid=${uid}`)
   .then((res) => res.json())
-  .then(async (data) => {
+  .then((data) => {
     const tableBody = document.getElementById("table-body");
-    let totalValue = 0;
-
-    // Map symbol to holdings
     const holdings = {};
 
-    // Go through all trades to calculate net quantity and avg buy price
-    data.forEach((trade) => {
-      const symbol = trade.symbol;
-      const quantity = trade.quantity;
-
-      if (!holdings[symbol]) {
-        holdings[symbol] = {
-          quantity: 0,
-          totalCost: 0,
-          livePrice: trade.live_price || trade.livePrice || 0,
-        };
-      }
-
-      if (trade.buy) {
-        holdings[symbol].quantity += quantity;
-        holdings[symbol].totalCost += trade.buy_price * quantity;
-      } else if (trade.sell) {
-        holdings[symbol].quantity -= trade.oldQuantity || trade.quantity; // Reduce by amount sold
-        holdings[symbol].totalCost -= trade.price * (trade.oldQuantity || trade.quantity);
-      }
-    });
-
-    // Get all symbols for live price fetch
-    const symbols = Object.keys(holdings).filter(symbol => holdings[symbol].quantity > 0);
-
-    // Fetch live prices
-    const livePrices = await fetchLivePrices(symbols);
-
-    // Update live prices in holdings
-    symbols.forEach(symbol => {
-      if (livePrices[symbol] && livePrices[symbol] > 0) {
-        holdings[symbol].livePrice = livePrices[symbol];
-      }
-    });
-
-    // Render current holdings
-    for (const [symbol, holdingData] of Object.entries(holdings)) {
-      if (holdingData.quantity <= 0) continue; // Don't render sold-out stocks
-
-      const avgBuyPrice = holdingData.totalCost / holdingData.quantity;
-      const marketValue = holdingData.livePrice * holdingData.quantity;
-      const pl = marketValue - holdingData.totalCost;
-
-      totalValue += marketValue;
+    data.positions.forEach((position) => {
+      const livePrice = position.price || 0;
+      const marketValue = position.marketValue || 0;
+      const pl = position.unrealizedPL || 0;
+      holdings[position.symbol] = {
+        quantity: position.quantity,
+        totalCost: position.costBasis,
+        livePrice: livePrice,
+      };
 
       const row = document.createElement("div");
       row.className = "table-Row";
+      row.dataset.symbol = position.symbol;
       const plClass = pl >= 0 ? "positive" : "negative";
       row.innerHTML = `
-        <div class="stock">${symbol}</div>
-        <div class="quantity">${holdingData.quantity}</div>
-        <div class="price">₹${avgBuyPrice.toFixed(2)}</div>
-        <div class="liveprice">₹${holdingData.livePrice.toFixed(2)}</div>
+        <div class="stock">${position.symbol}</div>
+        <div class="quantity">${position.quantity}</div>
+        <div class="price">₹${position.avgCost.toFixed(2)}</div>
+        <div class="liveprice">₹${livePrice.toFixed(2)}</div>
         <div class="total">₹${marketValue.toFixed(2)}</div>
         <div class="pl ${plClass}">${pl >= 0 ? "+" : ""}₹${pl.toFixed(2)}</div>
       `;
       tableBody.appendChild(row);
-    }
+    });
+
+    document.getElementById("total-value").textContent = `${data.totals.marketValue.toFixed(2)}`;
 
-    document.getElementById("total-value").textContent = `${totalValue.toFixed(2)}`;
+    // Keep live prices current via the server-pushed stream
+    subscribeLivePrices(holdings, Object.keys(holdings));
 
     // Render chart after data is loaded
     renderChart();
@@ -0,0 +1,42 @@
+// ===================== COMPACT SERIES =====================
+// Decoder for ?format=compact history responses (see backend/charts.py):
+// a JSON header line, int32 time deltas, then one float32 array per column.
+
+// Fetch `url` and return {t: epoch seconds, columns: {name: values}, ...header},
+// or the parsed JSON body when the server answered with JSON (errors).
+export async function fetchSeries(url) {
+  const res = await fetch(url);
+  const type = res.headers.get("Content-Type") || "";
+  if (!type.startsWith("application/octet-stream")) {
+    return res.json();
+  }
+
+  const buf = await res.arrayBuffer();
+  const bytes = new Uint8Array(buf);
+  const headerEnd = bytes.indexOf(10);
+  const header = JSON.parse(new TextDecoder().decode(bytes.subarray(0, headerEnd)));
+  const n = header.n;
+  let offset = headerEnd + 1;
+
+  const deltas = new Int32Array(buf, offset, n);
+  offset += 4 * n;
+  const t = new Array(n);
+  let acc = header.t0;
+  for (let i = 0; i < n; i++) {
+    acc += deltas[i];
+    t[i] = acc;
+  }
+
+  const columns = {};
+  for (const name of header.columns) {
+    columns[name] = Array.from(new Float32Array(buf, offset, n));
+    offset += 4 * n;
+  }
+  return { ...header, t, columns };
+}
+
+// Chart labels for epoch seconds, formatted by `options` (Intl.DateTimeFormat) in `timeZone`.
+export function formatTimes(t, options, timeZone) {
+  const format = new Intl.DateTimeFormat("en-CA", { ...options, timeZone: timeZone || undefined });
+  return t.map((seconds) => format.format(new Date(seconds * 1000)));
+}
@@ -1,6 +1,8 @@
 // ===================== TRADE PAGE JS =====================
 // Single-page trade: sidebar stock list + inline chart & buy/sell
 
+import { fetchSeries, formatTimes } from "./series.js";
+
 const uid = localStorage.getItem("uid");
 const token = localStorage.getItem("token");
 
@@ -91,22 +93,20 @@ async function loadStocks() {
 
 async function pollForFullList() {
   try {
+    // Conditional GET: the browser revalidates with the ETag and reuses its copy on 304
     const res = await fetch("/trade/stocks");
     const data = await res.json();
     const stocks = data.stocks || [];
 
     if (stocks.length > allStocks.length) {
       allStocks = stocks;
-      // Re-apply search filter
-      const query = searchInput.value.trim().toLowerCase();
-      if (query) {
-        filteredStocks = allStocks.filter(s =>
-          s.symbol.toLowerCase().includes(query) || s.name.toLowerCase().includes(query)
-        );
+      // Re-run an active search against the bigger list
+      if (searchInput.value.trim()) {
+        searchStocks(searchInput.value.trim());
       } else {
         filteredStocks = allStocks;
+        renderStockList(filteredStocks);
       }
-      renderStockList(filteredStocks);
     }
 
     if (data.complete) {
@@ -120,6 +120,33 @@ async function pollForFullList() {
   }
 }
 
+// ---- Server-side Search ----
+let searchTimer = null;
+let searchSeq = 0;
+
+async function searchStocks(query, cursor = null) {
+  const seq = ++searchSeq;
+  try {
+    const params = new URLSearchParams({ q: query, limit: 50 });
+    if (cursor) params.set("cursor", cursor);
+    const res = await fetch(`/trade/stocks/search?${params}`);
+    const data = await res.json();
+    if (seq !== searchSeq) return; // a newer keystroke already answered
+
+    filteredStocks = cursor ? filteredStocks.concat(data.results || []) : (data.results || []);
+    renderStockList(filteredStocks);
+    if (data.nextCursor) {
+      const more = document.createElement("div");
+      more.className = "stock-list-loader stock-list-more";
+      more.textContent = `Show more (${filteredStocks.length} of ${data.total})`;
+      more.addEventListener("click", () => searchStocks(query, data.nextCursor));
+      stockListEl.appendChild(more);
+    }
+  } catch (e) {
+    console.error("Error searching stocks:", e);
+  }
+}
+
 // ---- Render Stock List ----
 function renderStockList(stocks) {
   stockListEl.innerHTML = "";
@@ -145,15 +172,15 @@ function renderStockList(stocks) {
 // ---- Search/Filter ----
 if (searchInput) {
   searchInput.addEventListener("input", () => {
-    const query = searchInput.value.trim().toLowerCase();
+    const query = searchInput.value.trim();
+    clearTimeout(searchTimer);
     if (!query) {
+      searchSeq++;
       filteredStocks = allStocks;
-    } else {
-      filteredStocks = allStocks.filter(s =>
-        s.symbol.toLowerCase().includes(query) || s.name.toLowerCase().includes(query)
-      );
+      renderStockList(filteredStocks);
+      return;
     }
-    renderStockList(filteredStocks);
+    searchTimer = setTimeout(() => searchStocks(query), 150);
   });
 }
 
@@ -238,22 +265,27 @@ async function loadChart(symbol, period) {
   chartLoader.classList.remove("hidden");
 
   try {
-    const res = await fetch(`/api/stock-data?symbol=${symbol}&period=${period}`);
-    const data = await res.json();
+    const ctx = document.getElementById("stockChart");
+    // About one point per pixel is all the canvas can show
+    const maxPoints = Math.max(100, ctx.clientWidth || 0);
+    const data = await fetchSeries(
+      `/api/stock-data?symbol=${symbol}&period=${period}&maxPoints=${maxPoints}&format=compact`
+    );
 
     if (data.error) {
       chartLoader.innerHTML = `<span style="color: rgba(255,255,255,0.4);">No chart data available</span>`;
       return;
     }
 
-    const ctx = document.getElementById("stockChart");
-
     if (stockChart) {
       stockChart.destroy();
     }
 
     // Determine gradient color based on price trend
-    const prices = data.prices;
+    const prices = data.columns.prices;
+    const labels = ["1d", "5d"].includes(period)
+      ? formatTimes(data.t, { hour: "2-digit", minute: "2-digit", hourCycle: "h23" }, data.tz)
+      : formatTimes(data.t, { year: "numeric", month: "2-digit", day: "2-digit" }, data.tz);
     const isUp = prices.length >= 2 && prices[prices.length - 1] >= prices[0];
     const lineColor = isUp ? "rgba(76, 175, 80, 1)" : "rgba(244, 67, 54, 1)";
     const fillColor = isUp ? "rgba(76, 175, 80, 0.08)" : "rgba(244, 67, 54, 0.08)";
@@ -261,7 +293,7 @@ async function loadChart(symbol, period) {
     stockChart = new Chart(ctx, {
       type: "line",
       data: {
-        labels: data.labels,
+        labels: labels,
         datasets: [{
           label: `${symbol} Price (₹)`,
           data: prices,
@@ -438,19 +470,9 @@ if (btnSell) {
 
     try {
       // First check holdings
-      const tradesRes = await fetch(`/portfolio/trades?uid=${uid}`);
-      const trades = await tradesRes.json();
-
-      let ownedQuantity = 0;
-      trades.forEach(trade => {
-        if (trade.symbol === selectedStock.symbol) {
-          if (trade.sell) {
-            ownedQuantity -= trade.quantity;
-          } else if (trade.buy) {
-            ownedQuantity += trade.quantity;
-          }
-        }
-      });
+      const positionsRes = await fetch(`/portfolio/positions?uid=${uid}`);
+      const positions = (await positionsRes.json()).positions || {};
+      const ownedQuantity = (positions[selectedStock.symbol] || {}).quantity || 0;
 
       if (qty > ownedQuantity) {
         showToast(`Not enough shares. You own ${ownedQuantity} of ${selectedStock.symbol}`, "error");
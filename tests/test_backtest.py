@@ -0,0 +1,91 @@
+"""
+The vectorized backtest simulation against a plain bar-by-bar loop, on a
+fixed synthetic daily series.
+"""
+import math
+
+import numpy as np
+import pytest
+
+from backend import backtest
+from backend.bars import _frame_to_bars
+from backend.market_data import SyntheticProvider
+
+CASH = 10000.0
+
+
+@pytest.fixture(scope="module")
+def daily():
+    provider = SyntheticProvider(seed=7)
+    hist = provider.history("AAPL", period="5y", interval="1d")
+    return _frame_to_bars(hist), str(hist.index.tz)
+
+
+def bar_by_bar(close, target, cash):
+    """Long/flat sleeve stepped one bar at a time: the loop simulate() replaces."""
+    shares, held, trades, equity = 0.0, None, [], []
+    previous = 0.0
+    for i, price in enumerate(close):
+        if target[i] > previous:
+            quantity = math.floor(cash / price * 1e6) / 1e6
+            if quantity > 0:
+                cash -= quantity * price
+                shares, held = quantity, i
+        elif target[i] < previous and held is not None:
+            cash += shares * price
+            trades.append((held, i, shares))
+            shares, held = 0.0, None
+        previous = target[i]
+        equity.append(cash + shares * price)
+    if held is not None:
+        trades.append((held, None, shares))
+    return np.array(equity), trades
+
+
+def assert_same(result, expected):
+    equity, trades = result
+    expected_equity, expected_trades = expected
+    np.testing.assert_allclose(equity, expected_equity, rtol=1e-9)
+    assert [(i, j) for i, j, _ in trades] == [(i, j) for i, j, _ in expected_trades]
+    np.testing.assert_allclose([q for _, _, q in trades], [q for _, _, q in expected_trades], rtol=1e-12)
+
+
+@pytest.mark.parametrize("strategy, params", [
+    ("buy_hold", {}),
+    ("sma_cross", {"fast": 20, "slow": 50}),
+    ("sma_cross", {"fast": 5, "slow": 15}),
+    ("rsi", {"period": 14, "lower": 30, "upper": 70}),
+    ("rsi", {"period": 5, "lower": 40, "upper": 60}),
+])
+def test_strategy_matches_bar_by_bar(daily, strategy, params):
+    bars, tz = daily
+    close = np.array(bars["close"])
+    first = 60
+    signal_lines = backtest.lines("TEST-BT", bars, tz, strategy, params)
+    job = (np.array(bars["t"]), close, first, strategy, params, CASH, signal_lines)
+    equity, trades, _ = backtest._run_job(job)
+
+    target = backtest.signals(strategy, close, params, signal_lines)
+    if strategy != "buy_hold":
+        target = np.r_[0.0, target[:-1]]
+    target[:first] = 0.0
+    expected = bar_by_bar(close[first:], target[first:], CASH)
+
+    assert_same((equity, trades), expected)
+    if strategy != "buy_hold":
+        assert len(trades) > 1
+
+
+def test_simulate_open_trade_and_unaffordable_entry(daily):
+    bars, _ = daily
+    close = np.array(bars["close"][:200])
+    target = np.zeros(len(close))
+    target[10:40] = 1.0
+    target[70:90] = 1.0
+    target[150:] = 1.0     # still held at the last bar
+    assert_same(backtest.simulate(close, target, CASH), bar_by_bar(close, target, CASH))
+
+    # Too little cash for even a millionth of a share: no trades, flat equity
+    equity, trades = backtest.simulate(close, target, 1e-9)
+    assert trades == []
+    np.testing.assert_allclose(equity, 1e-9)
@@ -0,0 +1,69 @@
+"""
+Memoized indicator series: stepping only the new bars must give the same
+values as computing over every bar.
+"""
+import numpy as np
+import pytest
+
+from backend import indicators
+from backend.bars import _frame_to_bars
+from backend.market_data import SyntheticProvider
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(indicators, "_cache", indicators.OrderedDict())
+
+
+@pytest.fixture(scope="module")
+def stored():
+    provider = SyntheticProvider(seed=11)
+    out = {}
+    for interval, period in (("1d", "2y"), ("5m", "5d")):
+        hist = provider.history("MSFT", period=period, interval=interval)
+        out[interval] = (_frame_to_bars(hist), str(hist.index.tz))
+    return out
+
+
+def full(interval, name, params, bars, tz):
+    """The series computed from scratch, bypassing the memo."""
+    entry, how = indicators._extend(None, bars, indicators._step(name, interval), params, tz)
+    assert how == "full"
+    return entry["values"]
+
+
+def assert_series_equal(got, expected):
+    assert got.keys() == expected.keys()
+    for key in expected:
+        np.testing.assert_allclose(got[key], expected[key], rtol=1e-10, atol=1e-10, equal_nan=True)
+
+
+CASES = [(name, defaults) for name, (defaults, _, _) in indicators.INDICATORS.items()]
+
+
+@pytest.mark.parametrize("interval", ["1d", "5m"])
+@pytest.mark.parametrize("name, params", CASES)
+def test_incremental_equals_full(stored, interval, name, params):
+    bars, tz = stored[interval]
+    n = len(bars)
+    before = indicators.INDICATOR_STATS["incremental"]
+    for stop in (n - 40, n - 39, n - 7, n):   # new bars arriving in uneven batches
+        got = indicators.series("MSFT", interval, name, params, bars=bars[:stop], tz=tz)
+        assert_series_equal(got, full(interval, name, params, bars[:stop], tz))
+    assert indicators.INDICATOR_STATS["incremental"] - before == 3
+
+
+@pytest.mark.parametrize("name, params", CASES)
+def test_overwritten_newest_bar(stored, name, params):
+    bars, tz = stored["1d"]
+    bars = bars.copy()
+    indicators.series("MSFT", "1d", name, params, bars=bars, tz=tz)
+
+    # The forming bar moves, then a new bar lands after it
+    bars["close"][-1] *= 1.03
+    bars["high"][-1] = max(bars["high"][-1], bars["close"][-1])
+    grown = np.concatenate([bars, bars[-1:]])
+    grown["t"][-1] += 86400
+    for current in (bars, grown):
+        got = indicators.series("MSFT", "1d", name, params, bars=current, tz=tz)
+        assert_series_equal(got, full("1d", name, params, current, tz))